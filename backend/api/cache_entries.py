@@ -0,0 +1,26 @@
+from __future__ import annotations
+from typing import Any
+
+from core.models import Location, WeatherCache
+from core.utils import enrich_weather
+from .compression import deflate_blocks
+from .responses import body_etag, dumps
+
+
+def new_entry(loc: Location, cache_type: str, value: Any, **data_fields: Any) -> WeatherCache:
+    """Unsaved cache entry for an upstream result: enriched, serialized and compressed.
+
+    `value` is what the endpoint sends (current conditions or the forecast
+    days); `data_fields` fill the decoded JSON columns.
+    """
+    # Derived metrics are computed once here and stored with the entry
+    enrich_weather(value)
+    body = dumps(value)
+    return WeatherCache(
+        location=loc,
+        cache_type=cache_type,
+        response_body=body,
+        response_gzip=deflate_blocks(body),
+        etag=body_etag(body),
+        **data_fields,
+    )
@@ -0,0 +1,57 @@
+from __future__ import annotations
+import struct
+import zlib
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse
+from django.middleware.gzip import re_accepts_gzip
+
+from .responses import CONTENT_TYPE, envelope_parts
+
+
+# Cached bodies are compressed once, at cache-fill time, into raw deflate
+# blocks ending on a full flush (no back-references past the block boundary).
+# Per request only the small envelope head/tail are compressed and the three
+# block runs are concatenated into a single gzip member, the same splicing
+# technique pigz uses for parallel compression.
+GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+
+
+def accepts_gzip(request: HttpRequest) -> bool:
+    return bool(re_accepts_gzip.search(request.META.get('HTTP_ACCEPT_ENCODING', '')))
+
+
+def deflate_blocks(body: bytes) -> Optional[bytes]:
+    """Precompress a cached body, or None when it is below the size threshold."""
+    if len(body) < settings.API_COMPRESS_MIN_BYTES:
+        return None
+    compressor = zlib.compressobj(settings.API_COMPRESS_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(body) + compressor.flush(zlib.Z_FULL_FLUSH)
+
+
+def _deflate(data: bytes, mode: int) -> bytes:
+    compressor = zlib.compressobj(settings.API_COMPRESS_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(mode)
+
+
+def gzip_splice(head: bytes, body: bytes, blocks: bytes, tail: bytes) -> bytes:
+    """Build a gzip stream of head + body + tail reusing `blocks` for body."""
+    crc = zlib.crc32(tail, zlib.crc32(body, zlib.crc32(head)))
+    size = (len(head) + len(body) + len(tail)) & 0xFFFFFFFF
+    return b''.join((
+        GZIP_HEADER,
+        _deflate(head, zlib.Z_SYNC_FLUSH),
+        blocks,
+        _deflate(tail, zlib.Z_FINISH),
+        struct.pack('<II', crc, size),
+    ))
+
+
+def gzip_success_bytes(key: str, body: bytes, blocks: bytes, meta: Optional[Dict[str, Any]] = None,
+                       status: int = 200) -> HttpResponse:
+    """Gzip-encoded counterpart of `success_bytes` for precompressed bodies."""
+    head, tail = envelope_parts(key, meta)
+    resp = HttpResponse(gzip_splice(head, body, blocks, tail), status=status, content_type=CONTENT_TYPE)
+    resp['Content-Encoding'] = 'gzip'
+    return resp
@@ -1,7 +1,20 @@
 from __future__ import annotations
+import json
+import logging
 import uuid
-from typing import Callable
+from time import perf_counter
+from typing import Any, Callable, Iterable, Iterator
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
 from django.http import HttpRequest, HttpResponse
+from django.middleware.gzip import GZipMiddleware
+from django.utils.module_loading import import_string
+
+from core import metrics, profiling, routers, timing
+
+
+timing_logger = logging.getLogger('api.timing')
 
 
 class SessionMiddleware:
@@ -47,3 +60,247 @@ class ApiKeyRequiredMiddleware:
         return self.get_response(request)
 
 
+class JSONCompressionMiddleware(GZipMiddleware):
+    """Gzip JSON API responses above `API_COMPRESS_MIN_BYTES`.
+
+    Static files are already precompressed by WhiteNoise and weather cache
+    hits arrive gzip-encoded from the view; both are left untouched.
+    """
+
+    def process_response(self, request: HttpRequest, response: HttpResponse) -> HttpResponse:
+        if not response.get('Content-Type', '').startswith('application/json'):
+            return response
+        if not response.streaming and len(response.content) < settings.API_COMPRESS_MIN_BYTES:
+            return response
+        return super().process_response(request, response)
+
+
+class ServerTimingMiddleware:
+    """Record per-phase timings and expose them as a `Server-Timing` header.
+
+    Phases come from `core.timing.span` blocks in the views and WeatherService
+    (location, cache, fetch, serialize, one entry per upstream provider) plus
+    `db` for total query time. Each request is also logged as one JSON line on
+    the `api.timing` logger. Removed from the stack unless
+    REQUEST_TIMING_ENABLED is set.
+    """
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
+        if not settings.REQUEST_TIMING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        token = timing.begin()
+        try:
+            with connection.execute_wrapper(self._time_query):
+                response = self.get_response(request)
+        finally:
+            timings = timing.end(token)
+        assert timings is not None
+        total = timings.elapsed()
+        phases = {name: round(seconds * 1000.0, 3) for name, seconds in timings.phases.items()}
+        entries = [f'{name};dur={ms}' for name, ms in phases.items()]
+        entries.append(f'total;dur={round(total * 1000.0, 3)}')
+        response['Server-Timing'] = ', '.join(entries)
+        timing_logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(total * 1000.0, 3),
+            'phases': phases,
+        }))
+        return response
+
+    @staticmethod
+    def _time_query(execute: Callable[..., Any], sql: str, params: Any, many: bool, context: Any) -> Any:
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            timings = timing.current()
+            if timings is not None:
+                timings.add('db', perf_counter() - started)
+
+
+class MetricsMiddleware:
+    """Count requests, latency and database queries per endpoint.
+
+    The endpoint label is the URL pattern name, so `/api/locations/12/` and
+    `/api/locations/13/` share one series. Snapshots for the multi-process
+    exposition are written here, at most once per METRICS_FLUSH_SECONDS.
+    """
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        queries = [0]
+
+        def count_query(execute: Callable[..., Any], sql: str, params: Any, many: bool, context: Any) -> Any:
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        started = perf_counter()
+        with connection.execute_wrapper(count_query):
+            response = self.get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        endpoint = (match.url_name if match else None) or 'unmatched'
+        metrics.API_REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+        metrics.API_LATENCY.observe(perf_counter() - started, endpoint=endpoint)
+        if queries[0]:
+            metrics.DB_QUERIES.inc(queries[0], endpoint=endpoint)
+        metrics.flush()
+        return response
+
+
+class ProfilingMiddleware:
+    """Profile the view of sampled or explicitly requested requests.
+
+    Runs the view under cProfile when `core.profiling.should_profile` says so
+    (PROFILING_SAMPLE_RATE, or a signed `X-Profile` header) and stores the
+    capture; the response names it in `X-Profile-Id`. Must stay last in
+    MIDDLEWARE so every other `process_view` hook (CSRF) still runs first.
+    Removed from the stack unless PROFILING_ENABLED is set.
+    """
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        return self.get_response(request)
+
+    def process_view(self, request: HttpRequest, view_func: Callable[..., HttpResponse],
+                     view_args: Any, view_kwargs: Any) -> Any:
+        if not profiling.should_profile(request.headers.get('X-Profile')):
+            return None
+        def call_view() -> HttpResponse:
+            response = view_func(request, *view_args, **view_kwargs)
+            # DRF responses render lazily; include rendering in the capture
+            if callable(getattr(response, 'render', None)):
+                response.render()
+            return response
+
+        response, profile, seconds = profiling.run(call_view)
+        match = getattr(request, 'resolver_match', None)
+        response['X-Profile-Id'] = profiling.save(profile, (match.url_name if match else None) or request.path, seconds)
+        return response
+
+
+class ReplicaPinMiddleware:
+    """Read-your-writes for replica routing (`core.routers.ReplicaRouter`).
+
+    Unsafe requests (save_location, update_preferences, toggle_favorite, ...)
+    run entirely against the primary, and a successful one sets a short-lived
+    `db_primary` cookie that pins the client's following reads to the primary
+    for REPLICA_PIN_SECONDS, longer than replication lag. Removed from the
+    stack when no replicas are configured.
+    """
+
+    cookie_name = 'db_primary'
+    safe_methods = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
+        if not settings.REPLICA_DATABASES:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        writing = request.method not in self.safe_methods
+        if not writing and self.cookie_name not in request.COOKIES:
+            return self.get_response(request)
+        with routers.pin_primary():
+            response = self.get_response(request)
+        if response.streaming and not getattr(response, 'is_async', False):
+            # Streamed bodies query while the server iterates them, after this returns
+            response.streaming_content = _pinned_stream(response.streaming_content)
+        if writing and response.status_code < 400:
+            response.set_cookie(self.cookie_name, '1', max_age=settings.REPLICA_PIN_SECONDS,
+                                httponly=True, samesite='Lax')
+        return response
+
+
+def _pinned_stream(content: Iterable[bytes]) -> Iterator[bytes]:
+    """Produce each chunk of `content` with reads pinned to the primary."""
+    chunks = iter(content)
+    while True:
+        # Pinned per chunk, so no context token is held across a yield
+        with routers.pin_primary():
+            chunk = next(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+class SiteOnlyMiddleware:
+    """Run SITE_MIDDLEWARE for non-API paths only.
+
+    The wrapped middleware (sessions, CSRF, auth, messages, clickjacking,
+    WhiteNoise) is imported and instantiated on the first request outside
+    API_PATH_PREFIX, so API-only workers never build it. Their
+    `process_view`, `process_exception` and `process_template_response`
+    hooks are forwarded in the order Django itself would call them.
+    """
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
+        self.get_response = get_response
+        self.prefix = settings.API_PATH_PREFIX
+        self._chain: Any = None
+        self._view_hooks: list = []
+        self._exception_hooks: list = []
+        self._template_hooks: list = []
+
+    def _load(self) -> Callable[[HttpRequest], HttpResponse]:
+        if self._chain is None:
+            handler = self.get_response
+            view_hooks, exception_hooks, template_hooks = [], [], []
+            for path in reversed(settings.SITE_MIDDLEWARE):
+                try:
+                    instance = import_string(path)(handler)
+                except MiddlewareNotUsed:
+                    continue
+                if hasattr(instance, 'process_view'):
+                    view_hooks.insert(0, instance.process_view)
+                if hasattr(instance, 'process_exception'):
+                    exception_hooks.append(instance.process_exception)
+                if hasattr(instance, 'process_template_response'):
+                    template_hooks.append(instance.process_template_response)
+                handler = instance
+            self._view_hooks, self._exception_hooks, self._template_hooks = view_hooks, exception_hooks, template_hooks
+            self._chain = handler
+        return self._chain
+
+    def _is_api(self, request: HttpRequest) -> bool:
+        return request.path_info.startswith(self.prefix)
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if self._is_api(request):
+            return self.get_response(request)
+        return self._load()(request)
+
+    def process_view(self, request: HttpRequest, view_func: Callable[..., Any], view_args: Any, view_kwargs: Any) -> Any:
+        if self._is_api(request):
+            return None
+        for hook in self._view_hooks:
+            response = hook(request, view_func, view_args, view_kwargs)
+            if response is not None:
+                return response
+        return None
+
+    def process_exception(self, request: HttpRequest, exception: Exception) -> Any:
+        if self._is_api(request):
+            return None
+        for hook in self._exception_hooks:
+            response = hook(request, exception)
+            if response is not None:
+                return response
+        return None
+
+    def process_template_response(self, request: HttpRequest, response: Any) -> Any:
+        if self._is_api(request):
+            return response
+        for hook in self._template_hooks:
+            response = hook(request, response)
+        return response
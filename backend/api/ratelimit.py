@@ -0,0 +1,127 @@
+from __future__ import annotations
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.request import Request
+
+
+# Per-client token buckets (RATE_LIMIT_ENABLED), one per client IP and one per
+# session cookie, in two lanes: HIT is taken by every weather/search request,
+# MISS additionally by requests about to call an upstream provider, so cache
+# hits can be allowed far more often than upstream work. Buckets live in
+# process memory, or in the Django cache with RATE_LIMIT_BACKEND='cache' (shared
+# when CACHE_URL is; its read-modify-write is not atomic, so limits are
+# approximate under contention). The client IP is REMOTE_ADDR, or with
+# RATE_LIMIT_TRUSTED_PROXIES=N the address N hops from the right end of
+# X-Forwarded-For; entries further left are written by the client and ignored.
+
+HIT = 'hit'
+MISS = 'miss'
+
+# Memory buckets beyond this are pruned of ones that have refilled completely
+_MAX_BUCKETS = 10000
+
+
+class RateLimited(Exception):
+    """Raised when a client has no tokens left in a lane."""
+
+    def __init__(self, lane: str, retry_after: float) -> None:
+        super().__init__(f'Rate limit exceeded ({lane})')
+        self.lane = lane
+        self.retry_after = retry_after
+
+
+Bucket = Tuple[float, float]  # (tokens, updated)
+
+
+def _refill(bucket: Bucket, now: float, rate: float, burst: float) -> float:
+    tokens, updated = bucket
+    return min(burst, tokens + (now - updated) * rate)
+
+
+def _take(buckets: Dict[str, Bucket], keys: List[str], now: float, rate: float, burst: float) -> float:
+    """Take one token from every bucket in `keys`, or none; returns seconds to wait (0 when taken)."""
+    levels = {k: _refill(buckets[k], now, rate, burst) if k in buckets else burst for k in keys}
+    short = min(levels.values())
+    if short < 1.0:
+        return (1.0 - short) / rate
+    for k, tokens in levels.items():
+        buckets[k] = (tokens - 1.0, now)
+    return 0.0
+
+
+class MemoryBuckets:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, Bucket] = {}
+
+    def take(self, keys: List[str], rate: float, burst: float) -> float:
+        now = time.monotonic()
+        with self._lock:
+            wait = _take(self._buckets, keys, now, rate, burst)
+            if len(self._buckets) > _MAX_BUCKETS:
+                full = now - burst / rate
+                self._buckets = {k: b for k, b in self._buckets.items() if b[1] > full}
+        return wait
+
+    def clear(self) -> None:
+        with self._lock:
+            self._buckets.clear()
+
+
+class CacheBuckets:
+    def take(self, keys: List[str], rate: float, burst: float) -> float:
+        now = time.time()
+        cache_keys = {f'ratelimit:{k}': k for k in keys}
+        buckets = {cache_keys[ck]: tuple(b) for ck, b in cache.get_many(list(cache_keys)).items()}
+        wait = _take(buckets, keys, now, rate, burst)
+        if not wait:
+            # Kept until the bucket would be full again
+            cache.set_many({ck: buckets[k] for ck, k in cache_keys.items()}, int(burst / rate) + 1)
+        return wait
+
+
+memory = MemoryBuckets()
+_shared = CacheBuckets()
+
+
+def client_ip(request: Request) -> str:
+    """Address of the peer just outside the trusted proxies."""
+    remote = request.META.get('REMOTE_ADDR', '')
+    trusted = settings.RATE_LIMIT_TRUSTED_PROXIES
+    if trusted <= 0:
+        return remote
+    xff = request.META.get('HTTP_X_FORWARDED_FOR', '')
+    hops = [p.strip() for p in xff.split(',') if p.strip()] + [remote]
+    # Fewer hops than proxies: the request did not come through all of them
+    return hops[max(len(hops) - 1 - trusted, 0)]
+
+
+def client_keys(request: Request, lane: str) -> List[str]:
+    ip = client_ip(request)
+    keys = [f'{lane}:ip:{ip}']
+    session_id = request.COOKIES.get('session_id')
+    if session_id:
+        keys.append(f'{lane}:session:{session_id}')
+    return keys
+
+
+def consume(request: Request, lane: str) -> None:
+    """Take a token in `lane` for the request's client.
+
+    Raises:
+        RateLimited: When the client's IP or session bucket is empty.
+    """
+    if not settings.RATE_LIMIT_ENABLED:
+        return
+    if lane == HIT:
+        rate, burst = settings.RATE_LIMIT_HIT_RATE, settings.RATE_LIMIT_HIT_BURST
+    else:
+        rate, burst = settings.RATE_LIMIT_MISS_RATE, settings.RATE_LIMIT_MISS_BURST
+    buckets = _shared if settings.RATE_LIMIT_BACKEND == 'cache' else memory
+    wait = buckets.take(client_keys(request, lane), rate, burst)
+    if wait:
+        raise RateLimited(lane, wait)
@@ -0,0 +1,127 @@
+from __future__ import annotations
+import hashlib
+import json
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse, HttpResponseBase, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from rest_framework.utils.encoders import JSONEncoder
+
+
+# Byte-level counterparts of `api_response`: the envelope is written around
+# already-serialized values instead of being rebuilt as a dict and handed to
+# DRF's JSONRenderer. Output matches JSONRenderer's compact encoding.
+CONTENT_TYPE = 'application/json'
+ENVELOPE_HEAD = b'{"success":true,"data":'
+ENVELOPE_TAIL = b',"message":null,"error":null}'
+
+
+def dumps(value: Any) -> bytes:
+    """Serialize a value the same way DRF's JSONRenderer does."""
+    text = json.dumps(value, cls=JSONEncoder, ensure_ascii=False, allow_nan=False, separators=(',', ':'))
+    return text.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029').encode('utf-8')
+
+
+def body_etag(body: bytes) -> str:
+    """Strong entity tag (unquoted) for a serialized body."""
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def json_array(items: Iterable[Any]) -> Iterator[bytes]:
+    """Yield a JSON array one serialized element at a time."""
+    yield b'['
+    first = True
+    for item in items:
+        if not first:
+            yield b','
+        first = False
+        yield dumps(item)
+    yield b']'
+
+
+def envelope_parts(key: str, meta: Optional[Dict[str, Any]] = None) -> Tuple[bytes, bytes]:
+    """Bytes before and after the `key` member's value in the success envelope."""
+    head = ENVELOPE_HEAD + b'{' + dumps(key) + b':'
+    tail = (b',' + dumps(meta)[1:-1] if meta else b'') + b'}' + ENVELOPE_TAIL
+    return head, tail
+
+
+def envelope(key: str, value: Iterable[bytes], meta: Optional[Dict[str, Any]] = None) -> Iterator[bytes]:
+    """Yield `{"success":true,"data":{key: <value>, **meta},...}` as byte chunks.
+
+    `value` is an iterable of pre-serialized chunks for the `key` member; `meta`
+    holds the small remaining members and is serialized here.
+    """
+    head, tail = envelope_parts(key, meta)
+    yield head
+    yield from value
+    yield tail
+
+
+def should_stream(item_count: int) -> bool:
+    """Return True when a payload is large enough to be worth streaming."""
+    return item_count >= settings.API_STREAM_MIN_ITEMS
+
+
+def success_bytes(key: str, value: bytes, meta: Optional[Dict[str, Any]] = None, status: int = 200) -> HttpResponse:
+    """Buffered success response around a pre-serialized value."""
+    return HttpResponse(b''.join(envelope(key, (value,), meta)), status=status, content_type=CONTENT_TYPE)
+
+
+def stream_success(key: str, value: Iterable[bytes], meta: Optional[Dict[str, Any]] = None, status: int = 200) -> StreamingHttpResponse:
+    """Streaming success response; `value` chunks are produced lazily."""
+    return StreamingHttpResponse(envelope(key, value, meta), status=status, content_type=CONTENT_TYPE)
+
+
+def _validators(etag: Optional[str], last_modified: Optional[datetime], weak: bool) -> Dict[str, Any]:
+    quoted = quote_etag(etag) if etag else None
+    if quoted and weak:
+        quoted = 'W/' + quoted
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    return {'etag': quoted, 'last_modified': timestamp}
+
+
+def not_modified(request: HttpRequest, etag: Optional[str] = None, last_modified: Optional[datetime] = None,
+                 weak: bool = False) -> Optional[HttpResponse]:
+    """Answer If-None-Match / If-Modified-Since before any body is built.
+
+    Returns a 304 response carrying the validators when the client copy is
+    current, otherwise None.
+    """
+    validators = _validators(etag, last_modified, weak)
+    if not (validators['etag'] or validators['last_modified']):
+        return None
+    resp = get_conditional_response(request, **validators)
+    if resp is not None:
+        set_validators(resp, etag, last_modified, weak)
+    return resp
+
+
+def set_validators(resp: HttpResponseBase, etag: Optional[str] = None, last_modified: Optional[datetime] = None,
+                   weak: bool = False) -> HttpResponseBase:
+    # A content-coded body is not byte-identical to the tagged entity
+    validators = _validators(etag, last_modified, weak or resp.has_header('Content-Encoding'))
+    if validators['etag']:
+        resp['ETag'] = validators['etag']
+    if validators['last_modified'] is not None:
+        resp['Last-Modified'] = http_date(validators['last_modified'])
+    return resp
+
+
+def set_cache_control(resp: HttpResponseBase, max_age: int, shared: bool) -> HttpResponseBase:
+    """Mark a response cacheable for `max_age` seconds.
+
+    Shared responses are `public` with a stale-while-revalidate window so a
+    CDN can keep serving while it refetches; the rest are `private`. Only
+    Accept-Encoding is added to Vary, never Cookie, so entries stay shareable.
+    """
+    if shared:
+        patch_cache_control(resp, public=True, max_age=max_age,
+                            stale_while_revalidate=settings.API_STALE_WHILE_REVALIDATE)
+    else:
+        patch_cache_control(resp, private=True, max_age=max_age)
+    patch_vary_headers(resp, ('Accept-Encoding',))
+    return resp
@@ -119,9 +119,913 @@ class TestPreferencesAPI(TestCase):
         self.assertTrue(resp.json()['success'])
 
     def test_default_preferences(self):
-        # First fetch creates defaults
+        # First fetch returns defaults
         resp = self.client.get('/api/preferences/', {'session_id': self.session_id})
         self.assertEqual(resp.status_code, 200)
         data = resp.json()['data']['preferences']
         self.assertIn(data['temperature_unit'], ['C', 'F'])
 
+    def test_get_does_not_write(self):
+        from django.core.cache import cache
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        cache.clear()
+        self.client.get('/api/preferences/', {'session_id': self.session_id})
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get('/api/preferences/', {'session_id': self.session_id})
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(resp.json()['data']['preferences']['theme'], 'auto')
+        self.assertFalse(UserPreferences.objects.exists())
+
+        payload = {'session_id': self.session_id, 'theme': 'dark'}
+        self.client.post('/api/preferences/update/', data=json.dumps(payload), content_type='application/json')
+        self.assertEqual(UserPreferences.objects.get().theme, 'dark')
+        resp = self.client.get('/api/preferences/', {'session_id': self.session_id})
+        self.assertEqual(resp.json()['data']['preferences']['theme'], 'dark')
+
+    def test_update_ignores_stale_context(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        self.client.get('/api/preferences/', {'session_id': self.session_id})  # caches "no row"
+        # Saved through another worker, whose invalidation this cache never saw
+        saved = UserPreferences.objects.create(session_id=self.session_id, temperature_unit='F', theme='dark')
+        payload = {'session_id': self.session_id, 'theme': 'light'}
+        resp = self.client.post('/api/preferences/update/', data=json.dumps(payload), content_type='application/json')
+        self.assertEqual(resp.status_code, 200)
+        prefs = UserPreferences.objects.get()
+        self.assertEqual((prefs.pk, prefs.temperature_unit, prefs.theme), (saved.pk, 'F', 'light'))
+        self.assertEqual(prefs.created_at, saved.created_at)
+
+
+class TestStreamingResponses(TestCase):
+    def setUp(self):
+        self.client = Client()
+
+    def test_large_forecast_is_streamed(self):
+        loc = Location.objects.create(user_id='streamsess', city_name='A', country='GB', latitude=1, longitude=1)
+        hours = [{'dt': i, 'temperature': 10.0 + i} for i in range(24)]
+        WeatherCache.objects.create(location=loc, cache_type=WeatherCache.CACHE_FORECAST, forecast_data={'days': [
+            {'date': f'2024-01-0{d}', 'min_temp': 1, 'max_temp': 3, 'hours': hours} for d in range(1, 4)
+        ]})
+        self.client.cookies['session_id'] = 'streamsess'
+        resp = self.client.get('/api/weather/forecast/', {'lat': '1', 'lon': '1', 'days': '3'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.streaming)
+        j = json.loads(b''.join(resp.streaming_content))
+        self.assertTrue(j['success'])
+        self.assertEqual(len(j['data']['data']), 3)
+        self.assertTrue(j['data']['cached'])
+
+    def test_streamed_envelope_matches_renderer(self):
+        from rest_framework.renderers import JSONRenderer
+        from api.responses import envelope, json_array
+
+        days = [{'date': '2024-01-01', 'hours': [{'dt': 1, 'weather': 'clear sky — ☀'}]}]
+        meta = {'cached': True, 'cache_age': '5 minutes'}
+        expected = JSONRenderer().render({
+            'success': True, 'data': {'data': days, **meta}, 'message': None, 'error': None,
+        })
+        self.assertEqual(b''.join(envelope('data', json_array(days), meta)), expected)
+
+
+class TestResponseBodyCache(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.client.cookies['session_id'] = 'bodysess'
+        self.loc = Location.objects.create(user_id='bodysess', city_name='A', country='GB', latitude=1, longitude=1)
+
+    def test_miss_stores_serialized_body(self):
+        weather = {'temperature': 20.0, 'weather': 'clear sky'}
+        with patch('core.services.weather_service.WeatherService.get_current_weather', return_value=weather):
+            resp = self.client.get('/api/weather/current/', {'lat': '1', 'lon': '1'})
+        self.assertEqual(resp.status_code, 200)
+        cache = WeatherCache.objects.get(location=self.loc)
+        self.assertEqual(json.loads(bytes(cache.response_body)), weather)
+        self.assertEqual(len(cache.etag), 32)
+
+    def test_hit_served_from_stored_body(self):
+        WeatherCache.objects.create(
+            location=self.loc, cache_type=WeatherCache.CACHE_CURRENT,
+            weather_data={'temperature': 1.0}, response_body=b'{"temperature":2.0}', etag='x',
+        )
+        resp = self.client.get('/api/weather/current/', {'lat': '1', 'lon': '1'})
+        j = resp.json()
+        self.assertTrue(j['data']['cached'])
+        self.assertEqual(j['data']['data'], {'temperature': 2.0})
+
+    def test_hit_without_body_falls_back_to_json_column(self):
+        WeatherCache.objects.create(location=self.loc, cache_type=WeatherCache.CACHE_CURRENT, weather_data={'temperature': 1.0})
+        resp = self.client.get('/api/weather/current/', {'lat': '1', 'lon': '1'})
+        self.assertEqual(resp.json()['data']['data'], {'temperature': 1.0})
+
+
+class TestConditionalRequests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.client.cookies['session_id'] = 'condsess'
+        self.loc = Location.objects.create(user_id='condsess', city_name='A', country='GB', latitude=1, longitude=1)
+        WeatherCache.objects.create(
+            location=self.loc, cache_type=WeatherCache.CACHE_CURRENT,
+            weather_data={'temperature': 2.0}, response_body=b'{"temperature":2.0}', etag='abc123',
+        )
+
+    def test_current_weather_emits_validators(self):
+        resp = self.client.get('/api/weather/current/', {'lat': '1', 'lon': '1'})
+        self.assertEqual(resp['ETag'], '"abc123"')
+        self.assertIn('Last-Modified', resp)
+
+    def test_current_weather_if_none_match(self):
+        resp = self.client.get('/api/weather/current/', {'lat': '1', 'lon': '1'}, HTTP_IF_NONE_MATCH='"abc123"')
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.content, b'')
+        self.assertEqual(resp['ETag'], '"abc123"')
+
+    def test_current_weather_if_modified_since(self):
+        first = self.client.get('/api/weather/current/', {'lat': '1', 'lon': '1'})
+        resp = self.client.get('/api/weather/current/', {'lat': '1', 'lon': '1'}, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(resp.status_code, 304)
+
+    def test_locations_revalidation(self):
+        first = self.client.get('/api/locations/', {'session_id': 'condsess'})
+        etag = first['ETag']
+        self.assertTrue(etag.startswith('W/'))
+        resp = self.client.get('/api/locations/', {'session_id': 'condsess'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 304)
+
+        Location.objects.create(user_id='condsess', city_name='B', country='GB', latitude=2, longitude=2)
+        resp = self.client.get('/api/locations/', {'session_id': 'condsess'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(resp.json()['data']['locations']), 2)
+
+
+class TestCacheControl(TestCase):
+    def setUp(self):
+        self.client = Client()
+
+    @patch('core.services.weather_service.WeatherService.reverse_geocode', return_value='London')
+    @patch('core.services.weather_service.WeatherService.get_current_weather', return_value={'temperature': 20.0})
+    def test_coordinate_only_request_is_public_and_cookie_free(self, _mock_get, _mock_geo):
+        resp = self.client.get('/api/weather/current/', {'lat': '51.5', 'lon': '-0.12'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotIn('session_id', resp.cookies)
+        self.assertIn('public', resp['Cache-Control'])
+        self.assertIn('max-age=', resp['Cache-Control'])
+        self.assertIn('stale-while-revalidate=', resp['Cache-Control'])
+        self.assertNotIn('cookie', resp['Vary'].lower())
+        self.assertTrue(Location.objects.filter(user_id=Location.SHARED_USER_ID).exists())
+
+    def test_shared_owner_is_not_a_session(self):
+        loc = Location.objects.create(user_id=Location.SHARED_USER_ID, city_name='A', country='', latitude=1, longitude=1)
+        shared = {'session_id': Location.SHARED_USER_ID}
+        self.assertEqual(self.client.get('/api/locations/', shared).status_code, 400)
+        self.assertEqual(self.client.delete(f'/api/locations/{loc.id}/?session_id={Location.SHARED_USER_ID}').status_code, 400)
+        self.assertEqual(self.client.post(f'/api/locations/{loc.id}/favorite/', data=json.dumps(shared),
+                                          content_type='application/json').status_code, 400)
+        self.assertEqual(self.client.get('/api/preferences/', shared).status_code, 400)
+        self.assertTrue(Location.objects.filter(pk=loc.pk, is_favorite=False).exists())
+
+    def test_max_age_tracks_remaining_ttl(self):
+        from datetime import timedelta
+        from django.utils import timezone
+
+        loc = Location.objects.create(user_id=Location.SHARED_USER_ID, city_name='A', country='', latitude=1, longitude=1)
+        cache = WeatherCache.objects.create(location=loc, cache_type=WeatherCache.CACHE_CURRENT, weather_data={})
+        cache.cached_at = timezone.now() - timedelta(minutes=4)
+        cache.save(update_fields=['cached_at'])
+        resp = self.client.get('/api/weather/current/', {'lat': '1', 'lon': '1'})
+        max_age = int(resp['Cache-Control'].split('max-age=')[1].split(',')[0])
+        self.assertTrue(355 <= max_age <= 360)
+
+    def test_session_request_is_private(self):
+        loc = Location.objects.create(user_id='ccsess', city_name='A', country='', latitude=1, longitude=1)
+        WeatherCache.objects.create(location=loc, cache_type=WeatherCache.CACHE_CURRENT, weather_data={})
+        self.client.cookies['session_id'] = 'ccsess'
+        resp = self.client.get('/api/weather/current/', {'lat': '1', 'lon': '1'})
+        self.assertIn('private', resp['Cache-Control'])
+
+
+class TestCompression(TestCase):
+    def setUp(self):
+        self.client = Client()
+
+    def test_gzip_splice_round_trips(self):
+        import gzip
+        from api.compression import deflate_blocks, gzip_splice
+
+        body = json.dumps([{'hour': i, 'temperature': 10.5} for i in range(200)]).encode()
+        blocks = deflate_blocks(body)
+        self.assertIsNotNone(blocks)
+        self.assertLess(len(blocks), len(body))
+        self.assertEqual(gzip.decompress(gzip_splice(b'{"data":', body, blocks, b'}')), b'{"data":' + body + b'}')
+
+    @patch('core.services.weather_service.WeatherService.reverse_geocode', return_value='London')
+    @patch('core.services.weather_service.WeatherService.get_forecast')
+    def test_forecast_served_precompressed(self, mock_get, _mock_geo):
+        import gzip
+
+        hours = [{'dt': i, 'temperature': 10.0, 'weather': 'clear sky'} for i in range(8)]
+        mock_get.return_value = {'days': [{'date': '2024-01-01', 'min_temp': 1, 'max_temp': 3, 'hours': hours}] * 3}
+        params = {'lat': '51.5', 'lon': '-0.12', 'days': '3'}
+        miss = self.client.get('/api/weather/forecast/', params, HTTP_ACCEPT_ENCODING='gzip, br')
+        hit = self.client.get('/api/weather/forecast/', params, HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertIsNotNone(WeatherCache.objects.get().response_gzip)
+        for resp in (miss, hit):
+            self.assertEqual(resp['Content-Encoding'], 'gzip')
+            self.assertTrue(resp['ETag'].startswith('W/'))
+            self.assertEqual(len(json.loads(gzip.decompress(resp.content))['data']['data']), 3)
+        self.assertTrue(json.loads(gzip.decompress(hit.content))['data']['cached'])
+
+        plain = self.client.get('/api/weather/forecast/', params)
+        self.assertNotIn('Content-Encoding', plain)
+        self.assertTrue(plain.json()['data']['cached'])
+
+    def test_small_json_left_uncompressed(self):
+        resp = self.client.get('/api/health/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertNotIn('Content-Encoding', resp)
+
+
+class TestServerTiming(TestCase):
+    def setUp(self):
+        loc = Location.objects.create(user_id=Location.SHARED_USER_ID, city_name='A', country='', latitude=1, longitude=1)
+        WeatherCache.objects.create(location=loc, cache_type=WeatherCache.CACHE_CURRENT, weather_data={},
+                                    response_body=b'{}', etag='t')
+
+    def test_header_and_log_when_enabled(self):
+        from django.test import override_settings
+
+        with override_settings(REQUEST_TIMING_ENABLED=True), self.assertLogs('api.timing', 'INFO') as logs:
+            resp = Client().get('/api/weather/current/', {'lat': '1', 'lon': '1'})
+        phases = [entry.split(';')[0] for entry in resp['Server-Timing'].split(', ')]
+        for name in ('location', 'cache', 'serialize', 'db', 'total'):
+            self.assertIn(name, phases)
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['path'], '/api/weather/current/')
+        self.assertIn('cache', record['phases'])
+
+    def test_absent_when_disabled(self):
+        resp = Client().get('/api/weather/current/', {'lat': '1', 'lon': '1'})
+        self.assertNotIn('Server-Timing', resp)
+
+
+class TestMetrics(TestCase):
+    def setUp(self):
+        loc = Location.objects.create(user_id=Location.SHARED_USER_ID, city_name='A', country='', latitude=1, longitude=1)
+        WeatherCache.objects.create(location=loc, cache_type=WeatherCache.CACHE_CURRENT, weather_data={},
+                                    response_body=b'{}', etag='m')
+
+    def _scrape(self, **extra):
+        resp = Client().get('/api/metrics/', **extra)
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return resp.content.decode()
+
+    def _value(self, text, series):
+        for line in text.splitlines():
+            if line.startswith(series + ' '):
+                return float(line.rsplit(' ', 1)[1])
+        return 0.0
+
+    def test_cache_hits_queries_and_table_size(self):
+        hit = 'weather_cache_lookups_total{type="current",result="hit"}'
+        before = self._value(self._scrape(), hit)
+        Client().get('/api/weather/current/', {'lat': '1', 'lon': '1'})
+        text = self._scrape()
+        self.assertEqual(self._value(text, hit), before + 1)
+        self.assertGreater(self._value(text, 'api_db_queries_total{endpoint="current_weather"}'), 0)
+        self.assertIn('api_request_duration_seconds_bucket{endpoint="current_weather",le="+Inf"}', text)
+        self.assertEqual(self._value(text, 'weather_cache_rows{type="current"}'), 1)
+
+    @patch('core.services.weather_service.requests.get')
+    def test_upstream_status_counted_per_provider(self, mock_get):
+        from core.services.weather_service import WeatherService
+
+        series = 'weather_upstream_requests_total{provider="nominatim",status="429"}'
+        before = self._value(self._scrape(), series)
+        mock_get.return_value.status_code = 429
+        WeatherService(api_key='')._http_get('nominatim', 'http://example.invalid/search', params={})
+        self.assertEqual(self._value(self._scrape(), series), before + 1)
+
+    def test_token_required_when_configured(self):
+        from django.test import override_settings
+
+        with override_settings(METRICS_TOKEN='s3cret'):
+            self.assertEqual(Client().get('/api/metrics/').status_code, 401)
+            self._scrape(HTTP_AUTHORIZATION='Bearer s3cret', REMOTE_ADDR='203.0.113.5')
+
+    def test_local_only_without_token(self):
+        self._scrape()  # loopback
+        self.assertEqual(Client().get('/api/metrics/', REMOTE_ADDR='203.0.113.5').status_code, 403)
+        self.assertEqual(Client().get('/api/metrics/', HTTP_X_FORWARDED_FOR='203.0.113.5').status_code, 403)
+
+    def test_snapshots_from_other_processes_are_summed(self):
+        import os
+        import tempfile
+        from django.test import override_settings
+
+        series = 'weather_geocoding_fallbacks_total{fallback="nominatim"}'
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            own = self._value(self._scrape(), series)
+            with open(os.path.join(directory, 'metrics-1-1.json'), 'w') as fh:
+                json.dump({'weather_geocoding_fallbacks_total': {json.dumps([['fallback', 'nominatim']]): 5}}, fh)
+            self.assertEqual(self._value(self._scrape(), series), own + 5)
+
+
+class TestProfiling(TestCase):
+    def setUp(self):
+        import tempfile
+        from django.test import override_settings
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(PROFILING_ENABLED=True, PROFILING_DIR=self.tmp.name,
+                                                   PROFILING_MAX_FILES=2)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.tmp.cleanup()
+
+    def test_signed_header_profiles_and_rotates(self):
+        import os
+        from core.profiling import make_token
+
+        token = make_token()
+        names = []
+        for _ in range(3):
+            resp = Client().get('/api/health/', HTTP_X_PROFILE=token)
+            self.assertEqual(resp.status_code, 200)
+            names.append(resp['X-Profile-Id'])
+        self.assertIn('health', names[0])
+        self.assertEqual(len(os.listdir(self.tmp.name)), 2)
+
+    def test_unsampled_and_forged_requests_not_profiled(self):
+        self.assertNotIn('X-Profile-Id', Client().get('/api/health/'))
+        self.assertNotIn('X-Profile-Id', Client().get('/api/health/', HTTP_X_PROFILE='profile:forged:sig'))
+
+    def test_download_is_staff_only(self):
+        import pstats
+        import os
+        from django.contrib.auth.models import User
+        from core.profiling import make_token
+
+        name = Client().get('/api/health/', HTTP_X_PROFILE=make_token())['X-Profile-Id']
+        self.assertEqual(Client().get(f'/admin/profiles/{name}').status_code, 302)
+
+        staff = Client()
+        staff.force_login(User.objects.create_user('ops', password='x', is_staff=True))
+        listing = staff.get('/admin/profiles/').json()['profiles']
+        self.assertEqual(listing[0]['name'], name)
+        resp = staff.get(f'/admin/profiles/{name}')
+        self.assertEqual(resp.status_code, 200)
+        path = os.path.join(self.tmp.name, 'copy.prof')
+        with open(path, 'wb') as fh:
+            fh.write(b''.join(resp.streaming_content))
+        self.assertGreater(pstats.Stats(path).total_calls, 0)
+        self.assertEqual(staff.get('/admin/profiles/..%2Fsettings.py').status_code, 404)
+
+
+class TestReplicaRouting(TestCase):
+    def test_reads_go_to_replicas_unless_pinned(self):
+        from django.test import override_settings
+        from core.routers import ReplicaRouter, pin_primary
+
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_read(Location), 'default')
+        with override_settings(REPLICA_DATABASES=['replica1']):
+            self.assertEqual(router.db_for_read(Location), 'replica1')
+            self.assertEqual(router.db_for_write(Location), 'default')
+            with pin_primary():
+                self.assertEqual(router.db_for_read(Location), 'default')
+            self.assertFalse(router.allow_migrate('replica1', 'core'))
+
+    def test_write_pins_following_reads_to_primary(self):
+        from django.test import override_settings
+        from core import routers
+
+        seen = []
+        original = routers.ReplicaRouter.db_for_read
+
+        def spy(router, model, **hints):
+            seen.append(routers.is_pinned())
+            return 'default'
+
+        with override_settings(REPLICA_DATABASES=['replica1']), patch.object(routers.ReplicaRouter, 'db_for_read', spy):
+            client = Client()
+            resp = client.post('/api/preferences/update/', data=json.dumps({'temperature_unit': 'F'}),
+                               content_type='application/json', HTTP_COOKIE='session_id=pin')
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.cookies['db_primary']['max-age'], 10)
+            seen.clear()
+            resp = client.get('/api/locations/', {'session_id': 'pin'})
+            self.assertEqual(resp.status_code, 200)
+            self.assertTrue(seen and all(seen))
+            seen.clear()
+            Client().get('/api/locations/', {'session_id': 'other'})
+            self.assertTrue(seen and not any(seen))
+        self.assertIs(routers.ReplicaRouter.db_for_read, original)
+
+    def test_pin_covers_streamed_bodies(self):
+        from django.test import override_settings
+        from core import routers
+
+        for i in range(3):
+            Location.objects.create(user_id='pin', city_name=f'C{i}', country='', latitude=i, longitude=i)
+        seen = []
+
+        def spy(router, model, **hints):
+            seen.append(routers.is_pinned())
+            return 'default'
+
+        with override_settings(REPLICA_DATABASES=['replica1'], API_STREAM_MIN_ITEMS=1), \
+                patch.object(routers.ReplicaRouter, 'db_for_read', spy):
+            client = Client()
+            client.cookies['db_primary'] = '1'
+            resp = client.get('/api/locations/', {'session_id': 'pin'})
+            self.assertTrue(resp.streaming)
+            self.assertEqual(len(json.loads(b''.join(resp.streaming_content))['data']['locations']), 3)
+        self.assertTrue(seen and all(seen))
+
+
+class TestSiteOnlyMiddleware(TestCase):
+    def test_admin_keeps_csrf_sessions_and_frame_options(self):
+        from django.contrib.auth.models import User
+        from django.test import override_settings
+
+        # The manifest only exists after collectstatic
+        storage = override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+        storage.enable()
+        self.addCleanup(storage.disable)
+        User.objects.create_user('ops', password='x', is_staff=True)
+        client = Client(enforce_csrf_checks=True)
+        login = client.get('/admin/login/')
+        self.assertEqual(login.status_code, 200)
+        self.assertEqual(login['X-Frame-Options'], 'DENY')
+        token = login.cookies['csrftoken'].value
+        self.assertEqual(client.post('/admin/login/', {'username': 'ops', 'password': 'x'}).status_code, 403)
+        resp = client.post('/admin/login/', {'username': 'ops', 'password': 'x', 'csrfmiddlewaretoken': token,
+                                             'next': '/admin/'})
+        self.assertEqual(resp.status_code, 302)
+        self.assertIn('sessionid', resp.cookies)
+        self.assertEqual(client.get('/admin/').status_code, 200)  # authenticated through the session
+
+    def test_api_skips_site_middleware(self):
+        client = Client(enforce_csrf_checks=True)
+        resp = client.get('/api/health/')
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotIn('X-Frame-Options', resp)
+        self.assertNotIn('csrftoken', resp.cookies)
+        self.assertNotIn('sessionid', resp.cookies)
+        resp = client.post('/api/preferences/update/', data=json.dumps({'session_id': 'mw', 'theme': 'dark'}),
+                           content_type='application/json')
+        self.assertEqual(resp.status_code, 200)  # no CSRF check
+        self.assertNotIn('X-Frame-Options', resp)
+
+
+class TestSessionContext(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        self.client = Client()
+        self.client.cookies['session_id'] = 'ctx'
+        self.loc = Location.objects.create(user_id='ctx', city_name='A', country='', latitude='51.507400',
+                                           longitude='-0.127800')
+        WeatherCache.objects.create(location=self.loc, cache_type=WeatherCache.CACHE_CURRENT, weather_data={},
+                                    response_body=b'{}', etag='ctx')
+
+    def test_cached_hit_needs_only_the_cache_query(self):
+        params = {'lat': '51.5074', 'lon': '-0.1278'}
+        self.assertEqual(self.client.get('/api/weather/current/', params).status_code, 200)
+        with self.assertNumQueries(1):
+            resp = self.client.get('/api/weather/current/', params)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(Location.objects.filter(user_id='ctx').count(), 1)
+
+    def test_list_loads_weather_in_one_query(self):
+        from datetime import timedelta
+        from django.utils import timezone
+
+        for i in range(4):
+            loc = Location.objects.create(user_id='ctx', city_name=f'L{i}', country='', latitude=i, longitude=i)
+            old = WeatherCache.objects.create(location=loc, cache_type=WeatherCache.CACHE_CURRENT,
+                                              weather_data={'temperature': -1})
+            old.cached_at = timezone.now() - timedelta(minutes=1)
+            old.save(update_fields=['cached_at'])
+            WeatherCache.objects.create(location=loc, cache_type=WeatherCache.CACHE_CURRENT,
+                                        weather_data={'temperature': i})
+        self.client.get('/api/locations/')  # warms the context
+        with self.assertNumQueries(2):  # ETag aggregate, latest caches
+            resp = self.client.get('/api/locations/')
+        weather = {e['city_name']: e['weather'] for e in resp.json()['data']['locations']}
+        self.assertEqual(weather, {'A': {}, **{f'L{i}': {'temperature': i} for i in range(4)}})
+
+    def test_writes_invalidate(self):
+        url = f'/api/locations/{self.loc.id}/favorite/'
+        self.assertTrue(self.client.post(url, {}, content_type='application/json').json()['data']['location']['is_favorite'])
+        self.assertFalse(self.client.post(url, {}, content_type='application/json').json()['data']['location']['is_favorite'])
+
+        self.client.post('/api/locations/save/', data=json.dumps({'city': 'B', 'lat': 2, 'lon': 2}),
+                         content_type='application/json')
+        resp = self.client.post('/api/preferences/update/', data=json.dumps({'default_location': self.loc.id}),
+                                content_type='application/json')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self.client.get('/api/preferences/').json()['data']['preferences']['default_location'],
+                         self.loc.id)
+        self.assertEqual(len(self.client.get('/api/locations/').json()['data']['locations']), 2)
+
+
+class TestUnits(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        self.client = Client()
+        days = [{'date': '2024-01-01', 'min_temp': 0.0, 'max_temp': 10.0,
+                 'hours': [{'temperature': 20.0, 'wind_speed': 10.0, 'visibility': 10000, 'pressure': 1013}] * 2}]
+        body = json.dumps(days, separators=(',', ':')).encode()
+        for owner in (Location.SHARED_USER_ID, 'usess'):
+            loc = Location.objects.create(user_id=owner, city_name='A', country='', latitude=1, longitude=1)
+            WeatherCache.objects.create(location=loc, cache_type=WeatherCache.CACHE_FORECAST,
+                                        forecast_data={'days': days}, response_body=body, etag='u1')
+
+    def _forecast(self, units=None, **extra):
+        params = {'lat': '1', 'lon': '1', 'days': '1', **({'units': units} if units else {})}
+        return self.client.get('/api/weather/forecast/', params, **extra)
+
+    def test_default_is_metric_and_unchanged(self):
+        resp = self._forecast()
+        self.assertEqual(resp['ETag'], '"u1"')
+        self.assertEqual(resp.json()['data']['units'], 'metric')
+        self.assertEqual(resp.json()['data']['data'][0]['hours'][0]['temperature'], 20.0)
+
+    def test_imperial_variant_is_converted_and_cached(self):
+        from django.core.cache import cache
+
+        resp = self._forecast(units='imperial')
+        self.assertEqual(resp['ETag'], '"u1-imperial"')
+        day = resp.json()['data']['data'][0]
+        self.assertEqual((day['min_temp'], day['max_temp']), (32.0, 50.0))
+        self.assertEqual(day['hours'][1], {'temperature': 68.0, 'wind_speed': 22.4, 'visibility': 6.2, 'pressure': 29.91})
+        self.assertIsNotNone(cache.get('units:u1-imperial'))
+        with patch('api.units.convert') as mock_convert:
+            again = self._forecast(units='imperial')
+        mock_convert.assert_not_called()
+        self.assertEqual(again.json()['data']['data'], resp.json()['data']['data'])
+        self.assertEqual(self._forecast(units='imperial', HTTP_IF_NONE_MATCH='"u1-imperial"').status_code, 304)
+
+    def test_preference_and_invalid_units(self):
+        UserPreferences.objects.create(session_id='usess', temperature_unit='F')
+        self.client.cookies['session_id'] = 'usess'
+        self.assertEqual(self._forecast(units='preference').json()['data']['units'], 'imperial')
+        self.assertEqual(self._forecast(units='kelvin').status_code, 400)
+
+    def test_preference_is_never_shared(self):
+        resp = self._forecast(units='preference')
+        self.assertEqual(resp.json()['data']['units'], 'metric')
+        self.assertIn('private', resp['Cache-Control'])
+        self.assertNotIn('public', resp['Cache-Control'])
+        self.assertIn('public', self._forecast(units='metric')['Cache-Control'])
+
+
+class TestWriteBehind(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from django.test import override_settings
+
+        cache.clear()
+        self.client = Client()
+        self.settings_override = override_settings(WRITE_BEHIND_ENABLED=True, WRITE_BEHIND_FLUSH_SECONDS=0,
+                                                   WRITE_BEHIND_MAX_PENDING=100)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    @patch('core.services.weather_service.WeatherService.reverse_geocode', return_value='London')
+    @patch('core.services.weather_service.WeatherService.get_current_weather', return_value={'temperature': 20.0})
+    def test_reads_do_not_write_until_flush(self, mock_get, _mock_geo):
+        from core.write_buffer import buffer
+
+        self.client.cookies['session_id'] = 'wbsess'
+        first = self.client.get('/api/weather/current/', {'lat': '51.5', 'lon': '-0.12'})
+        self.assertFalse(first.json()['data']['cached'])
+        self.assertFalse(Location.objects.exists() or WeatherCache.objects.exists())
+        second = self.client.get('/api/weather/current/', {'lat': '51.5', 'lon': '-0.12'})
+        self.assertTrue(second.json()['data']['cached'])
+        self.assertEqual(second['ETag'], first['ETag'])
+        mock_get.assert_called_once()
+
+        self.assertEqual(buffer.flush(), (1, 1))
+        entry = WeatherCache.objects.get()
+        self.assertEqual(entry.location.city_name, 'London')
+        self.assertEqual(entry.etag, first['ETag'].strip('"'))
+        self.assertTrue(self.client.get('/api/weather/current/', {'lat': '51.5', 'lon': '-0.12'}).json()['data']['cached'])
+        self.assertEqual(buffer.flush(), (0, 0))
+
+    def test_flush_reuses_existing_location(self):
+        from core.write_buffer import buffer
+
+        existing = Location.objects.create(user_id='wbsess', city_name='Saved', country='', latitude=1, longitude=2)
+        loc = buffer.add_location(Location(user_id='wbsess', city_name='Pending', country='', latitude=1.0, longitude=2.0))
+        self.assertIs(buffer.location('wbsess', 1, 2), loc)
+        buffer.add_cache(WeatherCache(location=loc, cache_type=WeatherCache.CACHE_CURRENT, weather_data={'temperature': 1}))
+        buffer.add_cache(WeatherCache(location=loc, cache_type=WeatherCache.CACHE_CURRENT, weather_data={'temperature': 2}))
+        self.assertEqual(buffer.flush(), (0, 1))  # the location was reused, not created
+        self.assertEqual(Location.objects.count(), 1)
+        self.assertEqual(loc.pk, existing.pk)
+        self.assertEqual(list(existing.caches.values_list('weather_data', flat=True)), [{'temperature': 2}])
+        self.assertIsNone(buffer.location('wbsess', 1, 2))
+
+    def test_entries_of_deleted_locations_are_dropped(self):
+        from core.write_buffer import buffer
+
+        gone = Location.objects.create(user_id='wbsess', city_name='Gone', country='', latitude=1, longitude=2)
+        kept = Location.objects.create(user_id='wbsess', city_name='Kept', country='', latitude=3, longitude=4)
+        for loc in (gone, kept):
+            buffer.add_cache(WeatherCache(location=loc, cache_type=WeatherCache.CACHE_CURRENT, weather_data={}))
+        Location.objects.filter(pk=gone.pk).delete()
+        self.assertEqual(buffer.flush(), (0, 1))
+        self.assertEqual(list(WeatherCache.objects.values_list('location_id', flat=True)), [kept.pk])
+        self.assertEqual(len(buffer), 0)
+
+    def test_flush_reads_from_primary(self):
+        from django.test import override_settings
+        from core import routers
+        from core.write_buffer import buffer
+
+        seen = []
+
+        def spy(router, model, **hints):
+            seen.append(routers.is_pinned())
+            return 'default'
+
+        loc = buffer.add_location(Location(user_id='wbsess', city_name='P', country='', latitude=1.0, longitude=2.0))
+        buffer.add_cache(WeatherCache(location=loc, cache_type=WeatherCache.CACHE_CURRENT, weather_data={}))
+        with override_settings(REPLICA_DATABASES=['replica1']), patch.object(routers.ReplicaRouter, 'db_for_read', spy):
+            self.assertEqual(buffer.flush(), (1, 1))
+        self.assertTrue(seen and all(seen))
+
+
+class TestColdRequests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        self.client = Client()
+
+    @patch('core.session_context.location_at', return_value=None)
+    @patch('core.services.weather_service.WeatherService.reverse_geocode', return_value='Other')
+    @patch('core.services.weather_service.WeatherService.get_current_weather', return_value={'temperature': 20.0})
+    def test_losing_the_insert_race_reuses_the_row(self, mock_get, _mock_geo, _mock_at):
+        from django.test import override_settings
+        from core import routers
+
+        def replica_lags(router, model, **hints):
+            # The winner's row is only on the primary yet
+            if model is Location and not routers.is_pinned():
+                raise Location.DoesNotExist
+            return 'default'
+
+        # The context was read before a concurrent request inserted the row
+        existing = Location.objects.create(user_id='racesess', city_name='First', country='', latitude=1, longitude=2)
+        self.client.cookies['session_id'] = 'racesess'
+        with override_settings(REPLICA_DATABASES=['replica1']), \
+                patch.object(routers.ReplicaRouter, 'db_for_read', replica_lags):
+            resp = self.client.get('/api/weather/current/', {'lat': '1', 'lon': '2'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(Location.objects.get().city_name, 'First')
+        mock_get.assert_called_once()
+        self.assertEqual(WeatherCache.objects.get().location_id, existing.id)
+
+    def test_geocoding_and_fetch_run_concurrently(self):
+        import time
+
+        def slow(value):
+            def call(*args, **kwargs):
+                time.sleep(0.3)
+                return value
+            return call
+
+        with patch('core.services.weather_service.WeatherService.reverse_geocode', side_effect=slow('London')), \
+                patch('core.services.weather_service.WeatherService.get_current_weather',
+                      side_effect=slow({'temperature': 20.0})):
+            started = time.perf_counter()
+            resp = self.client.get('/api/weather/current/', {'lat': '51.5', 'lon': '-0.12'})
+            elapsed = time.perf_counter() - started
+        self.assertEqual(resp.status_code, 200)
+        self.assertLess(elapsed, 0.55)
+        self.assertEqual(Location.objects.get().city_name, 'London')
+        self.assertEqual(WeatherCache.objects.count(), 1)
+
+    def test_late_geocoding_is_backfilled(self):
+        import threading
+        from django.test import override_settings
+        from core.write_buffer import buffer
+
+        release = threading.Event()
+
+        def geocode(*args):
+            release.wait(5)
+            return 'London'
+
+        # Buffered, so the backfill only touches the pending instance
+        with override_settings(UPSTREAM_DEADLINE_SECONDS=0.05, WRITE_BEHIND_ENABLED=True,
+                               WRITE_BEHIND_FLUSH_SECONDS=0), \
+                patch('core.services.weather_service.WeatherService.reverse_geocode', side_effect=geocode), \
+                patch('core.services.weather_service.WeatherService.get_current_weather',
+                      return_value={'temperature': 20.0}):
+            resp = self.client.get('/api/weather/current/', {'lat': '51.5', 'lon': '-0.12'})
+            self.assertEqual(resp.status_code, 200)
+            loc = buffer.location(Location.SHARED_USER_ID, 51.5, -0.12)
+            self.assertEqual(loc.city_name, '(51.5,-0.12)')
+            release.set()
+            for _ in range(50):
+                if loc.city_name == 'London':
+                    break
+                threading.Event().wait(0.02)
+            self.assertEqual(loc.city_name, 'London')
+            buffer.flush()
+        self.assertEqual(Location.objects.get().city_name, 'London')
+
+
+    def test_backfill_bumps_updated_at(self):
+        from concurrent.futures import Future
+        from datetime import timedelta
+        from django.utils import timezone
+        from api.views import _backfill_city
+
+        loc = Location.objects.create(user_id='bfsess', city_name='(1,2)', country='', latitude=1, longitude=2)
+        old = timezone.now() - timedelta(hours=1)
+        Location.objects.filter(pk=loc.pk).update(updated_at=old)
+        done = Future()
+        done.set_result('London')
+        _backfill_city(loc, done)
+        loc.refresh_from_db()
+        self.assertEqual(loc.city_name, 'London')
+        self.assertGreater(loc.updated_at, old)
+
+
+class TestDeadlines(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        self.client = Client()
+
+    @patch('core.services.weather_service.WeatherService.get_current_weather', side_effect=Exception('upstream down'))
+    def test_expired_entry_is_served_when_refresh_fails(self, _mock_get):
+        from datetime import timedelta
+        from django.utils import timezone
+        from core import metrics
+
+        loc = Location.objects.create(user_id=Location.SHARED_USER_ID, city_name='A', country='', latitude=1, longitude=1)
+        cache = WeatherCache.objects.create(location=loc, cache_type=WeatherCache.CACHE_CURRENT,
+                                            weather_data={'temperature': 5.0})
+        cache.cached_at = timezone.now() - timedelta(hours=2)
+        cache.save(update_fields=['cached_at'])
+        stale_key = (('type', WeatherCache.CACHE_CURRENT), ('result', 'stale'))
+        served_stale = metrics.CACHE_LOOKUPS.values.get(stale_key, 0.0)
+        resp = self.client.get('/api/weather/current/', {'lat': '1', 'lon': '1'})
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()['data']
+        self.assertEqual((data['data']['temperature'], data['stale']), (5.0, True))
+        self.assertEqual(metrics.CACHE_LOOKUPS.values[stale_key], served_stale + 1)
+        self.assertIn('max-age=0', resp['Cache-Control'])
+
+        WeatherCache.objects.all().delete()
+        self.assertEqual(self.client.get('/api/weather/current/', {'lat': '1', 'lon': '1'}).status_code, 502)
+
+    def test_prefetch_is_bounded_by_request_budget(self):
+        import time
+        from django.test import override_settings
+
+        def slow(*args, **kwargs):
+            time.sleep(1.0)
+            return {'temperature': 1.0}
+
+        with override_settings(UPSTREAM_DEADLINE_SECONDS=0.3), \
+                patch('core.services.weather_service.WeatherService.reverse_geocode', return_value='X'), \
+                patch('core.services.weather_service.WeatherService.get_current_weather', side_effect=slow):
+            started = time.perf_counter()
+            resp = self.client.get('/api/weather/current/', {'lat': '2', 'lon': '2'})
+            self.assertLess(time.perf_counter() - started, 0.8)
+        self.assertEqual(resp.status_code, 502)
+        self.assertIn('deadline', resp.json()['error'].lower())
+
+
+class TestAdmissionControl(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from django.test import override_settings
+
+        cache.clear()
+        self.client = Client()
+        self.settings_override = override_settings(UPSTREAM_MAX_CONCURRENCY=1, UPSTREAM_QUEUE_TIMEOUT_MS=10)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def _cached(self, lat, hours_old):
+        from datetime import timedelta
+        from django.utils import timezone
+
+        loc = Location.objects.create(user_id=Location.SHARED_USER_ID, city_name='A', country='',
+                                      latitude=lat, longitude=1)
+        cache = WeatherCache.objects.create(location=loc, cache_type=WeatherCache.CACHE_CURRENT,
+                                            weather_data={'temperature': 5.0})
+        cache.cached_at = timezone.now() - timedelta(hours=hours_old)
+        cache.save(update_fields=['cached_at'])
+
+    @patch('core.services.weather_service.WeatherService.reverse_geocode', return_value='X')
+    @patch('core.services.weather_service.WeatherService.get_current_weather', return_value={'temperature': 1.0})
+    def test_sheds_upstream_work_but_not_hits(self, mock_get, _mock_geo):
+        from core import admission
+
+        self._cached(1, hours_old=0)
+        self._cached(2, hours_old=2)
+        with admission.admit():  # the only slot is busy
+            hit = self.client.get('/api/weather/current/', {'lat': '1', 'lon': '1'})
+            stale = self.client.get('/api/weather/current/', {'lat': '2', 'lon': '1'})
+            cold = self.client.get('/api/weather/current/', {'lat': '3', 'lon': '1'})
+            search = self.client.get('/api/locations/search/', {'q': 'London'})
+        self.assertTrue(hit.json()['data']['cached'])
+        self.assertTrue(stale.json()['data']['stale'])
+        self.assertEqual((cold.status_code, cold['Retry-After']), (503, '5'))
+        self.assertEqual(search.status_code, 503)
+        mock_get.assert_not_called()
+        self.assertEqual(self.client.get('/api/weather/current/', {'lat': '3', 'lon': '1'}).status_code, 200)
+
+
+class TestRateLimiting(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from django.test import override_settings
+        from api.ratelimit import memory
+
+        cache.clear()
+        memory.clear()
+        self.client = Client()
+        self.settings_override = override_settings(RATE_LIMIT_ENABLED=True, RATE_LIMIT_HIT_RATE=0.01,
+                                                   RATE_LIMIT_HIT_BURST=4, RATE_LIMIT_MISS_RATE=0.01,
+                                                   RATE_LIMIT_MISS_BURST=1)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    @patch('core.services.weather_service.WeatherService.reverse_geocode', return_value='X')
+    @patch('core.services.weather_service.WeatherService.get_current_weather', return_value={'temperature': 1.0})
+    def test_misses_and_hits_have_separate_budgets(self, mock_get, _mock_geo):
+        first = self.client.get('/api/weather/current/', {'lat': '1', 'lon': '1'})  # miss
+        self.assertEqual(first.status_code, 200)
+        second_miss = self.client.get('/api/weather/current/', {'lat': '2', 'lon': '2'})
+        self.assertEqual(second_miss.status_code, 429)
+        self.assertGreater(int(second_miss['Retry-After']), 0)
+        self.assertEqual(mock_get.call_count, 1)
+        # Hits still allowed until the hit lane is spent (4 tokens: 2 used above)
+        self.assertEqual(self.client.get('/api/weather/current/', {'lat': '1', 'lon': '1'}).status_code, 200)
+        self.assertEqual(self.client.get('/api/weather/current/', {'lat': '1', 'lon': '1'}).status_code, 200)
+        self.assertEqual(self.client.get('/api/weather/current/', {'lat': '1', 'lon': '1'}).status_code, 429)
+        # Another client (IP) has its own buckets
+        other = self.client.get('/api/weather/current/', {'lat': '2', 'lon': '2'}, REMOTE_ADDR='203.0.113.9')
+        self.assertEqual(other.status_code, 200)
+
+    def test_forwarded_for_is_not_trusted_by_default(self):
+        from django.test import override_settings
+
+        with override_settings(RATE_LIMIT_HIT_BURST=2):
+            codes = [self.client.get('/api/locations/search/', HTTP_X_FORWARDED_FOR=f'198.51.100.{i}').status_code
+                     for i in range(4)]
+        self.assertEqual(codes[2:], [429, 429])
+
+    def test_trusted_proxy_hop(self):
+        from django.test import override_settings
+        from django.test.client import RequestFactory
+        from api.ratelimit import client_ip
+
+        factory = RequestFactory()
+        with override_settings(RATE_LIMIT_TRUSTED_PROXIES=1):
+            # The proxy appended the real peer; the forged left entry is ignored
+            request = factory.get('/', HTTP_X_FORWARDED_FOR='1.2.3.4, 203.0.113.7', REMOTE_ADDR='10.0.0.1')
+            self.assertEqual(client_ip(request), '203.0.113.7')
+            self.assertEqual(client_ip(factory.get('/', REMOTE_ADDR='10.0.0.1')), '10.0.0.1')
+        with override_settings(RATE_LIMIT_TRUSTED_PROXIES=2):
+            request = factory.get('/', HTTP_X_FORWARDED_FOR='1.2.3.4, 203.0.113.7, 10.0.0.2', REMOTE_ADDR='10.0.0.1')
+            self.assertEqual(client_ip(request), '203.0.113.7')
+        request = factory.get('/', HTTP_X_FORWARDED_FOR='203.0.113.7', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(client_ip(request), '10.0.0.1')
+
+    def test_session_bucket_follows_the_session_across_ips(self):
+        from django.test import override_settings
+
+        self.client.cookies['session_id'] = 'rlsess'
+        with override_settings(RATE_LIMIT_HIT_BURST=1):
+            first = self.client.get('/api/locations/search/', HTTP_X_FORWARDED_FOR='198.51.100.1')
+            second = self.client.get('/api/locations/search/', HTTP_X_FORWARDED_FOR='198.51.100.2')
+        self.assertNotEqual(first.status_code, 429)
+        self.assertEqual(second.status_code, 429)
+
+    def test_shared_backend(self):
+        from django.test import override_settings
+        from api.ratelimit import memory
+
+        with override_settings(RATE_LIMIT_BACKEND='cache', RATE_LIMIT_HIT_BURST=1):
+            self.assertNotEqual(self.client.get('/api/locations/search/').status_code, 429)
+            memory.clear()
+            self.assertEqual(self.client.get('/api/locations/search/').status_code, 429)
@@ -0,0 +1,81 @@
+from __future__ import annotations
+import json
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from django.core.cache import cache
+
+from core.utils import weather_records
+from .compression import deflate_blocks
+from .responses import dumps
+
+
+# Weather payloads are stored and cached in metric units (°C, m/s, m, hPa).
+# Imperial variants are derived from the cached body in one pass per field
+# over every record (current conditions, forecast days and their hours) and
+# kept in the Django cache next to the metric body, so they are byte-cache
+# hits too.
+
+METRIC = 'metric'
+IMPERIAL = 'imperial'
+UNITS = (METRIC, IMPERIAL)
+
+
+def _fahrenheit(values: List[float]) -> List[float]:
+    return [round(v * 9.0 / 5.0 + 32.0, 1) for v in values]
+
+
+def _mph(values: List[float]) -> List[float]:
+    return [round(v * 2.2369363, 1) for v in values]
+
+
+def _miles(values: List[float]) -> List[float]:
+    return [round(v / 1609.344, 1) for v in values]
+
+
+def _inhg(values: List[float]) -> List[float]:
+    return [round(v * 0.0295299831, 2) for v in values]
+
+
+# Field name -> column converter from metric to imperial
+IMPERIAL_FIELDS: Dict[str, Callable[[List[float]], List[float]]] = {
+    'temperature': _fahrenheit,
+    'feels_like': _fahrenheit,
+    'min_temp': _fahrenheit,
+    'max_temp': _fahrenheit,
+    'heat_index': _fahrenheit,
+    'dew_point': _fahrenheit,
+    'wind_chill': _fahrenheit,
+    'wind_speed': _mph,
+    'visibility': _miles,
+    'pressure': _inhg,
+}
+
+
+def convert(value: Any, units: str) -> Any:
+    """Convert a metric weather payload to `units` in place and return it."""
+    if units == METRIC:
+        return value
+    records = weather_records(value)
+    for field, converter in IMPERIAL_FIELDS.items():
+        rows = [r for r in records if isinstance(r.get(field), (int, float)) and not isinstance(r.get(field), bool)]
+        if rows:
+            for row, converted in zip(rows, converter([float(r[field]) for r in rows])):
+                row[field] = converted
+    return value
+
+
+def variant_etag(etag: str, units: str) -> str:
+    return etag if units == METRIC else f'{etag}-{units}'
+
+
+def variant(body: bytes, etag: str, units: str, ttl: int) -> Tuple[bytes, Optional[bytes]]:
+    """Converted cached body and its deflate blocks, built once per etag and unit."""
+    key = f'units:{variant_etag(etag, units)}'
+    hit = cache.get(key)
+    if hit is not None:
+        return hit
+    converted = dumps(convert(json.loads(body), units))
+    result = (converted, deflate_blocks(converted))
+    if ttl > 0:
+        cache.set(key, result, ttl)
+    return result
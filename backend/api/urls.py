@@ -4,6 +4,7 @@ from . import views
 urlpatterns = [
     # Health
     path('health/', views.health, name='health'),
+    path('metrics/', views.metrics_exposition, name='metrics'),
 
     # Weather
     path('weather/current/', views.current_weather, name='current_weather'),
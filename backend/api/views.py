@@ -1,21 +1,52 @@
+import contextvars
+import ipaddress
 import logging
-import uuid
-from typing import Any, Dict, List, Optional, Tuple
-
+import math
+from functools import partial
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Count, Max, OuterRef, Q, Subquery
+from django.http import HttpRequest, HttpResponse, HttpResponseBase
 from django.utils import timezone
-from rest_framework.decorators import api_view, permission_classes
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.http import require_GET
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework import status
 
+from core import admission
+from core import metrics
+from core import routers
+from core import session_context
+from core import write_buffer
+from core.admission import Overloaded
 from core.models import Location, WeatherCache, UserPreferences
-from core.services.weather_service import WeatherService
+from core.services.weather_service import Deadline, DeadlineExceeded, WeatherService
+from core.session_context import SessionContext
+from core.timing import span
+from . import ratelimit
+from .cache_entries import new_entry
+from .compression import accepts_gzip, gzip_success_bytes
+from .ratelimit import RateLimited
+from .responses import (
+    body_etag, json_array, not_modified, set_cache_control, set_validators, should_stream, stream_success,
+    success_bytes,
+)
+from .units import IMPERIAL, METRIC, UNITS, convert, variant, variant_etag
 from .utils import success, error
 
 
 logger = logging.getLogger(__name__)
 
+# Upstream calls made side by side (reverse geocoding and the weather fetch
+# for a new location)
+_upstream_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix='upstream')
+
 
 def _parse_float(value: Optional[str], name: str) -> Tuple[Optional[float], Optional[Response]]:
     if value is None:
@@ -45,20 +76,285 @@ def _humanize_age_minutes(minutes: int) -> str:
     return f'{hours} hour' if hours == 1 else f'{hours} hours'
 
 
-def _get_or_create_location_for_session(session_id: str, lat: float, lon: float, service: WeatherService) -> Location:
-    loc = Location.objects.filter(user_id=session_id, latitude=lat, longitude=lon).first()
+def _weather_owner(request: Request) -> str:
+    # Weather payloads depend only on coordinates. Requests without a session
+    # cookie share one cache owner and get no cookie back, which keeps their
+    # responses cacheable by browsers and the CDN.
+    return request.COOKIES.get('session_id') or Location.SHARED_USER_ID
+
+
+def _requested_units(request: Request) -> Tuple[str, Optional[Response]]:
+    # Opt-in: clients that convert for display keep getting metric. 'preference'
+    # follows the session's stored temperature_unit.
+    requested = request.query_params.get('units') or METRIC
+    if requested == 'preference':
+        session_id = request.COOKIES.get('session_id')
+        prefs = SessionContext.load(session_id).preferences if session_id else None
+        return (IMPERIAL if prefs is not None and prefs.temperature_unit == 'F' else METRIC), None
+    if requested not in UNITS:
+        return METRIC, error("Invalid units (use 'metric', 'imperial' or 'preference')", status.HTTP_400_BAD_REQUEST)
+    return requested, None
+
+
+def _with_cache_control(request: Request, resp: HttpResponseBase, cache: WeatherCache) -> HttpResponseBase:
+    """Let HTTP caches keep a weather response for the rest of its cache TTL."""
+    # units=preference picks the body from the cookie, so it is never shared
+    shared = 'session_id' not in request.COOKIES and request.query_params.get('units') != 'preference'
+    set_cache_control(resp, cache.remaining_seconds(), shared=shared)
+    return resp
+
+
+def _upstream(func: Callable[..., Any], *args: Any, **kwargs: Any) -> 'Future[Any]':
+    """Run an upstream call on the shared pool, keeping the request's timing context."""
+    return _upstream_pool.submit(contextvars.copy_context().run, func, *args, **kwargs)
+
+
+def _backfill_city(loc: Location, geocoded: 'Future[Any]') -> None:
+    """Replace a coordinate placeholder name once a late reverse geocode completes."""
+    try:
+        city = geocoded.result()
+    except Exception:
+        return
+    if not city:
+        return
+    loc.city_name = city[:100]
+    if loc.pk is not None:  # otherwise still buffered and written with the new name
+        try:
+            # updated_at too, so list ETags and context stamps see the rename
+            Location.objects.filter(pk=loc.pk).update(city_name=loc.city_name, updated_at=timezone.now())
+            session_context.invalidate(loc.user_id)
+        except Exception:
+            logger.warning('Could not backfill city name for location %s', loc.pk, exc_info=True)
+        finally:
+            close_old_connections()
+
+
+def _get_or_create_location_for_session(request: Request, session_id: str, lat: float, lon: float,
+                                        service: WeatherService,
+                                        fetch: Callable[[], Any]) -> Tuple[Location, Optional['Future[Any]']]:
+    """The owner's location at (lat, lon), creating it on first use.
+
+    A new location has no cache entry yet, so `fetch` (the weather call the
+    miss will need) is started under an upstream slot alongside its reverse
+    geocoding and returned as a future; for known locations the future is
+    None. Raises RateLimited or Overloaded when no slot is granted. Both share the
+    service's deadline; geocoding that runs past it leaves a coordinate name,
+    replaced by the real one when the call finishes.
+    """
+    if settings.WRITE_BEHIND_ENABLED:
+        loc = write_buffer.buffer.location(session_id, lat, lon)
+        if loc:
+            return loc, None
+    if session_id == Location.SHARED_USER_ID:
+        # One row per coordinate ever requested: too many to keep in a context
+        loc = Location.objects.filter(user_id=session_id, latitude=lat, longitude=lon).first()
+    else:
+        loc = session_context.location_at(session_id, lat, lon)
     if loc:
-        return loc
-    # Try to populate city/country from reverse geocoding; fallback to coordinates
-    city = service.reverse_geocode(lat, lon) or f'({lat},{lon})'
-    return Location.objects.create(
+        return loc, None
+    slot = _upstream_slot(request)
+    prefetched = _upstream(fetch)
+    prefetched.add_done_callback(lambda _: slot.release())
+    geocoded = _upstream(service.reverse_geocode, lat, lon)
+    try:
+        city = geocoded.result(timeout=service.deadline.remaining())
+    except FutureTimeout:
+        city = None
+    except Exception:
+        city = None
+        geocoded = None
+    loc = Location(
         user_id=session_id,
-        city_name=city[:100],
+        city_name=(city or f'({lat},{lon})')[:100],
         country='',
         latitude=lat,
         longitude=lon,
         is_favorite=False,
     )
+    if settings.WRITE_BEHIND_ENABLED:
+        # Saved with the next flush, which also invalidates the session context
+        loc = write_buffer.buffer.add_location(loc)
+    else:
+        try:
+            with transaction.atomic():
+                loc.save(force_insert=True)
+        except IntegrityError:
+            # A concurrent request created it first (replicas may not have it yet);
+            # its fetch is still ours
+            with routers.pin_primary():
+                loc = Location.objects.get(user_id=session_id, latitude=loc.latitude, longitude=loc.longitude)
+            return loc, prefetched
+        session_context.invalidate(session_id)
+    if geocoded is not None and not geocoded.done():
+        geocoded.add_done_callback(lambda done: _backfill_city(loc, done))
+    return loc, prefetched
+
+
+def _upstream_slot(request: Request) -> admission.Slot:
+    """Charge the client's miss lane, then take an admission slot."""
+    ratelimit.consume(request, ratelimit.MISS)
+    return admission.admit()
+
+
+def _fetch(request: Request, prefetched: Optional['Future[Any]'], service: WeatherService,
+           fetch: Callable[[], Any]) -> Any:
+    """Result of the prefetched call, or of `fetch()` under an upstream slot."""
+    if prefetched is None:
+        with _upstream_slot(request):
+            return fetch()
+    try:
+        return prefetched.result(timeout=service.deadline.remaining())
+    except FutureTimeout:
+        raise DeadlineExceeded('Request deadline exceeded waiting for upstream') from None
+
+
+def _shed(exc: Exception) -> Response:
+    """429 for a client over its rate limit, 503 when upstream capacity is exhausted."""
+    if isinstance(exc, RateLimited):
+        resp = error('Too many requests, slow down', status.HTTP_429_TOO_MANY_REQUESTS)
+        resp['Retry-After'] = str(math.ceil(exc.retry_after))
+    else:
+        resp = error('Too busy to reach weather providers, retry shortly', status.HTTP_503_SERVICE_UNAVAILABLE)
+        resp['Retry-After'] = str(settings.UPSTREAM_RETRY_AFTER)
+    return resp
+
+
+def _latest_cache(loc: Location, cache_type: str) -> Optional[WeatherCache]:
+    if settings.WRITE_BEHIND_ENABLED:
+        pending = write_buffer.buffer.latest_cache(loc, cache_type)
+        if pending is not None or loc.pk is None:
+            return pending
+    # The decoded JSON columns are only needed for rows cached before response
+    # bodies were stored; hits are served from `response_body` as-is.
+    return (
+        WeatherCache.objects.filter(location=loc, cache_type=cache_type)
+        .defer('weather_data', 'forecast_data')
+        .order_by('-cached_at')
+        .first()
+    )
+
+
+def _lookup_result(cache: Optional[WeatherCache], cache_type: str) -> str:
+    """Classify a cache lookup as hit, expired or miss and count it."""
+    result = 'miss' if cache is None else 'hit' if cache.is_valid() else 'expired'
+    metrics.CACHE_LOOKUPS.inc(type=cache_type, result=result)
+    return result
+
+
+def _cached_days(cache: WeatherCache) -> Any:
+    data = cache.forecast_data or {}
+    return data.get('days') if isinstance(data, dict) else data
+
+
+def _body_response(request: Request, body: bytes, blocks: Optional[bytes], meta: Dict[str, Any]) -> HttpResponseBase:
+    if blocks is not None and accepts_gzip(request):
+        return gzip_success_bytes('data', body, blocks, meta)
+    return success_bytes('data', body, meta)
+
+
+def _fill_cache(request: Request, loc: Location, cache_type: str, value: Any, unit_system: str,
+                **data_fields: Any) -> Tuple[WeatherCache, HttpResponseBase]:
+    """Store a fresh upstream result and build the uncached response from it.
+
+    `value` is serialized once; the bytes are both stored and sent (metric) or
+    converted to `unit_system`.
+    """
+    with span('serialize'):
+        cache = new_entry(loc, cache_type, value, **data_fields)
+    with span('cache'):
+        if settings.WRITE_BEHIND_ENABLED:
+            write_buffer.buffer.add_cache(cache)
+        else:
+            cache.save(force_insert=True)
+    body, blocks = cache.response_body, cache.response_gzip
+    if unit_system != METRIC:
+        with span('serialize'):
+            body, blocks = variant(body, cache.etag, unit_system, cache.remaining_seconds())
+    meta = {'cached': False, 'cache_age': _humanize_age_minutes(0), 'units': unit_system}
+    resp = _body_response(request, body, blocks, meta)
+    set_validators(resp, variant_etag(cache.etag, unit_system), cache.cached_at)
+    return cache, resp
+
+
+def _cache_hit(request: Request, cache: WeatherCache, unit_system: str,
+               fallback: Callable[[Dict[str, Any]], HttpResponseBase], stale: bool = False) -> HttpResponseBase:
+    """Serve a valid cache entry, answering conditional requests with a 304.
+
+    `fallback` builds the response from the decoded JSON columns for rows that
+    have no stored body. `stale` marks an expired entry served because the
+    refresh failed.
+    """
+    etag = variant_etag(cache.etag, unit_system) if cache.etag else None
+    resp = not_modified(request, etag, cache.cached_at)
+    if resp is None:
+        meta = {'cached': True, 'cache_age': _humanize_age_minutes(cache.get_age_minutes()), 'units': unit_system}
+        if stale:
+            meta['stale'] = True
+        with span('serialize'):
+            if cache.response_body is not None:
+                body = bytes(cache.response_body)
+                blocks = bytes(cache.response_gzip) if cache.response_gzip is not None else None
+                if unit_system != METRIC:
+                    body, blocks = variant(body, cache.etag, unit_system, cache.remaining_seconds())
+                resp = _body_response(request, body, blocks, meta)
+            else:
+                resp = fallback(meta)
+    return set_validators(resp, etag, cache.cached_at)
+
+
+def _locations_etag(session_id: str) -> Tuple[str, Tuple[int, Any]]:
+    # Derived from row metadata rather than the body so a revalidation costs
+    # one aggregate query. Expiring current-weather caches change the valid
+    # count, adds/removes change the location count, edits bump updated_at.
+    cutoff = timezone.now() - WeatherCache.ttl_for(WeatherCache.CACHE_CURRENT)
+    current = Q(caches__cache_type=WeatherCache.CACHE_CURRENT)
+    agg = Location.objects.filter(user_id=session_id).aggregate(
+        count=Count('id', distinct=True),
+        updated=Max('updated_at'),
+        cached=Max('caches__cached_at', filter=current),
+        valid=Count('caches', filter=current & Q(caches__cached_at__gte=cutoff)),
+    )
+    key = '|'.join(str(agg[k]) for k in ('count', 'updated', 'cached', 'valid'))
+    return body_etag(f'{session_id}|{key}'.encode('utf-8')), (agg['count'], agg['updated'])
+
+
+def _forecast_response(days: Any, meta: Dict[str, Any]) -> HttpResponseBase:
+    # Large multi-day hourly payloads are streamed day by day instead of being
+    # rendered into a single buffer. Only rows cached before response bodies
+    # were stored get here; stored bodies are already encoded and sent whole.
+    if isinstance(days, list):
+        hours = sum(len(d.get('hours') or []) for d in days if isinstance(d, dict))
+        if should_stream(hours):
+            return stream_success('data', json_array(days), meta)
+    return success({'data': days, **meta})
+
+
+def _latest_current_caches(locs: List[Location]) -> Dict[int, WeatherCache]:
+    """Newest current-weather entry per location, in one query."""
+    if not locs:
+        return {}
+    newest = (
+        WeatherCache.objects.filter(location=OuterRef('location'), cache_type=WeatherCache.CACHE_CURRENT)
+        .order_by('-cached_at').values('pk')[:1]
+    )
+    rows = (
+        WeatherCache.objects.filter(location__in=[loc.pk for loc in locs], pk=Subquery(newest))
+        .only('location_id', 'cache_type', 'cached_at', 'weather_data')
+    )
+    return {cache.location_id: cache for cache in rows}
+
+
+def _location_entry(loc: Location, cache: Optional[WeatherCache]) -> Dict[str, Any]:
+    return {
+        'id': loc.id,
+        'city_name': loc.city_name,
+        'country': loc.country,
+        'latitude': float(loc.latitude),
+        'longitude': float(loc.longitude),
+        'is_favorite': loc.is_favorite,
+        'created_at': loc.created_at,
+        'weather': cache.weather_data if cache and cache.is_valid() else None,
+    }
 
 
 @api_view(['GET'])
@@ -67,9 +363,41 @@ def health(request: Request) -> Response:
     return success({'status': 'ok', 'server_time': timezone.now().isoformat()})
 
 
+def _is_local_scrape(request: HttpRequest) -> bool:
+    """A direct loopback request: not through a proxy that sets X-Forwarded-For."""
+    if 'HTTP_X_FORWARDED_FOR' in request.META:
+        return False
+    try:
+        return ipaddress.ip_address(request.META.get('REMOTE_ADDR', '')).is_loopback
+    except ValueError:
+        return False
+
+
+@require_GET
+def metrics_exposition(request: HttpRequest) -> HttpResponse:
+    """Prometheus text exposition of the counters in `core.metrics`."""
+    token = settings.METRICS_TOKEN
+    if token:
+        if not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+    elif not _is_local_scrape(request):
+        return HttpResponse(status=status.HTTP_403_FORBIDDEN)
+    rows = WeatherCache.objects.values_list('cache_type').annotate(n=Count('id')).order_by()
+    gauges = {
+        'weather_cache_rows': ('Rows in the WeatherCache table by cache type.',
+                               {(('type', cache_type),): n for cache_type, n in rows}),
+    }
+    return HttpResponse(metrics.render(gauges), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 @api_view(['GET'])
+@authentication_classes([])  # no session lookup, so no `Vary: Cookie`
 @permission_classes([AllowAny])
-def current_weather(request: Request) -> Response:
+def current_weather(request: Request) -> HttpResponseBase:
+    try:
+        ratelimit.consume(request, ratelimit.HIT)
+    except RateLimited as exc:
+        return _shed(exc)
     lat_str = request.query_params.get('lat')
     lon_str = request.query_params.get('lon')
     lat, err = _parse_float(lat_str, 'lat')
@@ -81,51 +409,57 @@ def current_weather(request: Request) -> Response:
     vr = _validate_coords(lat, lon)
     if vr:
         return vr
+    unit_system, err = _requested_units(request)
+    if err:
+        return err
 
-    # Session handling via cookie
-    session_id = request.COOKIES.get('session_id') or uuid.uuid4().hex
-    service = WeatherService()
+    session_id = _weather_owner(request)
+    service = WeatherService(deadline=Deadline(settings.UPSTREAM_DEADLINE_SECONDS))
+
+    fetch = partial(service.get_current_weather, lat, lon)
 
     # Cache lookup
-    loc = _get_or_create_location_for_session(session_id, lat, lon, service)
-    cache: Optional[WeatherCache] = (
-        WeatherCache.objects.filter(location=loc, cache_type=WeatherCache.CACHE_CURRENT)
-        .order_by('-cached_at')
-        .first()
-    )
-    if cache and cache.is_valid():
-        resp = success({
-            'data': cache.weather_data,
-            'cached': True,
-            'cache_age': _humanize_age_minutes(cache.get_age_minutes()),
-        })
+    try:
+        with span('location'):
+            loc, prefetched = _get_or_create_location_for_session(request, session_id, lat, lon, service, fetch)
+    except (Overloaded, RateLimited) as exc:
+        return _shed(exc)
+    with span('cache'):
+        cache = _latest_cache(loc, WeatherCache.CACHE_CURRENT) if prefetched is None else None
+
+    def from_columns(meta: Dict[str, Any]) -> HttpResponseBase:
+        return success({'data': convert(cache.weather_data, unit_system), **meta})
+
+    if _lookup_result(cache, WeatherCache.CACHE_CURRENT) == 'hit':
+        resp = _cache_hit(request, cache, unit_system, from_columns)
     else:
         try:
-            weather = service.get_current_weather(lat, lon)
+            with span('fetch'):
+                weather = _fetch(request, prefetched, service, fetch)
         except Exception as exc:
-            logger.exception('Failed to fetch current weather')
-            return error(f'Failed to fetch current weather: {exc}', status.HTTP_502_BAD_GATEWAY)
-
-        cache = WeatherCache.objects.create(
-            location=loc,
-            cache_type=WeatherCache.CACHE_CURRENT,
-            weather_data=weather,
-        )
-        resp = success({
-            'data': weather,
-            'cached': False,
-            'cache_age': _humanize_age_minutes(0),
-        })
-
-    # Ensure session cookie is set
-    if 'session_id' not in request.COOKIES:
-        resp.set_cookie('session_id', session_id, max_age=60 * 60 * 24 * 30, httponly=False, samesite='Lax')
-    return resp
+            if cache is None:
+                if isinstance(exc, (Overloaded, RateLimited)):
+                    return _shed(exc)
+                logger.exception('Failed to fetch current weather')
+                return error(f'Failed to fetch current weather: {exc}', status.HTTP_502_BAD_GATEWAY)
+            logger.warning('Serving expired current weather after failed fetch: %s', exc)
+            metrics.CACHE_LOOKUPS.inc(type=WeatherCache.CACHE_CURRENT, result='stale')
+            resp = _cache_hit(request, cache, unit_system, from_columns, stale=True)
+        else:
+            cache, resp = _fill_cache(request, loc, WeatherCache.CACHE_CURRENT, weather, unit_system,
+                                      weather_data=weather)
+
+    return _with_cache_control(request, resp, cache)
 
 
 @api_view(['GET'])
+@authentication_classes([])  # no session lookup, so no `Vary: Cookie`
 @permission_classes([AllowAny])
-def forecast_weather(request: Request) -> Response:
+def forecast_weather(request: Request) -> HttpResponseBase:
+    try:
+        ratelimit.consume(request, ratelimit.HIT)
+    except RateLimited as exc:
+        return _shed(exc)
     lat_str = request.query_params.get('lat')
     lon_str = request.query_params.get('lon')
     days_str = request.query_params.get('days', '7')
@@ -143,46 +477,64 @@ def forecast_weather(request: Request) -> Response:
     except ValueError:
         return error('Invalid days value', status.HTTP_400_BAD_REQUEST)
     days = max(1, min(days, 7))
+    unit_system, err = _requested_units(request)
+    if err:
+        return err
 
-    session_id = request.COOKIES.get('session_id') or uuid.uuid4().hex
-    service = WeatherService()
-    loc = _get_or_create_location_for_session(session_id, lat, lon, service)
+    session_id = _weather_owner(request)
+    service = WeatherService(deadline=Deadline(settings.UPSTREAM_DEADLINE_SECONDS))
+    fetch = partial(service.get_forecast, lat, lon, days=days)
+    try:
+        with span('location'):
+            loc, prefetched = _get_or_create_location_for_session(request, session_id, lat, lon, service, fetch)
+    except (Overloaded, RateLimited) as exc:
+        return _shed(exc)
 
-    cache: Optional[WeatherCache] = (
-        WeatherCache.objects.filter(location=loc, cache_type=WeatherCache.CACHE_FORECAST)
-        .order_by('-cached_at')
-        .first()
-    )
-    if cache and cache.is_valid():
-        data = cache.forecast_data or {}
-        resp = success({'data': data.get('days') if isinstance(data, dict) else data, 'cached': True, 'cache_age': _humanize_age_minutes(cache.get_age_minutes())})
+    with span('cache'):
+        cache = _latest_cache(loc, WeatherCache.CACHE_FORECAST) if prefetched is None else None
+
+    def from_columns(meta: Dict[str, Any]) -> HttpResponseBase:
+        return _forecast_response(convert(_cached_days(cache), unit_system), meta)
+
+    if _lookup_result(cache, WeatherCache.CACHE_FORECAST) == 'hit':
+        resp = _cache_hit(request, cache, unit_system, from_columns)
     else:
         try:
-            forecast = WeatherService().get_forecast(lat, lon, days=days)
+            with span('fetch'):
+                forecast = _fetch(request, prefetched, service, fetch)
         except Exception as exc:
-            logger.exception('Failed to fetch forecast')
-            return error(f'Failed to fetch forecast: {exc}', status.HTTP_502_BAD_GATEWAY)
-        WeatherCache.objects.create(
-            location=loc,
-            cache_type=WeatherCache.CACHE_FORECAST,
-            forecast_data=forecast,
-        )
-        resp = success({'data': forecast.get('days'), 'cached': False, 'cache_age': _humanize_age_minutes(0)})
-
-    if 'session_id' not in request.COOKIES:
-        resp.set_cookie('session_id', session_id, max_age=60 * 60 * 24 * 30, httponly=False, samesite='Lax')
-    return resp
+            if cache is None:
+                if isinstance(exc, (Overloaded, RateLimited)):
+                    return _shed(exc)
+                logger.exception('Failed to fetch forecast')
+                return error(f'Failed to fetch forecast: {exc}', status.HTTP_502_BAD_GATEWAY)
+            logger.warning('Serving expired forecast after failed fetch: %s', exc)
+            metrics.CACHE_LOOKUPS.inc(type=WeatherCache.CACHE_FORECAST, result='stale')
+            resp = _cache_hit(request, cache, unit_system, from_columns, stale=True)
+        else:
+            cache, resp = _fill_cache(request, loc, WeatherCache.CACHE_FORECAST, forecast.get('days'), unit_system,
+                                      forecast_data=forecast)
+
+    return _with_cache_control(request, resp, cache)
 
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def search_locations(request: Request) -> Response:
+    try:
+        ratelimit.consume(request, ratelimit.HIT)
+    except RateLimited as exc:
+        return _shed(exc)
     query = request.query_params.get('q')
     if not query:
         return error('Missing required parameter: q', status.HTTP_400_BAD_REQUEST)
     try:
-        results = WeatherService().search_location(query, limit=5)
+        service = WeatherService(deadline=Deadline(settings.UPSTREAM_DEADLINE_SECONDS))
+        with _upstream_slot(request):
+            results = service.search_location(query, limit=5)
         return success({'results': results})
+    except (Overloaded, RateLimited) as exc:
+        return _shed(exc)
     except Exception as exc:
         logger.exception('Location search failed')
         return error(f'Failed to search locations: {exc}', status.HTTP_502_BAD_GATEWAY)
@@ -195,6 +547,8 @@ def save_location(request: Request) -> Response:
     session_id = data.get('session_id') or request.COOKIES.get('session_id')
     if not session_id:
         return error('session_id is required', status.HTTP_400_BAD_REQUEST)
+    if session_id == Location.SHARED_USER_ID:
+        return error('session_id is reserved', status.HTTP_400_BAD_REQUEST)
     city = (data.get('city') or '').strip()
     country = (data.get('country') or '').strip()
     lat, err = _parse_float(str(data.get('lat')), 'lat')
@@ -207,7 +561,7 @@ def save_location(request: Request) -> Response:
     if vr:
         return vr
 
-    existing = Location.objects.filter(user_id=session_id, latitude=lat, longitude=lon).first()
+    existing = session_context.location_at(session_id, lat, lon)
     if existing:
         return success({'location': {
             'id': existing.id,
@@ -226,6 +580,7 @@ def save_location(request: Request) -> Response:
         latitude=lat,
         longitude=lon,
     )
+    session_context.invalidate(session_id)
     return success({'location': {
         'id': loc.id,
         'city_name': loc.city_name,
@@ -239,28 +594,30 @@ def save_location(request: Request) -> Response:
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
-def list_locations(request: Request) -> Response:
+def list_locations(request: Request) -> HttpResponseBase:
     session_id = request.query_params.get('session_id') or request.COOKIES.get('session_id')
     if not session_id:
         return error('session_id is required', status.HTTP_400_BAD_REQUEST)
-    locs = Location.objects.filter(user_id=session_id).order_by('-is_favorite', '-created_at')
-    result: List[Dict[str, Any]] = []
-    for loc in locs:
-        cache = (
-            WeatherCache.objects.filter(location=loc, cache_type=WeatherCache.CACHE_CURRENT)
-            .order_by('-cached_at').first()
-        )
-        result.append({
-            'id': loc.id,
-            'city_name': loc.city_name,
-            'country': loc.country,
-            'latitude': float(loc.latitude),
-            'longitude': float(loc.longitude),
-            'is_favorite': loc.is_favorite,
-            'created_at': loc.created_at,
-            'weather': cache.weather_data if cache and cache.is_valid() else None,
-        })
-    return success({'locations': result})
+    if session_id == Location.SHARED_USER_ID:
+        return error('session_id is reserved', status.HTTP_400_BAD_REQUEST)
+    etag, stamp = _locations_etag(session_id)
+    resp = not_modified(request, etag, weak=True)
+    if resp is not None:
+        return resp
+    ctx = SessionContext.load(session_id)
+    if ctx.locations_stamp() != stamp:
+        # Changed outside the API views (admin, commands) since it was cached
+        session_context.invalidate(session_id)
+        ctx = SessionContext.load(session_id)
+    locs = ctx.locations
+    caches = _latest_current_caches(locs)
+    if should_stream(len(locs)):
+        # Entries are encoded while the body is sent
+        resp = stream_success('locations', json_array(_location_entry(loc, caches.get(loc.pk)) for loc in locs))
+    else:
+        result: List[Dict[str, Any]] = [_location_entry(loc, caches.get(loc.pk)) for loc in locs]
+        resp = success({'locations': result})
+    return set_validators(resp, etag, weak=True)
 
 
 @api_view(['DELETE'])
@@ -269,10 +626,13 @@ def delete_location(request: Request, location_id: int) -> Response:
     session_id = request.query_params.get('session_id') or request.COOKIES.get('session_id')
     if not session_id:
         return error('session_id is required', status.HTTP_400_BAD_REQUEST)
-    loc = Location.objects.filter(id=location_id, user_id=session_id).first()
+    if session_id == Location.SHARED_USER_ID:
+        return error('session_id is reserved', status.HTTP_400_BAD_REQUEST)
+    loc = session_context.location(session_id, location_id)
     if not loc:
         return error('Location not found', status.HTTP_404_NOT_FOUND)
     loc.delete()
+    session_context.invalidate(session_id)
     return success({'message': 'Location deleted'})
 
 
@@ -282,11 +642,14 @@ def toggle_favorite(request: Request, location_id: int) -> Response:
     session_id = request.data.get('session_id') or request.COOKIES.get('session_id')
     if not session_id:
         return error('session_id is required', status.HTTP_400_BAD_REQUEST)
-    loc = Location.objects.filter(id=location_id, user_id=session_id).first()
+    if session_id == Location.SHARED_USER_ID:
+        return error('session_id is reserved', status.HTTP_400_BAD_REQUEST)
+    loc = session_context.location(session_id, location_id)
     if not loc:
         return error('Location not found', status.HTTP_404_NOT_FOUND)
     loc.is_favorite = not loc.is_favorite
-    loc.save(update_fields=['is_favorite'])
+    loc.save(update_fields=['is_favorite', 'updated_at'])
+    session_context.invalidate(session_id)
     return success({'location': {
         'id': loc.id,
         'city_name': loc.city_name,
@@ -298,20 +661,29 @@ def toggle_favorite(request: Request, location_id: int) -> Response:
     }})
 
 
+def _preferences_payload(prefs: UserPreferences) -> Dict[str, Any]:
+    return {
+        'session_id': prefs.session_id,
+        'temperature_unit': prefs.temperature_unit,
+        'theme': prefs.theme,
+        'default_location': prefs.default_location_id,
+        'updated_at': prefs.updated_at,  # None until saved
+    }
+
+
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def get_preferences(request: Request) -> Response:
     session_id = request.query_params.get('session_id') or request.COOKIES.get('session_id')
     if not session_id:
         return error('session_id is required', status.HTTP_400_BAD_REQUEST)
-    prefs, _ = UserPreferences.objects.get_or_create(session_id=session_id)
-    return success({'preferences': {
-        'session_id': prefs.session_id,
-        'temperature_unit': prefs.temperature_unit,
-        'theme': prefs.theme,
-        'default_location': prefs.default_location_id,
-        'updated_at': prefs.updated_at,
-    }})
+    if session_id == Location.SHARED_USER_ID:
+        return error('session_id is reserved', status.HTTP_400_BAD_REQUEST)
+    # Sessions that never saved preferences get the model defaults; the row
+    # is created by their first update. Either way the answer comes from the
+    # cached session context.
+    prefs = SessionContext.load(session_id).preferences or UserPreferences(session_id=session_id)
+    return success({'preferences': _preferences_payload(prefs)})
 
 
 @api_view(['POST'])
@@ -321,6 +693,8 @@ def update_preferences(request: Request) -> Response:
     session_id = data.get('session_id') or request.COOKIES.get('session_id')
     if not session_id:
         return error('session_id is required', status.HTTP_400_BAD_REQUEST)
+    if session_id == Location.SHARED_USER_ID:
+        return error('session_id is reserved', status.HTTP_400_BAD_REQUEST)
     temperature_unit = data.get('temperature_unit')
     theme = data.get('theme')
     default_location = data.get('default_location')
@@ -333,7 +707,9 @@ def update_preferences(request: Request) -> Response:
     if theme and theme not in valid_themes:
         return error('Invalid theme', status.HTTP_400_BAD_REQUEST)
 
-    prefs, _ = UserPreferences.objects.get_or_create(session_id=session_id)
+    # Read fresh: a stale cached context (per worker with locmem) would
+    # overwrite the saved row with defaults
+    prefs = SessionContext.load(session_id, fresh=True).preferences or UserPreferences(session_id=session_id)
     if temperature_unit:
         prefs.temperature_unit = temperature_unit
     if theme:
@@ -347,18 +723,13 @@ def update_preferences(request: Request) -> Response:
                 loc_id = int(default_location)
             except (TypeError, ValueError):
                 return error('Invalid default_location', status.HTTP_400_BAD_REQUEST)
-            loc = Location.objects.filter(id=loc_id, user_id=session_id).first()
+            loc = session_context.location(session_id, loc_id)
             if not loc:
                 return error('default_location not found for this session', status.HTTP_400_BAD_REQUEST)
             prefs.default_location = loc
-    prefs.save()
+    prefs.save()  # inserts the row on a session's first update
+    session_context.invalidate(session_id)
 
-    return success({'preferences': {
-        'session_id': prefs.session_id,
-        'temperature_unit': prefs.temperature_unit,
-        'theme': prefs.theme,
-        'default_location': prefs.default_location_id,
-        'updated_at': prefs.updated_at,
-    }})
+    return success({'preferences': _preferences_payload(prefs)})
 
 
@@ -0,0 +1,73 @@
+from __future__ import annotations
+import threading
+from typing import Optional
+
+from django.conf import settings
+
+from . import metrics
+from .services.weather_service import WeatherAPIError
+
+
+# Admission control for upstream-bound work (cache misses, new locations,
+# searches). At most UPSTREAM_MAX_CONCURRENCY such requests per process wait on
+# providers at once; a request that cannot get a slot within
+# UPSTREAM_QUEUE_TIMEOUT_MS is shed, and the view serves an expired entry or a
+# 503 with Retry-After instead. Cache hits never take a slot, so they stay fast
+# while upstream is slow.
+
+
+class Overloaded(WeatherAPIError):
+    """Raised when no upstream slot frees up within the queue timeout."""
+
+
+class Slot:
+    """A held admission slot; release it once (also usable as a context manager)."""
+
+    __slots__ = ('_semaphore',)
+
+    def __init__(self, semaphore: Optional[threading.Semaphore]) -> None:
+        self._semaphore = semaphore
+
+    def release(self) -> None:
+        semaphore, self._semaphore = self._semaphore, None
+        if semaphore is not None:
+            semaphore.release()
+
+    def __enter__(self) -> 'Slot':
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.release()
+
+
+_lock = threading.Lock()
+_semaphore: Optional[threading.Semaphore] = None
+_limit = 0
+
+
+def _current() -> Optional[threading.Semaphore]:
+    """Process semaphore for UPSTREAM_MAX_CONCURRENCY (rebuilt when the setting changes)."""
+    global _semaphore, _limit
+    limit = settings.UPSTREAM_MAX_CONCURRENCY
+    if limit != _limit:
+        with _lock:
+            if limit != _limit:
+                _semaphore = threading.BoundedSemaphore(limit) if limit > 0 else None
+                _limit = limit
+    return _semaphore
+
+
+def admit() -> Slot:
+    """Take an upstream slot, waiting at most UPSTREAM_QUEUE_TIMEOUT_MS.
+
+    Raises:
+        Overloaded: When every slot stayed busy for the whole wait.
+    """
+    semaphore = _current()
+    if semaphore is None:
+        return Slot(None)
+    if not semaphore.acquire(timeout=settings.UPSTREAM_QUEUE_TIMEOUT_MS / 1000.0):
+        metrics.ADMISSIONS.inc(outcome='shed')
+        raise Overloaded('Too many requests waiting on upstream providers')
+    metrics.ADMISSIONS.inc(outcome='admitted')
+    return Slot(semaphore)
@@ -0,0 +1,391 @@
+from __future__ import annotations
+import json
+import math
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+from urllib.parse import parse_qs, urlsplit
+
+
+class Latency:
+    """Latency distribution in milliseconds, parsed from a short spec.
+
+    Specs: '50' (fixed), 'uniform:20:80' (min, max), 'normal:50:10' (mean,
+    stddev) and 'lognormal:50:0.5' (median, sigma). Samples are never negative.
+    """
+
+    KINDS = ('fixed', 'uniform', 'normal', 'lognormal')
+
+    def __init__(self, spec: Union[str, float, int] = 0) -> None:
+        parts = str(spec).split(':')
+        if len(parts) == 1:
+            parts = ['fixed', parts[0]]
+        self.kind = parts[0]
+        if self.kind not in self.KINDS:
+            raise ValueError(f'Unknown latency distribution {self.kind!r}; expected one of {", ".join(self.KINDS)}')
+        try:
+            self.args = [float(p) for p in parts[1:]]
+        except ValueError:
+            raise ValueError(f'Invalid latency spec {spec!r}') from None
+        expected = 1 if self.kind == 'fixed' else 2
+        if len(self.args) != expected:
+            raise ValueError(f'Latency {self.kind!r} takes {expected} parameter(s), got {spec!r}')
+
+    def sample_ms(self, rng: random.Random) -> float:
+        if self.kind == 'fixed':
+            value = self.args[0]
+        elif self.kind == 'uniform':
+            value = rng.uniform(*self.args)
+        elif self.kind == 'normal':
+            value = rng.gauss(*self.args)
+        else:
+            median, sigma = self.args
+            value = median * math.exp(rng.gauss(0.0, sigma)) if median > 0 else 0.0
+        return max(0.0, value)
+
+    def __str__(self) -> str:
+        return ':'.join([self.kind] + [f'{a:g}' for a in self.args])
+
+
+class FakeUpstream:
+    """Local stand-in for OpenWeather, Open-Meteo and Nominatim.
+
+    Speaks the request/response shapes WeatherService uses:
+    OpenWeather `/data/2.5/weather`, `/data/2.5/forecast`, `/geo/1.0/direct`
+    and `/geo/1.0/reverse`; Open-Meteo `/v1/forecast` (including
+    comma-separated coordinate lists), `/v1/search` and `/v1/reverse`; and
+    Nominatim `/search`. Payloads are synthetic and deterministic per
+    coordinate or query. Latency is drawn from a `Latency` distribution and
+    failures are injected at the configured rates from a seeded RNG, so a run
+    is reproducible.
+
+    Point the service at it with OPENWEATHER_URL, OPEN_METEO_URL,
+    OPEN_METEO_GEOCODING_URL and NOMINATIM_URL (all the same base URL):
+
+        with FakeUpstream(latency='normal:50:10', error_rate=0.01) as url:
+            ...
+    """
+
+    def __init__(self, latency: Union[str, float, int, Latency] = 0, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, timeout_rate: float = 0.0, hang_seconds: float = 10.0,
+                 seed: int = 0, host: str = '127.0.0.1', port: int = 0) -> None:
+        self.latency = latency if isinstance(latency, Latency) else Latency(latency)
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.timeout_rate = timeout_rate
+        self.hang_seconds = hang_seconds
+        self.host = host
+        self.port = port
+        self.requests_served = 0
+        self.stats: Dict[Tuple[str, int], int] = {}
+        self._rng = random.Random(seed)
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        if not self._server:
+            raise RuntimeError('FakeUpstream is not running')
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> str:
+        handler = type('Handler', (_Handler,), {'upstream': self})
+        self._server = ThreadingHTTPServer((self.host, self.port), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, kwargs={'poll_interval': 0.05},
+                                        name='fake-upstream', daemon=True)
+        self._thread.start()
+        return self.url
+
+    def serve_forever(self) -> None:
+        self.start()
+        assert self._thread is not None
+        try:
+            while self._thread.is_alive():
+                self._thread.join(0.5)
+        finally:
+            self.stop()
+
+    def stop(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> str:
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
+
+    def plan(self) -> Tuple[float, Optional[int]]:
+        """Draw the delay (seconds) and injected failure status for one request."""
+        with self._lock:
+            self.requests_served += 1
+            delay = self.latency.sample_ms(self._rng) / 1000.0
+            roll = self._rng.random()
+        if roll < self.timeout_rate:
+            return delay + self.hang_seconds, None
+        roll -= self.timeout_rate
+        if roll < self.rate_limit_rate:
+            return delay, 429
+        roll -= self.rate_limit_rate
+        if roll < self.error_rate:
+            return delay, 503
+        return delay, None
+
+    def record(self, path: str, status: int) -> None:
+        with self._lock:
+            self.stats[(path, status)] = self.stats.get((path, status), 0) + 1
+
+
+# ----------------------------
+# Synthetic payloads
+# ----------------------------
+def _day_start() -> datetime:
+    return datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _temperature(lat: float, hour: int) -> float:
+    return round(25.0 - abs(lat) / 3.0 + 6.0 * math.sin((hour % 24 - 9) * math.pi / 12), 1)
+
+
+def _weather_code(lon: float, hour: int) -> int:
+    return (0, 1, 2, 3, 61, 80)[(hour // 6 + int(abs(lon))) % 6]
+
+
+# Open-Meteo WMO code -> OpenWeather condition, matching WeatherService._om_conditions
+_OW_CONDITIONS = {
+    0: (800, 'Clear', 'clear sky', '01d'),
+    1: (801, 'Clouds', 'few clouds', '02d'),
+    2: (802, 'Clouds', 'scattered clouds', '03d'),
+    3: (804, 'Clouds', 'overcast clouds', '04d'),
+    61: (500, 'Rain', 'light rain', '10d'),
+    80: (521, 'Rain', 'shower rain', '09d'),
+}
+
+
+def om_forecast(lat: float, lon: float, days: int) -> Dict[str, Any]:
+    """Open-Meteo /v1/forecast payload, deterministic per coordinate."""
+    start = _day_start()
+    hours = 24 * days
+    temps = [_temperature(lat, h) for h in range(hours)]
+    return {
+        'latitude': lat,
+        'longitude': lon,
+        'timezone': 'GMT',
+        'utc_offset_seconds': 0,
+        'hourly': {
+            'time': [(start + timedelta(hours=h)).strftime('%Y-%m-%dT%H:%M') for h in range(hours)],
+            'temperature_2m': temps,
+            'apparent_temperature': [round(t - 1.5, 1) for t in temps],
+            'relative_humidity_2m': [60 + (h * 7) % 30 for h in range(hours)],
+            'surface_pressure': [1008 + (h % 10) for h in range(hours)],
+            'weather_code': [_weather_code(lon, h) for h in range(hours)],
+            'wind_speed_10m': [round(3.0 + (h % 12) * 0.5, 1) for h in range(hours)],
+            'wind_direction_10m': [(h * 15 + int(abs(lat))) % 360 for h in range(hours)],
+            'visibility': [10000 - (h % 5) * 1000 for h in range(hours)],
+            'cloudcover': [(h * 11) % 100 for h in range(hours)],
+        },
+        'daily': {
+            'time': [(start + timedelta(days=d)).strftime('%Y-%m-%d') for d in range(days)],
+            'temperature_2m_max': [max(temps[d * 24:(d + 1) * 24]) for d in range(days)],
+            'temperature_2m_min': [min(temps[d * 24:(d + 1) * 24]) for d in range(days)],
+            'sunrise': [(start + timedelta(days=d, hours=6)).strftime('%Y-%m-%dT%H:%M') for d in range(days)],
+            'sunset': [(start + timedelta(days=d, hours=18)).strftime('%Y-%m-%dT%H:%M') for d in range(days)],
+        },
+    }
+
+
+def _place(name: str, index: int) -> Dict[str, Any]:
+    seed = sum(map(ord, name.lower()))
+    return {
+        'name': f'{name.title()}{"" if index == 0 else f" {index}"}',
+        'lat': round((seed * (index + 1)) % 180 - 90 + 0.5, 4),
+        'lon': round((seed * 7 * (index + 1)) % 360 - 180 + 0.5, 4),
+        'country': 'TL',
+        'country_name': 'Testland',
+        'state': 'Region',
+    }
+
+
+def om_search(name: str, count: int) -> Dict[str, Any]:
+    return {'results': [{
+        'id': i + 1, 'name': p['name'], 'latitude': p['lat'], 'longitude': p['lon'],
+        'country': p['country_name'], 'country_code': p['country'], 'admin1': p['state'],
+    } for i, p in enumerate(_place(name, i) for i in range(count))]}
+
+
+def om_reverse(lat: float, lon: float) -> Dict[str, Any]:
+    return {'results': [{'name': f'Place {lat:.2f},{lon:.2f}', 'latitude': lat, 'longitude': lon}]}
+
+
+def _ow_entry(lat: float, lon: float, hour: int, ts: int) -> Dict[str, Any]:
+    temp = _temperature(lat, hour)
+    code, main, description, icon = _OW_CONDITIONS[_weather_code(lon, hour)]
+    return {
+        'main': {'temp': temp, 'feels_like': round(temp - 1.5, 1), 'temp_min': round(temp - 1.0, 1),
+                 'temp_max': round(temp + 1.0, 1), 'pressure': 1008 + (hour % 10),
+                 'humidity': 60 + (hour * 7) % 30},
+        'weather': [{'id': code, 'main': main, 'description': description, 'icon': icon}],
+        'clouds': {'all': (hour * 11) % 100},
+        'wind': {'speed': round(3.0 + (hour % 12) * 0.5, 1), 'deg': (hour * 15 + int(abs(lat))) % 360},
+        'visibility': 10000 - (hour % 5) * 1000,
+        'dt': ts,
+    }
+
+
+def ow_weather(lat: float, lon: float) -> Dict[str, Any]:
+    now = datetime.now(timezone.utc)
+    start = _day_start()
+    return {
+        'coord': {'lon': lon, 'lat': lat},
+        **_ow_entry(lat, lon, now.hour, int(now.timestamp())),
+        'base': 'stations',
+        'sys': {'country': 'TL', 'sunrise': int((start + timedelta(hours=6)).timestamp()),
+                'sunset': int((start + timedelta(hours=18)).timestamp())},
+        'timezone': 0,
+        'id': 1,
+        'name': f'Place {lat:.2f},{lon:.2f}',
+        'cod': 200,
+    }
+
+
+def ow_forecast(lat: float, lon: float) -> Dict[str, Any]:
+    start = _day_start()
+    entries = []
+    for i in range(40):
+        at = start + timedelta(hours=3 * i)
+        entries.append({**_ow_entry(lat, lon, 3 * i, int(at.timestamp())), 'dt_txt': at.strftime('%Y-%m-%d %H:%M:%S')})
+    return {'cod': '200', 'message': 0, 'cnt': len(entries), 'list': entries,
+            'city': {'id': 1, 'name': f'Place {lat:.2f},{lon:.2f}', 'coord': {'lat': lat, 'lon': lon},
+                     'country': 'TL', 'timezone': 0}}
+
+
+def ow_direct(query: str, limit: int) -> List[Dict[str, Any]]:
+    name = query.split(',')[0].strip()
+    return [{k: p[k] for k in ('name', 'lat', 'lon', 'country', 'state')} for p in (_place(name, i) for i in range(limit))]
+
+
+def ow_reverse(lat: float, lon: float) -> List[Dict[str, Any]]:
+    return [{'name': f'Place {lat:.2f},{lon:.2f}', 'lat': lat, 'lon': lon, 'country': 'TL'}]
+
+
+def nominatim_search(query: str, limit: int) -> List[Dict[str, Any]]:
+    out = []
+    for i in range(limit):
+        p = _place(query, i)
+        out.append({
+            'place_id': i + 1, 'lat': str(p['lat']), 'lon': str(p['lon']), 'name': p['name'],
+            'display_name': f'{p["name"]}, {p["state"]}, {p["country_name"]}',
+            'address': {'city': p['name'], 'state': p['state'], 'country': p['country_name'],
+                        'country_code': p['country'].lower()},
+        })
+    return out
+
+
+# ----------------------------
+# HTTP handler
+# ----------------------------
+def _param(query: Dict[str, List[str]], name: str, default: Optional[str] = None) -> str:
+    values = query.get(name)
+    if values:
+        return values[0]
+    if default is None:
+        raise ValueError(f'Missing parameter: {name}')
+    return default
+
+
+def _floats(value: str) -> List[float]:
+    return [float(v) for v in value.split(',')]
+
+
+def _route_om_forecast(q: Dict[str, List[str]]) -> Any:
+    lats, lons = _floats(_param(q, 'latitude')), _floats(_param(q, 'longitude'))
+    if len(lats) != len(lons):
+        raise ValueError('Parameter latitude and longitude must have the same number of elements')
+    days = max(1, min(int(_param(q, 'forecast_days', '7')), 16))
+    payloads = [om_forecast(lat, lon, days) for lat, lon in zip(lats, lons)]
+    if len(payloads) == 1:
+        return payloads[0]
+    return [{**p, 'location_id': i} for i, p in enumerate(payloads)]
+
+
+def _requires_appid(route: Callable[[Dict[str, List[str]]], Any]) -> Callable[[Dict[str, List[str]]], Any]:
+    def wrapped(q: Dict[str, List[str]]) -> Any:
+        if not q.get('appid'):
+            raise PermissionError('Invalid API key. Please see https://openweathermap.org/faq#error401 for more info.')
+        return route(q)
+    return wrapped
+
+
+ROUTES: Dict[str, Callable[[Dict[str, List[str]]], Any]] = {
+    '/v1/forecast': _route_om_forecast,
+    '/v1/search': lambda q: om_search(_param(q, 'name'), max(1, min(int(_param(q, 'count', '10')), 100))),
+    '/v1/reverse': lambda q: om_reverse(float(_param(q, 'latitude')), float(_param(q, 'longitude'))),
+    '/search': lambda q: nominatim_search(_param(q, 'q'), max(1, min(int(_param(q, 'limit', '10')), 40))),
+    '/data/2.5/weather': _requires_appid(lambda q: ow_weather(float(_param(q, 'lat')), float(_param(q, 'lon')))),
+    '/data/2.5/forecast': _requires_appid(lambda q: ow_forecast(float(_param(q, 'lat')), float(_param(q, 'lon')))),
+    '/geo/1.0/direct': _requires_appid(lambda q: ow_direct(_param(q, 'q'), max(1, min(int(_param(q, 'limit', '5')), 5)))),
+    '/geo/1.0/reverse': _requires_appid(lambda q: ow_reverse(float(_param(q, 'lat')), float(_param(q, 'lon')))),
+}
+
+
+def _error_body(path: str, status: int, message: str) -> Any:
+    if path.startswith(('/data/', '/geo/')):
+        return {'cod': status, 'message': message}
+    if path == '/search':
+        return {'error': {'code': status, 'message': message}}
+    return {'error': True, 'reason': message}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    upstream: FakeUpstream
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002 - silence per-request logging
+        pass
+
+    def do_GET(self) -> None:  # noqa: N802 - http.server naming
+        parts = urlsplit(self.path)
+        delay, injected = self.upstream.plan()
+        if delay:
+            time.sleep(delay)
+        if injected == 429:
+            self._send(parts.path, 429, _error_body(parts.path, 429, 'Too many requests'))
+            return
+        if injected:
+            self._send(parts.path, injected, _error_body(parts.path, injected, 'Service unavailable'))
+            return
+
+        route = ROUTES.get(parts.path)
+        if route is None:
+            self._send(parts.path, 404, _error_body(parts.path, 404, f'Unknown path {parts.path}'))
+            return
+        try:
+            payload = route(parse_qs(parts.query))
+        except PermissionError as exc:
+            self._send(parts.path, 401, _error_body(parts.path, 401, str(exc)))
+            return
+        except (TypeError, ValueError) as exc:
+            self._send(parts.path, 400, _error_body(parts.path, 400, str(exc)))
+            return
+        self._send(parts.path, 200, payload)
+
+    def _send(self, path: str, status: int, payload: Any) -> None:
+        self.upstream.record(path, status)
+        body = json.dumps(payload).encode('utf-8')
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # Client gave up (e.g. an injected hang outlived its timeout)
+            pass
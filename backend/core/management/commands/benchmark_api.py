@@ -0,0 +1,287 @@
+import json
+import os
+import random
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from core.fake_upstream import FakeUpstream, Latency
+from core.models import Location, UserPreferences, WeatherCache
+
+
+SCENARIOS = ['cached_hit', 'miss', 'list_locations', 'search', 'preferences']
+MIDDLEWARE_PROFILES = ['lean', 'full', 'both']
+UPSTREAM_ENV = ['OPENWEATHER_API_KEY', 'OPENWEATHER_URL', 'OPEN_METEO_URL', 'OPEN_METEO_GEOCODING_URL', 'NOMINATIM_URL']
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not samples:
+        return 0.0
+    rank = max(1, int(round(pct / 100.0 * len(samples))))
+    return samples[min(rank, len(samples)) - 1]
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the API hot paths against a throwaway test database and a local fake upstream. '
+        'Usage: manage.py benchmark_api --sessions=200 --locations=5 --requests=500 --latency=normal:50:10'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sessions', type=int, default=100, help='Number of seeded sessions')
+        parser.add_argument('--locations', type=int, default=5, help='Saved locations per seeded session')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per scenario')
+        parser.add_argument('--warmup', type=int, default=20,
+                            help='Discarded requests per scenario before each profile is measured')
+        parser.add_argument('--latency', type=str, default='50',
+                            help="Fake upstream latency in ms: '50', 'uniform:20:80', 'normal:50:10', 'lognormal:50:0.5'")
+        parser.add_argument('--upstream-error-rate', type=float, default=0.0,
+                            help='Fraction of upstream calls answered 503')
+        parser.add_argument('--upstream-rate-limit-rate', type=float, default=0.0,
+                            help='Fraction of upstream calls answered 429')
+        parser.add_argument('--scenarios', type=str, default=','.join(SCENARIOS),
+                            help=f'Comma-separated subset of: {", ".join(SCENARIOS)}')
+        parser.add_argument('--middleware', type=str, default='lean', choices=MIDDLEWARE_PROFILES,
+                            help="'lean' (API bypasses SITE_MIDDLEWARE), 'full' (every request runs the whole "
+                                 "Django stack with DRF session auth) or 'both' to compare them")
+        parser.add_argument('--seed', type=int, default=42, help='Random seed for data and request order')
+        parser.add_argument('--json', dest='json_path', type=str, default=None, help='Write results to this file')
+        parser.add_argument('--baseline', type=str, default=None,
+                            help='Results file from a previous run; fail if any p95 regresses past --tolerance')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Allowed relative p95 regression against --baseline (default 0.2 = 20%%)')
+
+    def handle(self, *args, **options):
+        scenarios = [s.strip() for s in options['scenarios'].split(',') if s.strip()]
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f'Unknown scenarios: {", ".join(sorted(unknown))}')
+
+        try:
+            latency = Latency(options['latency'])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as fh:
+                baseline = json.load(fh)
+
+        saved_env = {name: os.environ.get(name) for name in UPSTREAM_ENV}
+        setup_test_environment()
+        old_db_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        upstream = FakeUpstream(
+            latency=latency,
+            error_rate=options['upstream_error_rate'],
+            rate_limit_rate=options['upstream_rate_limit_rate'],
+            seed=options['seed'],
+        )
+        try:
+            url = upstream.start()
+            os.environ.pop('OPENWEATHER_API_KEY', None)
+            for name in UPSTREAM_ENV[1:]:
+                os.environ[name] = url
+
+            rng = random.Random(options['seed'])
+            sessions = self._seed(rng, options['sessions'], options['locations'])
+            self.stdout.write(self.style.WARNING(
+                f'Seeded {Location.objects.count()} locations, {WeatherCache.objects.count()} caches, '
+                f'{UserPreferences.objects.count()} preferences; upstream latency {latency} ms'
+            ))
+            results: Dict[str, Dict[str, float]] = {}
+            profiles = ['full', 'lean'] if options['middleware'] == 'both' else [options['middleware']]
+            count, warmup = max(1, options['requests']), max(0, options['warmup'])
+            for n, profile in enumerate(profiles):
+                # Each profile starts from the same cache state, is warmed up
+                # (connections, imports, lazily built middleware) by a discarded
+                # pass, and gets its own miss coordinates and search queries, so
+                # every profile does the same work
+                cache.clear()
+                offset = n * (count + warmup)
+                with self._middleware_profile(profile):
+                    for name in scenarios:
+                        if warmup:
+                            self._run(name, rng, sessions, warmup, upstream, offset=offset + count)
+                        key = f'{name}[full]' if profile == 'full' and len(profiles) > 1 else name
+                        results[key] = self._run(name, rng, sessions, count, upstream, offset=offset)
+        finally:
+            upstream.stop()
+            connection.creation.destroy_test_db(old_db_name, verbosity=0)
+            teardown_test_environment()
+            for name, value in saved_env.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+        self._report(results)
+        if options['middleware'] == 'both':
+            self._report_middleware(results, scenarios)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as fh:
+                json.dump({'options': {k: options[k] for k in ('sessions', 'locations', 'requests', 'latency', 'seed')},
+                           'results': results}, fh, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'Wrote {options["json_path"]}'))
+        if baseline:
+            self._compare(results, baseline.get('results', {}), options['tolerance'])
+
+    # ----------------------------
+    # Seeding
+    # ----------------------------
+    def _seed(self, rng: random.Random, num_sessions: int, per_session: int) -> List[Tuple[str, List[Location]]]:
+        sessions: List[Tuple[str, List[Location]]] = []
+        prefs: List[UserPreferences] = []
+        locs: List[Location] = []
+        for i in range(max(1, num_sessions)):
+            session_id = f'bench{i:06d}'
+            prefs.append(UserPreferences(session_id=session_id, temperature_unit=rng.choice(['C', 'F'])))
+            for j in range(max(1, per_session)):
+                locs.append(Location(
+                    user_id=session_id,
+                    city_name=f'City {i}-{j}',
+                    country='TL',
+                    latitude=round(rng.uniform(-60, 60), 4),
+                    longitude=round(rng.uniform(-180, 180), 4),
+                    is_favorite=j == 0,
+                ))
+        UserPreferences.objects.bulk_create(prefs)
+        Location.objects.bulk_create(locs)
+
+        by_session: Dict[str, List[Location]] = {}
+        for loc in Location.objects.all():
+            by_session.setdefault(loc.user_id, []).append(loc)
+        weather = {
+            'temperature': 18.5, 'feels_like': 17.9, 'humidity': 60, 'pressure': 1012,
+            'weather': 'partly cloudy', 'weather_main': 'Clouds', 'icon': '03d', 'wind_speed': 4.2,
+            'wind_direction': 240, 'visibility': 10000, 'clouds': 40, 'sunrise': 0, 'sunset': 0,
+            'timezone': 0, 'dt': 0,
+        }
+        body = json.dumps(weather, separators=(',', ':')).encode('utf-8')
+        WeatherCache.objects.bulk_create([
+            WeatherCache(location=loc, cache_type=WeatherCache.CACHE_CURRENT, weather_data=weather,
+                         response_body=body, etag=f'bench{loc.id}')
+            for session_locs in by_session.values() for loc in session_locs
+        ])
+        sessions.extend(sorted(by_session.items()))
+        return sessions
+
+    # ----------------------------
+    # Scenarios
+    # ----------------------------
+    def _middleware_profile(self, profile: str) -> Any:
+        """Settings override for a middleware profile ('lean' is the configured stack)."""
+        if profile == 'lean':
+            return override_settings()
+        middleware: List[str] = []
+        for path in settings.MIDDLEWARE:
+            middleware.extend(settings.SITE_MIDDLEWARE if path == 'api.middleware.SiteOnlyMiddleware' else [path])
+        rest_framework = {
+            **settings.REST_FRAMEWORK,
+            'DEFAULT_AUTHENTICATION_CLASSES': [
+                'rest_framework.authentication.SessionAuthentication',
+                'rest_framework.authentication.BasicAuthentication',
+            ],
+            'UNAUTHENTICATED_USER': 'django.contrib.auth.models.AnonymousUser',
+        }
+        return override_settings(MIDDLEWARE=middleware, REST_FRAMEWORK=rest_framework)
+
+    def _run(self, name: str, rng: random.Random, sessions: List[Tuple[str, List[Location]]], count: int,
+             upstream: FakeUpstream, offset: int = 0) -> Dict[str, float]:
+        client = Client()
+        calls_before = upstream.requests_served
+        request: Callable[[int], Any]
+
+        if name == 'cached_hit':
+            def request(i: int) -> Any:
+                session_id, locs = rng.choice(sessions)
+                loc = rng.choice(locs)
+                client.cookies['session_id'] = session_id
+                return client.get('/api/weather/current/', {'lat': str(loc.latitude), 'lon': str(loc.longitude)})
+        elif name == 'miss':
+            def request(i: int) -> Any:
+                client.cookies.pop('session_id', None)
+                # Fresh coordinates every time so nothing is cached yet
+                n = offset + i
+                return client.get('/api/weather/current/', {'lat': f'{-80 + (n % 1600) * 0.1:.4f}',
+                                                            'lon': f'{-170 + (n // 1600) * 0.1:.4f}'})
+        elif name == 'list_locations':
+            def request(i: int) -> Any:
+                return client.get('/api/locations/', {'session_id': rng.choice(sessions)[0]})
+        elif name == 'search':
+            def request(i: int) -> Any:
+                return client.get('/api/locations/search/', {'q': f'city{offset + i}'})
+        else:
+            def request(i: int) -> Any:
+                return client.get('/api/preferences/', {'session_id': rng.choice(sessions)[0]})
+
+        errors = 0
+        samples: List[float] = []
+        started = time.perf_counter()
+        for i in range(max(1, count)):
+            t0 = time.perf_counter()
+            resp = request(i)
+            if resp.streaming:
+                b''.join(resp.streaming_content)
+            samples.append((time.perf_counter() - t0) * 1000.0)
+            if resp.status_code >= 400:
+                errors += 1
+        elapsed = time.perf_counter() - started
+        samples.sort()
+        return {
+            'requests': len(samples),
+            'errors': errors,
+            'upstream_calls': upstream.requests_served - calls_before,
+            'throughput_rps': round(len(samples) / elapsed, 1) if elapsed else 0.0,
+            'mean_ms': round(sum(samples) / len(samples), 3),
+            'p50_ms': round(percentile(samples, 50), 3),
+            'p90_ms': round(percentile(samples, 90), 3),
+            'p95_ms': round(percentile(samples, 95), 3),
+            'p99_ms': round(percentile(samples, 99), 3),
+            'max_ms': round(samples[-1], 3),
+        }
+
+    # ----------------------------
+    # Reporting
+    # ----------------------------
+    def _report(self, results: Dict[str, Dict[str, float]]) -> None:
+        width = max([16] + [len(name) + 2 for name in results])
+        header = (f'{"scenario":<{width}}{"req":>6}{"err":>5}{"upstream":>9}{"req/s":>9}'
+                  f'{"p50":>9}{"p95":>9}{"p99":>9}{"max":>9}')
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for name, r in results.items():
+            self.stdout.write(
+                f'{name:<{width}}{r["requests"]:>6}{r["errors"]:>5}{r["upstream_calls"]:>9}{r["throughput_rps"]:>9.1f}'
+                f'{r["p50_ms"]:>9.2f}{r["p95_ms"]:>9.2f}{r["p99_ms"]:>9.2f}{r["max_ms"]:>9.2f}'
+            )
+        self.stdout.write('(latencies in ms)')
+
+    def _report_middleware(self, results: Dict[str, Dict[str, float]], scenarios: List[str]) -> None:
+        self.stdout.write('Middleware overhead (full stack -> lean API stack):')
+        for name in scenarios:
+            full, lean = results[f'{name}[full]'], results[name]
+            self.stdout.write(
+                f'  {name:<16} p50 {full["p50_ms"]:.3f} -> {lean["p50_ms"]:.3f} ms '
+                f'({full["p50_ms"] - lean["p50_ms"]:+.3f}), mean {full["mean_ms"]:.3f} -> {lean["mean_ms"]:.3f} ms'
+            )
+
+    def _compare(self, results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+                 tolerance: float) -> None:
+        regressions: List[str] = []
+        for name, r in results.items():
+            base: Optional[Dict[str, float]] = baseline.get(name)
+            if not base or not base.get('p95_ms'):
+                continue
+            limit = base['p95_ms'] * (1.0 + tolerance)
+            if r['p95_ms'] > limit:
+                regressions.append(f'{name}: p95 {r["p95_ms"]:.2f} ms > {limit:.2f} ms (baseline {base["p95_ms"]:.2f})')
+        if regressions:
+            raise CommandError('Latency regression against baseline:\n  ' + '\n  '.join(regressions))
+        self.stdout.write(self.style.SUCCESS(f'No p95 regression beyond {tolerance:.0%} of baseline'))
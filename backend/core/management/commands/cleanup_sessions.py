@@ -0,0 +1,112 @@
+import time
+from datetime import timedelta
+from typing import Dict, List
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from core import session_context
+from core.models import Location, UserPreferences, WeatherCache
+
+
+class Command(BaseCommand):
+    help = ('Delete locations, weather caches and preferences of sessions inactive for --days, in batches. '
+            'Usage: manage.py cleanup_sessions --days=30 --batch-size=500 [--dry-run]')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help='Inactivity (days) before a session is removed')
+        parser.add_argument('--batch-size', type=int, default=500, help='Sessions (or shared locations) per batch')
+        parser.add_argument('--sleep', type=float, default=0.0,
+                            help='Seconds to pause between batches, to let other writers in')
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would be deleted')
+
+    def handle(self, *args, **options):
+        if options['days'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--days and --batch-size must be positive')
+        self.dry_run = options['dry_run']
+        self.batch_size = options['batch_size']
+        self.sleep = options['sleep']
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        self.totals: Dict[str, int] = {'sessions': 0, 'locations': 0, 'caches': 0, 'preferences': 0}
+        started = time.perf_counter()
+
+        # A session's last activity is its newest location update, cache entry
+        # or preferences update; shared-owner locations are judged one by one
+        active = (
+            Location.objects.filter(Q(updated_at__gte=cutoff) | Q(caches__cached_at__gte=cutoff)).values('user_id')
+        )
+        active_prefs = UserPreferences.objects.filter(updated_at__gte=cutoff).values('session_id')
+        with_locations = (
+            Location.objects.exclude(user_id=Location.SHARED_USER_ID)
+            .exclude(user_id__in=active).exclude(user_id__in=active_prefs)
+            .values_list('user_id', flat=True).distinct().order_by('user_id')
+        )
+        prefs_only = (
+            UserPreferences.objects.exclude(session_id__in=active).exclude(session_id__in=active_prefs)
+            .exclude(session_id__in=Location.objects.values('user_id'))
+            .values_list('session_id', flat=True).order_by('session_id')
+        )
+        shared = (
+            Location.objects.filter(user_id=Location.SHARED_USER_ID, updated_at__lt=cutoff)
+            .exclude(caches__cached_at__gte=cutoff).values_list('pk', flat=True).order_by('pk')
+        )
+        self._batches(with_locations, 'user_id', self._delete_sessions)
+        self._batches(prefs_only, 'session_id', self._delete_sessions)
+        self._batches(shared, 'pk', self._delete_shared)
+
+        elapsed = time.perf_counter() - started
+        rows = self.totals['locations'] + self.totals['caches'] + self.totals['preferences']
+        rate = rows / elapsed if elapsed else 0
+        verb = 'Would delete' if self.dry_run else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {self.totals['sessions']} inactive sessions (before {cutoff:%Y-%m-%d %H:%M}): "
+            f"{self.totals['locations']} locations, {self.totals['caches']} cache entries, "
+            f"{self.totals['preferences']} preferences in {elapsed:.2f}s ({rate:.0f} rows/s)."
+        ))
+
+    def _batches(self, queryset, field: str, delete) -> None:
+        """Walk `queryset` by keyset pagination on `field` (stable under deletes and dry runs)."""
+        last = None
+        while True:
+            page = queryset.filter(**{f'{field}__gt': last}) if last is not None else queryset
+            keys = list(page[:self.batch_size])
+            if not keys:
+                return
+            started = time.perf_counter()
+            counts = delete(keys)
+            elapsed = time.perf_counter() - started
+            for name, n in counts.items():
+                self.totals[name] += n
+            rows = sum(n for name, n in counts.items() if name != 'sessions')
+            self.stdout.write(
+                f"  batch of {len(keys)}: {counts.get('locations', 0)} locations, {counts.get('caches', 0)} caches, "
+                f"{counts.get('preferences', 0)} preferences in {elapsed:.3f}s "
+                f"({rows / elapsed if elapsed else 0:.0f} rows/s)"
+            )
+            last = keys[-1]
+            if self.sleep:
+                time.sleep(self.sleep)
+
+    def _delete_sessions(self, session_ids: List[str]) -> Dict[str, int]:
+        prefs = UserPreferences.objects.filter(session_id__in=session_ids)
+        caches = WeatherCache.objects.filter(location__user_id__in=session_ids)
+        locations = Location.objects.filter(user_id__in=session_ids)
+        if self.dry_run:
+            return {'sessions': len(session_ids), 'preferences': prefs.count(), 'caches': caches.count(),
+                    'locations': locations.count()}
+        with transaction.atomic():
+            # Preferences first, so deleting locations does not null their default_location
+            counts = {'sessions': len(session_ids), 'preferences': prefs.delete()[0],
+                      'caches': caches.delete()[0], 'locations': locations.delete()[0]}
+        session_context.invalidate_many(session_ids)
+        return counts
+
+    def _delete_shared(self, pks: List[int]) -> Dict[str, int]:
+        caches = WeatherCache.objects.filter(location_id__in=pks)
+        locations = Location.objects.filter(pk__in=pks)
+        if self.dry_run:
+            return {'caches': caches.count(), 'locations': locations.count()}
+        with transaction.atomic():
+            return {'caches': caches.delete()[0], 'locations': locations.delete()[0]}
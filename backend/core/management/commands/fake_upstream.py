@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.fake_upstream import FakeUpstream, Latency
+
+
+class Command(BaseCommand):
+    help = (
+        'Run a local stand-in for OpenWeather, Open-Meteo and Nominatim. '
+        'Usage: manage.py fake_upstream --port=8765 --latency=normal:50:10 --error-rate=0.01'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', type=str, default='127.0.0.1', help='Interface to bind')
+        parser.add_argument('--port', type=int, default=8765, help='Port to bind')
+        parser.add_argument('--latency', type=str, default='0',
+                            help="Latency in ms: '50', 'uniform:20:80', 'normal:50:10' or 'lognormal:50:0.5'")
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered 503')
+        parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Fraction of requests answered 429')
+        parser.add_argument('--timeout-rate', type=float, default=0.0,
+                            help='Fraction of requests held for --hang-seconds before answering')
+        parser.add_argument('--hang-seconds', type=float, default=10.0, help='Delay added to timed-out requests')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for latency and failure injection')
+
+    def handle(self, *args, **options):
+        try:
+            latency = Latency(options['latency'])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        upstream = FakeUpstream(
+            latency=latency,
+            error_rate=options['error_rate'],
+            rate_limit_rate=options['rate_limit_rate'],
+            timeout_rate=options['timeout_rate'],
+            hang_seconds=options['hang_seconds'],
+            seed=options['seed'],
+            host=options['host'],
+            port=options['port'],
+        )
+        url = f'http://{options["host"]}:{options["port"]}'
+        self.stdout.write(self.style.SUCCESS(f'Fake upstream on {url} (latency {latency})'))
+        self.stdout.write('Point the backend at it with:')
+        for name in ('OPENWEATHER_URL', 'OPEN_METEO_URL', 'OPEN_METEO_GEOCODING_URL', 'NOMINATIM_URL'):
+            self.stdout.write(f'  export {name}={url}')
+        try:
+            upstream.serve_forever()
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('Stopped.'))
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.profiling import make_token
+
+
+class Command(BaseCommand):
+    help = 'Print a signed X-Profile header value that forces profiling of a request.'
+
+    def handle(self, *args, **options):
+        self.stdout.write(make_token())
+        self.stderr.write(
+            f'Valid for {settings.PROFILING_TOKEN_MAX_AGE} s; send as `X-Profile: <token>` '
+            f'(PROFILING_ENABLED must be True).'
+        )
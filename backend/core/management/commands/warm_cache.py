@@ -0,0 +1,80 @@
+import time
+from datetime import timedelta
+from typing import Dict, List, Tuple
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from api.cache_entries import new_entry
+from core.models import Location, WeatherCache
+from core.services.weather_service import WeatherService
+
+
+class Command(BaseCommand):
+    help = ('Refresh WeatherCache entries that are missing or about to expire, fetching saved locations '
+            'in batched upstream requests. Usage: manage.py warm_cache --type=both --ahead=120')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--type', choices=['current', 'forecast', 'both'], default='both',
+                            help='Cache type(s) to warm')
+        parser.add_argument('--days', type=int, default=7, help='Forecast days to fetch')
+        parser.add_argument('--ahead', type=int, default=120,
+                            help='Also refresh entries expiring within this many seconds')
+        parser.add_argument('--limit', type=int, default=0, help='Max distinct coordinates per type (0 = all)')
+        parser.add_argument('--batch-size', type=int, default=0,
+                            help='Coordinates per upstream request (default OPEN_METEO_BATCH_SIZE)')
+
+    def handle(self, *args, **options):
+        service = WeatherService()
+        if options['batch_size'] < 0:
+            raise CommandError('--batch-size must be positive')
+        if options['batch_size']:
+            service.batch_size = options['batch_size']
+        days = max(1, min(int(options['days']), 7))
+        types = [WeatherCache.CACHE_CURRENT, WeatherCache.CACHE_FORECAST] if options['type'] == 'both' \
+            else [options['type']]
+        for cache_type in types:
+            self._warm(service, cache_type, days, options['ahead'], options['limit'])
+
+    def _stale_locations(self, cache_type: str, ahead: int) -> List[Location]:
+        # Latest entry per location older than (TTL - ahead), or no entry at all
+        cutoff = timezone.now() - WeatherCache.ttl_for(cache_type) + timedelta(seconds=max(0, ahead))
+        return list(
+            Location.objects.annotate(
+                latest=Max('caches__cached_at', filter=Q(caches__cache_type=cache_type)),
+            ).filter(Q(latest__isnull=True) | Q(latest__lt=cutoff)).order_by('pk')
+        )
+
+    def _warm(self, service: WeatherService, cache_type: str, days: int, ahead: int, limit: int) -> None:
+        groups: Dict[Tuple[float, float], List[Location]] = {}
+        for loc in self._stale_locations(cache_type, ahead):
+            groups.setdefault((float(loc.latitude), float(loc.longitude)), []).append(loc)
+        coords = list(groups)[:limit] if limit > 0 else list(groups)
+        if not coords:
+            self.stdout.write(self.style.WARNING(f'No {cache_type} entries to warm.'))
+            return
+
+        started = time.perf_counter()
+        entries: List[WeatherCache] = []
+        for i in range(0, len(coords), service.batch_size):
+            chunk = coords[i:i + service.batch_size]
+            try:
+                if cache_type == WeatherCache.CACHE_CURRENT:
+                    results = service.get_current_weather_many(chunk)
+                else:
+                    results = service.get_forecast_many(chunk, days=days)
+            except Exception as exc:
+                self.stderr.write(self.style.ERROR(f'Batch of {len(chunk)} {cache_type} fetches failed: {exc}'))
+                continue
+            for coord, result in zip(chunk, results):
+                for loc in groups[coord]:
+                    if cache_type == WeatherCache.CACHE_CURRENT:
+                        entries.append(new_entry(loc, cache_type, result, weather_data=result))
+                    else:
+                        entries.append(new_entry(loc, cache_type, result.get('days'), forecast_data=result))
+        WeatherCache.objects.bulk_create(entries)
+        self.stdout.write(self.style.SUCCESS(
+            f'Warmed {len(entries)} {cache_type} entries for {len(coords)} coordinates '
+            f'in {time.perf_counter() - started:.2f}s.'
+        ))
@@ -0,0 +1,210 @@
+from __future__ import annotations
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+
+
+# Minimal Prometheus-style counters and histograms.
+#
+# Each process keeps its own values in memory. When METRICS_DIR is set (one
+# shared directory per host, like prometheus_client's multiprocess mode) every
+# process also writes a snapshot file there at most every
+# METRICS_FLUSH_SECONDS, and the exposition endpoint sums all snapshots, so a
+# scrape that lands on any gunicorn worker reports totals for all of them.
+# Snapshot files of exited workers are kept so totals stay monotonic.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+_lock = threading.Lock()
+_registry: Dict[str, '_Metric'] = {}
+_started = int(time.time())
+_last_flush = 0.0
+
+
+def _key(labelnames: Sequence[str], labels: Dict[str, object]) -> LabelKey:
+    return tuple((name, str(labels.get(name, ''))) for name in labelnames)
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        _registry[name] = self
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: object) -> None:
+        key = _key(self.labelnames, labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # Per label set: [count per bucket..., +Inf count, sum]
+        self.values: Dict[LabelKey, List[float]] = {}
+
+    def observe(self, value: float, **labels: object) -> None:
+        key = _key(self.labelnames, labels)
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with _lock:
+            row = self.values.get(key)
+            if row is None:
+                row = self.values[key] = [0.0] * (len(self.buckets) + 2)
+            row[index] += 1
+            row[-1] += value
+
+
+# ----------------------------
+# Application metrics
+# ----------------------------
+CACHE_LOOKUPS = Counter('weather_cache_lookups_total', 'WeatherCache lookups by cache type and result (hit, miss, expired, stale).',
+                        ('type', 'result'))
+UPSTREAM_REQUESTS = Counter('weather_upstream_requests_total', 'Upstream provider calls by HTTP status or failure kind.',
+                            ('provider', 'status'))
+UPSTREAM_LATENCY = Histogram('weather_upstream_request_duration_seconds', 'Upstream provider call latency.',
+                             ('provider',))
+GEOCODING_FALLBACKS = Counter('weather_geocoding_fallbacks_total', 'Geocoding fallbacks taken, by fallback used.',
+                              ('fallback',))
+API_REQUESTS = Counter('api_requests_total', 'API responses by endpoint and status code.', ('endpoint', 'status'))
+API_LATENCY = Histogram('api_request_duration_seconds', 'API request latency by endpoint.', ('endpoint',))
+DB_QUERIES = Counter('api_db_queries_total', 'Database queries executed by endpoint.', ('endpoint',))
+ADMISSIONS = Counter('api_upstream_admissions_total', 'Upstream-bound requests by admission outcome (admitted, shed).',
+                     ('outcome',))
+WRITE_BEHIND_ROWS = Counter('write_behind_rows_total', 'Buffered rows by model and outcome (inserted, dropped, retried).',
+                            ('model', 'outcome'))
+
+
+# ----------------------------
+# Multi-process snapshots
+# ----------------------------
+def _snapshot() -> Dict[str, Dict[str, object]]:
+    with _lock:
+        return {
+            name: {json.dumps(key): (list(v) if isinstance(v, list) else v) for key, v in metric.values.items()}
+            for name, metric in _registry.items()
+        }
+
+
+def _snapshot_path(directory: str) -> str:
+    return os.path.join(directory, f'metrics-{os.getpid()}-{_started}.json')
+
+
+def flush(force: bool = False) -> None:
+    """Write this process's snapshot to METRICS_DIR (throttled unless forced)."""
+    global _last_flush
+    directory = settings.METRICS_DIR
+    if not directory:
+        return
+    now = time.monotonic()
+    if not force and now - _last_flush < settings.METRICS_FLUSH_SECONDS:
+        return
+    _last_flush = now
+    os.makedirs(directory, exist_ok=True)
+    path = _snapshot_path(directory)
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as fh:
+        json.dump(_snapshot(), fh)
+    os.replace(tmp, path)
+
+
+atexit.register(lambda: flush(force=True))
+
+
+def _merge(target: Dict[str, Dict[str, object]], snapshot: Dict[str, Dict[str, object]]) -> None:
+    for name, series in snapshot.items():
+        merged = target.setdefault(name, {})
+        for key, value in series.items():
+            current = merged.get(key)
+            if current is None:
+                merged[key] = list(value) if isinstance(value, list) else value
+            elif isinstance(value, list):
+                merged[key] = [a + b for a, b in zip(current, value)]  # type: ignore[arg-type]
+            else:
+                merged[key] = current + value  # type: ignore[operator]
+
+
+def collect() -> Dict[str, Dict[str, object]]:
+    """Values summed over every process that has written a snapshot."""
+    directory = settings.METRICS_DIR
+    if not directory:
+        return _snapshot()
+    flush(force=True)
+    totals: Dict[str, Dict[str, object]] = {}
+    for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+        try:
+            with open(path) as fh:
+                _merge(totals, json.load(fh))
+        except (OSError, ValueError):
+            continue
+    return totals
+
+
+# ----------------------------
+# Text exposition (format 0.0.4)
+# ----------------------------
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(pairs: Iterable[Tuple[str, str]]) -> str:
+    body = ','.join(f'{name}="{_escape(value)}"' for name, value in pairs)
+    return f'{{{body}}}' if body else ''
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def render(gauges: Optional[Dict[str, Tuple[str, Dict[LabelKey, float]]]] = None) -> str:
+    """Render all metrics, plus scrape-time `gauges` (name -> (help, values))."""
+    values = collect()
+    lines: List[str] = []
+    for name, metric in _registry.items():
+        lines.append(f'# HELP {name} {metric.documentation}')
+        lines.append(f'# TYPE {name} {metric.kind}')
+        for raw_key, value in sorted(values.get(name, {}).items()):
+            pairs = [tuple(p) for p in json.loads(raw_key)]
+            if isinstance(metric, Histogram):
+                row = value  # type: ignore[assignment]
+                cumulative = 0.0
+                for bound, count in zip(list(metric.buckets) + [float('inf')], row[:-1]):  # type: ignore[index]
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else _number(bound)
+                    lines.append(f'{name}_bucket{_labels(pairs + [("le", le)])} {_number(cumulative)}')
+                lines.append(f'{name}_sum{_labels(pairs)} {repr(float(row[-1]))}')  # type: ignore[index]
+                lines.append(f'{name}_count{_labels(pairs)} {_number(cumulative)}')
+            else:
+                lines.append(f'{name}{_labels(pairs)} {_number(value)}')  # type: ignore[arg-type]
+    for name, (documentation, series) in (gauges or {}).items():
+        lines.append(f'# HELP {name} {documentation}')
+        lines.append(f'# TYPE {name} gauge')
+        for key, value in sorted(series.items()):
+            lines.append(f'{name}{_labels(key)} {_number(value)}')
+    return '\n'.join(lines) + '\n'
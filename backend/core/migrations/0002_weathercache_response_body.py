@@ -0,0 +1,23 @@
+# Generated by Django 5.0.1 on 2026-10-19 01:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='weathercache',
+            name='etag',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='weathercache',
+            name='response_body',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-19 01:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_weathercache_response_body'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='weathercache',
+            name='response_gzip',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
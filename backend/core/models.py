@@ -5,6 +5,9 @@ from typing import Optional
 
 
 class Location(models.Model):
+    # Owner of locations created by weather requests that carry no session
+    SHARED_USER_ID = '__shared__'
+
     user_id = models.CharField(max_length=255, db_index=True)
     city_name = models.CharField(max_length=100)
     country = models.CharField(max_length=100)
@@ -54,6 +57,12 @@ class WeatherCache(models.Model):
     forecast_data = models.JSONField(null=True, blank=True)
     cache_type = models.CharField(max_length=10, choices=CACHE_TYPE_CHOICES)
     cached_at = models.DateTimeField(auto_now_add=True)
+    # Serialized `data` member of the API response and its content hash, so
+    # hits are served without decoding/re-encoding the JSON columns above
+    response_body = models.BinaryField(null=True, blank=True, editable=False)
+    etag = models.CharField(max_length=64, blank=True, default='')
+    # `response_body` precompressed as spliceable deflate blocks (large bodies only)
+    response_gzip = models.BinaryField(null=True, blank=True, editable=False)
 
     class Meta:
         ordering = ['-cached_at']
@@ -63,10 +72,17 @@ class WeatherCache(models.Model):
             models.Index(fields=['cache_type']),
         ]
 
+    @classmethod
+    def ttl_for(cls, cache_type: str) -> timedelta:
+        return timedelta(minutes=10) if cache_type == cls.CACHE_CURRENT else timedelta(hours=1)
+
     def is_valid(self) -> bool:
         now = timezone.now()
-        ttl = timedelta(minutes=10) if self.cache_type == self.CACHE_CURRENT else timedelta(hours=1)
-        return self.cached_at >= now - ttl
+        return self.cached_at >= now - self.ttl_for(self.cache_type)
+
+    def remaining_seconds(self) -> int:
+        expires_at = self.cached_at + self.ttl_for(self.cache_type)
+        return max(0, int((expires_at - timezone.now()).total_seconds()))
 
     def get_age_minutes(self) -> int:
         delta = timezone.now() - self.cached_at
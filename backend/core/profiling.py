@@ -0,0 +1,85 @@
+from __future__ import annotations
+import cProfile
+import os
+import random
+import re
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core import signing
+
+
+# On-demand cProfile captures of single requests.
+#
+# A request is profiled when it falls into PROFILING_SAMPLE_RATE or carries an
+# `X-Profile` header holding a token from `make_token()` (see the
+# `profile_token` command). Captures are written to PROFILING_DIR as standard
+# .prof files (pstats, snakeviz) and the oldest are removed beyond
+# PROFILING_MAX_FILES.
+
+TOKEN_SALT = 'core.profiling'
+_NAME_RE = re.compile(r'^[\w.-]+\.prof$')
+
+
+def make_token() -> str:
+    """A signed `X-Profile` header value, valid for PROFILING_TOKEN_MAX_AGE seconds."""
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign('profile')
+
+
+def token_valid(token: str) -> bool:
+    try:
+        signing.TimestampSigner(salt=TOKEN_SALT).unsign(token, max_age=settings.PROFILING_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def should_profile(header: Optional[str]) -> bool:
+    if header:
+        return token_valid(header)
+    rate = settings.PROFILING_SAMPLE_RATE
+    return rate > 0 and random.random() < rate
+
+
+def run(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Tuple[Any, cProfile.Profile, float]:
+    """Call `func` under cProfile; returns (result, profile, wall seconds)."""
+    profile = cProfile.Profile()
+    started = time.perf_counter()
+    result = profile.runcall(func, *args, **kwargs)
+    return result, profile, time.perf_counter() - started
+
+
+def save(profile: cProfile.Profile, label: str, seconds: float) -> str:
+    """Write a capture to PROFILING_DIR, rotate old ones, return the file name."""
+    directory = settings.PROFILING_DIR
+    os.makedirs(directory, exist_ok=True)
+    slug = re.sub(r'[^\w-]+', '-', label).strip('-')[:60] or 'request'
+    name = f'{time.strftime("%Y%m%dT%H%M%S")}-{uuid.uuid4().hex[:8]}-{slug}-{int(seconds * 1000)}ms.prof'
+    profile.dump_stats(os.path.join(directory, name))
+    for stale in list_profiles()[settings.PROFILING_MAX_FILES:]:
+        try:
+            os.remove(os.path.join(directory, stale['name']))
+        except OSError:
+            pass
+    return name
+
+
+def list_profiles() -> List[Dict[str, Any]]:
+    """Stored captures, newest first."""
+    directory = settings.PROFILING_DIR
+    try:
+        entries = [e for e in os.scandir(directory) if e.is_file() and _NAME_RE.match(e.name)]
+    except FileNotFoundError:
+        return []
+    rows = [{'name': e.name, 'size': e.stat().st_size, 'modified': e.stat().st_mtime} for e in entries]
+    return sorted(rows, key=lambda r: (r['modified'], r['name']), reverse=True)
+
+
+def profile_path(name: str) -> Optional[str]:
+    """Absolute path of a stored capture, or None for unknown/unsafe names."""
+    if not _NAME_RE.match(name):
+        return None
+    path = os.path.join(settings.PROFILING_DIR, name)
+    return path if os.path.isfile(path) else None
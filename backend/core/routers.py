@@ -0,0 +1,47 @@
+from __future__ import annotations
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator, Optional
+
+from django.conf import settings
+
+
+# Reads go to a random replica from REPLICA_DATABASES unless the current
+# request is pinned to the primary: unsafe requests always are, and so is a
+# client for REPLICA_PIN_SECONDS after a successful write
+# (api.middleware.ReplicaPinMiddleware), so it reads its own writes.
+
+_pinned: ContextVar[bool] = ContextVar('db_pinned_to_primary', default=False)
+
+
+@contextmanager
+def pin_primary() -> Iterator[None]:
+    """Route reads inside the block to the primary."""
+    token = _pinned.set(True)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+def is_pinned() -> bool:
+    return _pinned.get()
+
+
+class ReplicaRouter:
+    def db_for_read(self, model: Any, **hints: Any) -> Optional[str]:
+        replicas = settings.REPLICA_DATABASES
+        if not replicas or _pinned.get():
+            return 'default'
+        return random.choice(replicas)
+
+    def db_for_write(self, model: Any, **hints: Any) -> Optional[str]:
+        return 'default'
+
+    def allow_relation(self, obj1: Any, obj2: Any, **hints: Any) -> Optional[bool]:
+        # Replicas mirror the primary, so objects from any of them may relate
+        return True
+
+    def allow_migrate(self, db: str, app_label: str, model_name: Optional[str] = None, **hints: Any) -> Optional[bool]:
+        return db == 'default'
@@ -0,0 +1,56 @@
+from __future__ import annotations
+import hashlib
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+# Short-lived markers for upstream calls that just failed or came back empty.
+# They live in the Django cache, shared by all workers when CACHE_URL points at
+# a shared backend, so repeats of the same call fail fast for a few seconds
+# instead of every request waiting on a provider that is down. TTLs depend on
+# the kind of failure; a TTL of 0 disables that kind.
+
+CLIENT_ERROR = '4xx'
+SERVER_ERROR = '5xx'  # also 429: worth retrying soon, not per-key
+TIMEOUT = 'timeout'  # only calls given the full timeout, not one cut short by a deadline
+CONNECTION_ERROR = 'connection'  # refused, reset, DNS and other transport errors
+EMPTY = 'empty'  # answered, but nothing found
+
+
+def _ttl(kind: str) -> int:
+    return {
+        CLIENT_ERROR: settings.UPSTREAM_NEGATIVE_TTL_4XX,
+        SERVER_ERROR: settings.UPSTREAM_NEGATIVE_TTL_5XX,
+        TIMEOUT: settings.UPSTREAM_NEGATIVE_TTL_TIMEOUT,
+        CONNECTION_ERROR: settings.UPSTREAM_NEGATIVE_TTL_CONNECTION,
+        EMPTY: settings.UPSTREAM_NEGATIVE_TTL_EMPTY,
+    }[kind]
+
+
+def key(*parts: Any) -> str:
+    return 'negative:' + hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def request_key(provider: str, url: str, params: Dict[str, Any]) -> str:
+    return key(provider, url, sorted((name, str(value)) for name, value in params.items()))
+
+
+def kind_for_status(status: int) -> Optional[str]:
+    if status == 429 or status >= 500:
+        return SERVER_ERROR
+    if status >= 400:
+        return CLIENT_ERROR
+    return None
+
+
+def get(cache_key: str) -> Optional[str]:
+    """Kind of the recent failure recorded under `cache_key`, if any."""
+    return cache.get(cache_key)
+
+
+def remember(cache_key: str, kind: str) -> None:
+    ttl = _ttl(kind)
+    if ttl > 0:
+        cache.set(cache_key, kind, ttl)
@@ -1,10 +1,17 @@
 import logging
 import os
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
 from datetime import datetime
-from typing import Any, Dict, List, Optional
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import requests
 
+from core import metrics
+from core.timing import span
+from . import negative_cache
+
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +28,33 @@ class RateLimitExceeded(WeatherAPIError):
     """Raised when the API rate limit is exceeded (HTTP 429)."""
 
 
+class UpstreamSuppressed(WeatherAPIError):
+    """Raised instead of repeating an upstream call that failed moments ago."""
+
+
+class DeadlineExceeded(WeatherAPIError):
+    """Raised when the request's upstream budget is spent before a call can start."""
+
+
+# Calls (and fallbacks) are not started with less budget left than this
+MIN_CALL_SECONDS = 0.25
+
+
+class Deadline:
+    """Upstream time budget shared by every call made for one request."""
+
+    __slots__ = ('expires',)
+
+    def __init__(self, seconds: float) -> None:
+        self.expires = perf_counter() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires - perf_counter())
+
+    def allows_call(self) -> bool:
+        return self.remaining() >= MIN_CALL_SECONDS
+
+
 class WeatherService:
     """Service to interact with the OpenWeatherMap API.
 
@@ -28,16 +62,30 @@ class WeatherService:
     geocoding (city search), and reverse geocoding.
     """
 
-    def __init__(self, api_key: Optional[str] = None) -> None:
+    def __init__(self, api_key: Optional[str] = None, deadline: Optional[Deadline] = None) -> None:
         """Initialize the service.
 
         Args:
             api_key: Optional explicit API key; if None, uses OPENWEATHER_API_KEY env.
+            deadline: Optional request budget; every call's timeout is capped by
+                what is left of it and fallbacks are skipped once it runs low.
         """
         self.api_key = api_key or os.getenv('OPENWEATHER_API_KEY', '')
-        self.base_url = 'https://api.openweathermap.org/data/2.5'
-        self.geo_url = 'https://api.openweathermap.org/geo/1.0'
+        self.deadline = deadline
+        # Provider hosts can be overridden to point at a local stand-in server
+        openweather_url = os.getenv('OPENWEATHER_URL', 'https://api.openweathermap.org').rstrip('/')
+        self.base_url = f'{openweather_url}/data/2.5'
+        self.geo_url = f'{openweather_url}/geo/1.0'
+        self.open_meteo_url = os.getenv('OPEN_METEO_URL', 'https://api.open-meteo.com').rstrip('/')
+        self.open_meteo_geocoding_url = os.getenv(
+            'OPEN_METEO_GEOCODING_URL', 'https://geocoding-api.open-meteo.com'
+        ).rstrip('/')
+        self.nominatim_url = os.getenv('NOMINATIM_URL', 'https://nominatim.openstreetmap.org').rstrip('/')
         self.timeout_seconds = 5
+        # Open-Meteo coordinates per batched request, and how long (ms) a miss
+        # waits for concurrent misses to share its request (0 disables)
+        self.batch_size = max(1, int(os.getenv('OPEN_METEO_BATCH_SIZE', '50')))
+        self.coalesce_window = float(os.getenv('UPSTREAM_COALESCE_WINDOW_MS', '0')) / 1000.0
 
     # ----------------------------
     # Open-Meteo fallbacks (no API key required)
@@ -77,9 +125,27 @@ class WeatherService:
         return {"description": desc, "main": main, "icon": icon}
 
     def _om_fetch(self, lat: float, lon: float, days: int) -> Dict[str, Any]:
+        if self.coalesce_window > 0:
+            # Concurrent misses in this process share one batched upstream call
+            try:
+                return _coalescer(self, days).get((lat, lon), timeout=self._call_timeout())
+            except FutureTimeout:
+                raise DeadlineExceeded('Request deadline exceeded waiting for a batched fetch') from None
+        return self._om_fetch_many([(lat, lon)], days)[0]
+
+    def _om_fetch_many(self, coords: List[Tuple[float, float]], days: int) -> List[Dict[str, Any]]:
+        """Open-Meteo forecasts for several coordinates, OPEN_METEO_BATCH_SIZE per request."""
+        results: List[Dict[str, Any]] = []
+        for start in range(0, len(coords), self.batch_size):
+            chunk = coords[start:start + self.batch_size]
+            results.extend(self._om_fetch_batch(chunk, days))
+        return results
+
+    def _om_fetch_batch(self, coords: List[Tuple[float, float]], days: int) -> List[Dict[str, Any]]:
         params = {
-            'latitude': lat,
-            'longitude': lon,
+            # Comma-separated lists fetch every coordinate in one request
+            'latitude': ','.join(str(lat) for lat, _ in coords),
+            'longitude': ','.join(str(lon) for _, lon in coords),
             'timezone': 'auto',
             # Hourly for rich current + hourly forecast
             'hourly': ','.join([
@@ -95,11 +161,124 @@ class WeatherService:
             ]),
             # Daily for min/max and sunrise/sunset
             'daily': 'temperature_2m_max,temperature_2m_min,sunrise,sunset',
+            # Metric like OpenWeather's units=metric (Open-Meteo defaults to km/h)
+            'wind_speed_unit': 'ms',
             'forecast_days': max(1, min(int(days), 7)),
         }
-        resp = requests.get('https://api.open-meteo.com/v1/forecast', params=params, timeout=self.timeout_seconds)
+        resp = self._http_get('open-meteo', f'{self.open_meteo_url}/v1/forecast', params=params)
         resp.raise_for_status()
-        return resp.json() or {}
+        payload = resp.json() or {}
+        # A single coordinate comes back as an object, several as a list in request order
+        payload_list = payload if isinstance(payload, list) else [payload]
+        if len(payload_list) != len(coords):
+            raise WeatherAPIError(f'Open-Meteo returned {len(payload_list)} results for {len(coords)} locations')
+        return payload_list
+
+    def _om_current(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Map an Open-Meteo forecast response to current conditions."""
+        tz_offset = 0
+        try:
+            # Open-Meteo returns ISO strings; for dt, use current UTC ts
+            from datetime import timezone as _tz
+            tz_offset = 0
+        except Exception:
+            tz_offset = 0
+        hourly = data.get('hourly') or {}
+        daily = (data.get('daily') or {})
+        # Take first hour as current approximation
+        temp = (hourly.get('temperature_2m') or [None])[0]
+        feels = (hourly.get('apparent_temperature') or [None])[0]
+        rh = (hourly.get('relative_humidity_2m') or [None])[0]
+        sp = (hourly.get('surface_pressure') or [None])[0]
+        wc = (hourly.get('weather_code') or [0])[0]
+        ws = (hourly.get('wind_speed_10m') or [None])[0]
+        wd = (hourly.get('wind_direction_10m') or [None])[0]
+        vis = (hourly.get('visibility') or [None])[0]
+        cc = (hourly.get('cloudcover') or [None])[0]
+        cond = self._om_conditions(wc)
+        # sunrise/sunset for today
+        sunrise = None
+        sunset = None
+        try:
+            sunrise_str = (daily.get('sunrise') or [None])[0]
+            sunset_str = (daily.get('sunset') or [None])[0]
+            if sunrise_str:
+                sunrise = int(datetime.fromisoformat(sunrise_str.replace('Z', '+00:00')).timestamp())
+            if sunset_str:
+                sunset = int(datetime.fromisoformat(sunset_str.replace('Z', '+00:00')).timestamp())
+        except Exception:
+            pass
+        return {
+            'temperature': float(temp) if temp is not None else None,
+            'feels_like': float(feels) if feels is not None else None,
+            'humidity': int(rh) if rh is not None else None,
+            'pressure': int(sp) if sp is not None else None,
+            'weather': cond['description'],
+            'weather_main': cond['main'],
+            'icon': cond['icon'],
+            'wind_speed': float(ws) if ws is not None else None,
+            'wind_direction': int(wd) if wd is not None else None,
+            'visibility': int(vis) if vis is not None else None,
+            'clouds': int(cc) if cc is not None else None,
+            'sunrise': sunrise,
+            'sunset': sunset,
+            'timezone': tz_offset,
+            'dt': int(datetime.utcnow().timestamp()),
+        }
+
+    def _om_forecast(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Map an Open-Meteo forecast response to daily summaries with hours."""
+        from datetime import timedelta
+        hourly = data.get('hourly') or {}
+        daily = data.get('daily') or {}
+        # Build a dict by date with hourly arrays
+        times = hourly.get('time') or []
+        out_days: Dict[str, List[int]] = {}
+        for idx, t in enumerate(times):
+            try:
+                dt = datetime.fromisoformat(str(t).replace('Z', '+00:00'))
+            except Exception:
+                continue
+            date_key = dt.strftime('%Y-%m-%d')
+            out_days.setdefault(date_key, []).append(idx)
+        result_days: List[Dict[str, Any]] = []
+        for date_key, idxs in sorted(out_days.items()):
+            hlist: List[Dict[str, Any]] = []
+            for i in idxs:
+                wc = (hourly.get('weather_code') or [0])[i if i < len(hourly.get('weather_code') or []) else 0]
+                cond = self._om_conditions(wc)
+                try:
+                    ts = int(datetime.fromisoformat(str(times[i]).replace('Z', '+00:00')).timestamp())
+                except Exception:
+                    ts = None
+                hlist.append({
+                    'dt': ts,
+                    'dt_txt': str(times[i]),
+                    'temperature': self._safe_float(hourly.get('temperature_2m'), i),
+                    'feels_like': self._safe_float(hourly.get('apparent_temperature'), i),
+                    'weather': cond['description'],
+                    'weather_main': cond['main'],
+                    'icon': cond['icon'],
+                    'wind_speed': self._safe_float(hourly.get('wind_speed_10m'), i),
+                    'wind_direction': self._safe_int(hourly.get('wind_direction_10m'), i),
+                    'humidity': self._safe_int(hourly.get('relative_humidity_2m'), i),
+                    'pressure': self._safe_int(hourly.get('surface_pressure'), i),
+                    'clouds': self._safe_int(hourly.get('cloudcover'), i),
+                })
+            # Daily min/max from daily arrays
+            try:
+                di = list(out_days.keys()).index(date_key)
+            except ValueError:
+                di = 0
+            tmin = self._safe_float(daily.get('temperature_2m_min'), di)
+            tmax = self._safe_float(daily.get('temperature_2m_max'), di)
+            result_days.append({
+                'date': date_key,
+                'min_temp': tmin,
+                'max_temp': tmax,
+                'hours': hlist,
+            })
+        return {'days': result_days}
 
     # ----------------------------
     # Internal helpers
@@ -119,6 +298,58 @@ class WeatherService:
         except Exception:
             pass
         return None
+
+    def _can_call(self) -> bool:
+        return self.deadline is None or self.deadline.allows_call()
+
+    def _call_timeout(self) -> float:
+        """Timeout for the next call: `timeout_seconds`, capped by the deadline."""
+        if self.deadline is None:
+            return self.timeout_seconds
+        if not self.deadline.allows_call():
+            raise DeadlineExceeded('Request deadline exceeded before calling upstream')
+        return min(self.timeout_seconds, self.deadline.remaining())
+
+    def _http_get(self, provider: str, url: str, params: Dict[str, Any],
+                  headers: Optional[Dict[str, str]] = None) -> requests.Response:
+        """Single choke point for upstream HTTP calls, timed and counted per provider.
+
+        Failed calls are remembered per provider, URL and parameters (see
+        `negative_cache`); repeating one within its TTL raises
+        UpstreamSuppressed without calling out.
+        """
+        started = perf_counter()
+        outcome = 'error'
+        failure_key = negative_cache.request_key(provider, url, params)
+        try:
+            failed = negative_cache.get(failure_key)
+            if failed:
+                outcome = 'suppressed'
+                raise UpstreamSuppressed(f'{provider} request failed recently ({failed}); not retrying yet')
+            timeout = self._call_timeout()
+            with span(provider):
+                resp = requests.get(url, params=params, headers=headers, timeout=timeout)
+            outcome = str(resp.status_code)
+            kind = negative_cache.kind_for_status(resp.status_code)
+            if kind:
+                negative_cache.remember(failure_key, kind)
+            return resp
+        except DeadlineExceeded:
+            outcome = 'deadline'
+            raise
+        except requests.Timeout:
+            outcome = 'timeout'
+            # A timeout shortened by this request's deadline says nothing about the provider
+            if timeout >= self.timeout_seconds:
+                negative_cache.remember(failure_key, negative_cache.TIMEOUT)
+            raise
+        except requests.RequestException:
+            negative_cache.remember(failure_key, negative_cache.CONNECTION_ERROR)
+            raise
+        finally:
+            metrics.UPSTREAM_REQUESTS.inc(provider=provider, status=outcome)
+            metrics.UPSTREAM_LATENCY.observe(perf_counter() - started, provider=provider)
+
     def _handle_response(self, resp: requests.Response) -> Dict[str, Any]:
         """Validate HTTP response and return JSON or raise errors.
 
@@ -151,7 +382,7 @@ class WeatherService:
         safe_params = {**params, 'appid': '***'} if 'appid' in params else params
         logger.debug('GET %s params=%s', url, safe_params)
         try:
-            resp = requests.get(url, params=params, timeout=self.timeout_seconds)
+            resp = self._http_get('openweather', url, params=params)
         except requests.Timeout as exc:
             logger.error('Request timeout: %s', url)
             raise WeatherAPIError('Request to weather API timed out') from exc
@@ -177,56 +408,7 @@ class WeatherService:
         """
         # If no API key, use Open-Meteo to return accurate current-like data
         if not self.api_key:
-            data = self._om_fetch(lat, lon, days=1)
-            tz_offset = 0
-            try:
-                # Open-Meteo returns ISO strings; for dt, use current UTC ts
-                from datetime import timezone as _tz
-                tz_offset = 0
-            except Exception:
-                tz_offset = 0
-            hourly = data.get('hourly') or {}
-            daily = (data.get('daily') or {})
-            # Take first hour as current approximation
-            temp = (hourly.get('temperature_2m') or [None])[0]
-            feels = (hourly.get('apparent_temperature') or [None])[0]
-            rh = (hourly.get('relative_humidity_2m') or [None])[0]
-            sp = (hourly.get('surface_pressure') or [None])[0]
-            wc = (hourly.get('weather_code') or [0])[0]
-            ws = (hourly.get('wind_speed_10m') or [None])[0]
-            wd = (hourly.get('wind_direction_10m') or [None])[0]
-            vis = (hourly.get('visibility') or [None])[0]
-            cc = (hourly.get('cloudcover') or [None])[0]
-            cond = self._om_conditions(wc)
-            # sunrise/sunset for today
-            sunrise = None
-            sunset = None
-            try:
-                sunrise_str = (daily.get('sunrise') or [None])[0]
-                sunset_str = (daily.get('sunset') or [None])[0]
-                if sunrise_str:
-                    sunrise = int(datetime.fromisoformat(sunrise_str.replace('Z', '+00:00')).timestamp())
-                if sunset_str:
-                    sunset = int(datetime.fromisoformat(sunset_str.replace('Z', '+00:00')).timestamp())
-            except Exception:
-                pass
-            return {
-                'temperature': float(temp) if temp is not None else None,
-                'feels_like': float(feels) if feels is not None else None,
-                'humidity': int(rh) if rh is not None else None,
-                'pressure': int(sp) if sp is not None else None,
-                'weather': cond['description'],
-                'weather_main': cond['main'],
-                'icon': cond['icon'],
-                'wind_speed': float(ws) if ws is not None else None,
-                'wind_direction': int(wd) if wd is not None else None,
-                'visibility': int(vis) if vis is not None else None,
-                'clouds': int(cc) if cc is not None else None,
-                'sunrise': sunrise,
-                'sunset': sunset,
-                'timezone': tz_offset,
-                'dt': int(datetime.utcnow().timestamp()),
-            }
+            return self._om_current(self._om_fetch(lat, lon, days=1))
 
         params: Dict[str, Any] = {
             'lat': lat,
@@ -273,58 +455,7 @@ class WeatherService:
         """
         # If no API key, use Open-Meteo forecast and map it to our schema
         if not self.api_key:
-            from datetime import timedelta
-            data = self._om_fetch(lat, lon, days)
-            hourly = data.get('hourly') or {}
-            daily = data.get('daily') or {}
-            # Build a dict by date with hourly arrays
-            times = hourly.get('time') or []
-            out_days: Dict[str, List[int]] = {}
-            for idx, t in enumerate(times):
-                try:
-                    dt = datetime.fromisoformat(str(t).replace('Z', '+00:00'))
-                except Exception:
-                    continue
-                date_key = dt.strftime('%Y-%m-%d')
-                out_days.setdefault(date_key, []).append(idx)
-            result_days: List[Dict[str, Any]] = []
-            for date_key, idxs in sorted(out_days.items()):
-                hlist: List[Dict[str, Any]] = []
-                for i in idxs:
-                    wc = (hourly.get('weather_code') or [0])[i if i < len(hourly.get('weather_code') or []) else 0]
-                    cond = self._om_conditions(wc)
-                    try:
-                        ts = int(datetime.fromisoformat(str(times[i]).replace('Z', '+00:00')).timestamp())
-                    except Exception:
-                        ts = None
-                    hlist.append({
-                        'dt': ts,
-                        'dt_txt': str(times[i]),
-                        'temperature': self._safe_float(hourly.get('temperature_2m'), i),
-                        'feels_like': self._safe_float(hourly.get('apparent_temperature'), i),
-                        'weather': cond['description'],
-                        'weather_main': cond['main'],
-                        'icon': cond['icon'],
-                        'wind_speed': self._safe_float(hourly.get('wind_speed_10m'), i),
-                        'wind_direction': self._safe_int(hourly.get('wind_direction_10m'), i),
-                        'humidity': self._safe_int(hourly.get('relative_humidity_2m'), i),
-                        'pressure': self._safe_int(hourly.get('surface_pressure'), i),
-                        'clouds': self._safe_int(hourly.get('cloudcover'), i),
-                    })
-                # Daily min/max from daily arrays
-                try:
-                    di = list(out_days.keys()).index(date_key)
-                except ValueError:
-                    di = 0
-                tmin = self._safe_float(daily.get('temperature_2m_min'), di)
-                tmax = self._safe_float(daily.get('temperature_2m_max'), di)
-                result_days.append({
-                    'date': date_key,
-                    'min_temp': tmin,
-                    'max_temp': tmax,
-                    'hours': hlist,
-                })
-            return {'days': result_days}
+            return self._om_forecast(self._om_fetch(lat, lon, days))
 
         params: Dict[str, Any] = {
             'lat': lat,
@@ -388,6 +519,22 @@ class WeatherService:
 
         return {'days': daily}
 
+    def get_current_weather_many(self, coords: List[Tuple[float, float]]) -> List[Dict[str, Any]]:
+        """Current weather for several coordinates, in order.
+
+        Without an API key all coordinates share batched Open-Meteo requests;
+        OpenWeather has no multi-location endpoint, so it is called per location.
+        """
+        if not self.api_key:
+            return [self._om_current(data) for data in self._om_fetch_many(list(coords), days=1)]
+        return [self.get_current_weather(lat, lon) for lat, lon in coords]
+
+    def get_forecast_many(self, coords: List[Tuple[float, float]], days: int = 7) -> List[Dict[str, Any]]:
+        """Forecasts for several coordinates, in order (batched like `get_current_weather_many`)."""
+        if not self.api_key:
+            return [self._om_forecast(data) for data in self._om_fetch_many(list(coords), days)]
+        return [self.get_forecast(lat, lon, days=days) for lat, lon in coords]
+
     def search_location(self, query: str, limit: int = 5) -> List[Dict[str, Any]]:
         """Search for cities by name using direct geocoding.
 
@@ -398,8 +545,13 @@ class WeatherService:
         Returns:
             List of dicts with name, country, state (optional), lat, lon.
         """
+        # Queries that found nothing recently are answered from the negative cache
+        empty_key = negative_cache.key('search', bool(self.api_key), query.strip().casefold(), limit)
+        if negative_cache.get(empty_key) == negative_cache.EMPTY:
+            return []
         # If no API key, use Open-Meteo's free geocoding API; if that fails, try Nominatim
         if not self.api_key:
+            failed = False
             # 1) Open-Meteo geocoding
             try:
                 params = {
@@ -408,7 +560,7 @@ class WeatherService:
                     'language': 'en',
                     'format': 'json',
                 }
-                resp = requests.get('https://geocoding-api.open-meteo.com/v1/search', params=params, timeout=self.timeout_seconds)
+                resp = self._http_get('om-geocoding', f'{self.open_meteo_geocoding_url}/v1/search', params=params)
                 resp.raise_for_status()
                 payload = resp.json() or {}
                 out: List[Dict[str, Any]] = []
@@ -423,9 +575,13 @@ class WeatherService:
                 if out:
                     return out[: max(1, min(limit, 10))]
             except Exception:
-                pass
+                failed = True
 
-            # 2) Nominatim (OpenStreetMap) as a secondary fallback (no API key required)
+            # 2) Nominatim (OpenStreetMap) as a secondary fallback (no API key required),
+            # unless the request's budget cannot cover another call
+            if not self._can_call():
+                return []
+            metrics.GEOCODING_FALLBACKS.inc(fallback='nominatim')
             try:
                 nom_params = {
                     'q': query,
@@ -436,7 +592,7 @@ class WeatherService:
                 headers = {
                     'User-Agent': 'WeatherApp/1.0 (+https://example.com)'
                 }
-                nresp = requests.get('https://nominatim.openstreetmap.org/search', params=nom_params, headers=headers, timeout=self.timeout_seconds)
+                nresp = self._http_get('nominatim', f'{self.nominatim_url}/search', params=nom_params, headers=headers)
                 nresp.raise_for_status()
                 ndata = nresp.json() or []
                 out2: List[Dict[str, Any]] = []
@@ -462,9 +618,12 @@ class WeatherService:
                 if out2:
                     return out2[: max(1, min(limit, 10))]
             except Exception:
-                pass
+                failed = True
 
-            # 3) As a last resort, return an empty list (do NOT default to a fixed city)
+            # 3) As a last resort, return an empty list (do NOT default to a fixed city);
+            # remembered only when both providers answered
+            if not failed:
+                negative_cache.remember(empty_key, negative_cache.EMPTY)
             return []
 
         params = {'q': query, 'limit': max(1, min(limit, 10)), 'appid': self.api_key}
@@ -479,6 +638,8 @@ class WeatherService:
                 'lat': item.get('lat'),
                 'lon': item.get('lon'),
             })
+        if not results:
+            negative_cache.remember(empty_key, negative_cache.EMPTY)
         return results
 
     def reverse_geocode(self, lat: float, lon: float) -> Optional[str]:
@@ -491,41 +652,110 @@ class WeatherService:
         Returns:
             The best-matching city name, if available.
         """
+        empty_key = negative_cache.key('reverse', bool(self.api_key), round(float(lat), 4), round(float(lon), 4))
+        nothing_found = negative_cache.get(empty_key) == negative_cache.EMPTY
         # If no API key, try Open-Meteo reverse geocoding; otherwise fallback to coordinate label
         if not self.api_key:
-            try:
-                params = {
-                    'latitude': float(lat),
-                    'longitude': float(lon),
-                    'language': 'en',
-                    'format': 'json',
-                }
-                resp = requests.get('https://geocoding-api.open-meteo.com/v1/reverse', params=params, timeout=self.timeout_seconds)
-                resp.raise_for_status()
-                payload = resp.json() or {}
-                results = payload.get('results') or []
-                if isinstance(results, list) and results:
-                    name = results[0].get('name')
-                    if name:
-                        return str(name)
-            except Exception:
-                pass
+            if not nothing_found:
+                try:
+                    params = {
+                        'latitude': float(lat),
+                        'longitude': float(lon),
+                        'language': 'en',
+                        'format': 'json',
+                    }
+                    resp = self._http_get('om-geocoding', f'{self.open_meteo_geocoding_url}/v1/reverse', params=params)
+                    resp.raise_for_status()
+                    payload = resp.json() or {}
+                    results = payload.get('results') or []
+                    if isinstance(results, list) and results:
+                        name = results[0].get('name')
+                        if name:
+                            return str(name)
+                    negative_cache.remember(empty_key, negative_cache.EMPTY)
+                except Exception:
+                    pass
+            metrics.GEOCODING_FALLBACKS.inc(fallback='coordinates')
             try:
                 return f"{float(lat):.2f},{float(lon):.2f}"
             except Exception:
                 return None
 
+        if nothing_found:
+            metrics.GEOCODING_FALLBACKS.inc(fallback='coordinates')
+            return None
         params = {'lat': lat, 'lon': lon, 'limit': 1, 'appid': self.api_key}
         try:
             data = self._get(f'{self.geo_url}/reverse', params)
         except WeatherAPIError:
             # Fail soft and let caller use coordinate label
+            metrics.GEOCODING_FALLBACKS.inc(fallback='coordinates')
             return None
         except Exception:
+            metrics.GEOCODING_FALLBACKS.inc(fallback='coordinates')
             return None
         payload_list = data if isinstance(data, list) else data.get('data') if isinstance(data, dict) else None
         if isinstance(payload_list, list) and payload_list:
             return payload_list[0].get('name')
+        negative_cache.remember(empty_key, negative_cache.EMPTY)
+        metrics.GEOCODING_FALLBACKS.inc(fallback='coordinates')
         return None
 
 
+class Coalescer:
+    """Group concurrent single-key lookups into batched calls.
+
+    The first caller of a batch waits `window` seconds for others to join,
+    then runs `fetch_many` once for every distinct key (at most `max_batch`)
+    and hands each caller its own result or the batch's exception.
+    """
+
+    def __init__(self, fetch_many: Callable[[List[Any]], List[Any]], window: float, max_batch: int) -> None:
+        self.fetch_many = fetch_many
+        self.window = window
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._pending: Dict[Any, Future] = {}
+        self._full = threading.Event()
+
+    def get(self, key: Any, timeout: Optional[float] = None) -> Any:
+        with self._lock:
+            future = self._pending.get(key)
+            leader = not self._pending
+            if future is None:
+                future = self._pending[key] = Future()
+                if len(self._pending) >= self.max_batch:
+                    self._full.set()
+        if leader:
+            self._full.wait(self.window)
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._full.clear()
+            keys = list(batch)
+            try:
+                results = self.fetch_many(keys)
+            except BaseException as exc:
+                for waiting in batch.values():
+                    waiting.set_exception(exc)
+            else:
+                for k, result in zip(keys, results):
+                    batch[k].set_result(result)
+        return future.result(timeout)
+
+
+_coalescers: Dict[Tuple[str, int], Coalescer] = {}
+_coalescers_lock = threading.Lock()
+
+
+def _coalescer(service: WeatherService, days: int) -> Coalescer:
+    """Process-wide coalescer for Open-Meteo fetches of `days` days."""
+    key = (service.open_meteo_url, days)
+    with _coalescers_lock:
+        coalescer = _coalescers.get(key)
+        if coalescer is None:
+            # Batches outlive the request that starts them, so they get no deadline
+            shared = WeatherService(api_key=service.api_key)
+            coalescer = _coalescers[key] = Coalescer(
+                lambda coords: shared._om_fetch_many(coords, days), service.coalesce_window, service.batch_size,
+            )
+        return coalescer
@@ -0,0 +1,109 @@
+from __future__ import annotations
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Location, UserPreferences
+
+
+# A session's saved locations and preferences, loaded together and kept in the
+# Django cache for SESSION_CONTEXT_TTL seconds so the API endpoints find them
+# without querying. Views that write either table call `invalidate()`; writes
+# made elsewhere (admin, management commands) show up once the TTL expires.
+# With several worker processes CACHES must point at a shared backend
+# (CACHE_URL), otherwise one worker's invalidation is not seen by the others.
+
+_LAT = Location._meta.get_field('latitude')
+_LON = Location._meta.get_field('longitude')
+
+
+def _coord(field, value) -> Decimal:
+    """Coordinate as stored in `field` (Decimal rounded to its decimal places)."""
+    return field.to_python(value).quantize(Decimal(1).scaleb(-field.decimal_places))
+
+
+def coord_key(lat, lon) -> Tuple[Decimal, Decimal]:
+    """(latitude, longitude) as stored on Location, for matching coordinates."""
+    return _coord(_LAT, lat), _coord(_LON, lon)
+
+
+def _key(session_id: str) -> str:
+    return f'session-context:{session_id}'
+
+
+class SessionContext:
+    __slots__ = ('session_id', 'locations', 'preferences', 'fresh', '_by_coords')
+
+    def __init__(self, session_id: str, locations: List[Location], preferences: Optional[UserPreferences]) -> None:
+        self.session_id = session_id
+        # Model default ordering: favorites first, newest first
+        self.locations = locations
+        self.preferences = preferences
+        # True only for a context just read from the database (not pickled)
+        self.fresh = False
+        self._by_coords: Dict[Tuple[Decimal, Decimal], Location] = {
+            coord_key(loc.latitude, loc.longitude): loc for loc in locations
+        }
+
+    @classmethod
+    def load(cls, session_id: str, fresh: bool = False) -> 'SessionContext':
+        """Cached context for `session_id`, read from the database on a miss or when `fresh`."""
+        key = _key(session_id)
+        ctx = None if fresh else cache.get(key)
+        if ctx is None:
+            ctx = cls(
+                session_id,
+                list(Location.objects.filter(user_id=session_id).order_by('-is_favorite', '-created_at')),
+                UserPreferences.objects.filter(session_id=session_id).first(),
+            )
+            cache.set(key, ctx, settings.SESSION_CONTEXT_TTL)
+            ctx.fresh = True
+        return ctx
+
+    def __getstate__(self) -> Tuple[str, List[Location], Optional[UserPreferences]]:
+        return self.session_id, self.locations, self.preferences
+
+    def __setstate__(self, state: Tuple[str, List[Location], Optional[UserPreferences]]) -> None:
+        self.__init__(*state)  # type: ignore[misc]
+
+    def locations_stamp(self) -> Tuple[int, Optional[datetime]]:
+        """(count, latest updated_at) of the locations, to compare with the database."""
+        return len(self.locations), max((loc.updated_at for loc in self.locations), default=None)
+
+    def location_at(self, lat: float, lon: float) -> Optional[Location]:
+        return self._by_coords.get(coord_key(lat, lon))
+
+    def location(self, location_id: int) -> Optional[Location]:
+        for loc in self.locations:
+            if loc.id == location_id:
+                return loc
+        return None
+
+
+def location_at(session_id: str, lat: float, lon: float) -> Optional[Location]:
+    """The session's location at (lat, lon); a miss is confirmed against the database."""
+    ctx = SessionContext.load(session_id)
+    loc = ctx.location_at(lat, lon)
+    if loc is None and not ctx.fresh:
+        loc = SessionContext.load(session_id, fresh=True).location_at(lat, lon)
+    return loc
+
+
+def location(session_id: str, location_id: int) -> Optional[Location]:
+    """The session's location `location_id`; a miss is confirmed against the database."""
+    ctx = SessionContext.load(session_id)
+    loc = ctx.location(location_id)
+    if loc is None and not ctx.fresh:
+        loc = SessionContext.load(session_id, fresh=True).location(location_id)
+    return loc
+
+
+def invalidate(session_id: str) -> None:
+    cache.delete(_key(session_id))
+
+
+def invalidate_many(session_ids: List[str]) -> None:
+    cache.delete_many([_key(session_id) for session_id in session_ids])
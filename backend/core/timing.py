@@ -0,0 +1,64 @@
+from __future__ import annotations
+from contextvars import ContextVar, Token
+from time import perf_counter
+from typing import Any, Dict, Optional
+
+
+class Timings:
+    """Accumulated wall time per phase (seconds) for one request."""
+
+    __slots__ = ('started', 'phases')
+
+    def __init__(self) -> None:
+        self.started = perf_counter()
+        self.phases: Dict[str, float] = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def elapsed(self) -> float:
+        return perf_counter() - self.started
+
+
+_current: ContextVar[Optional[Timings]] = ContextVar('request_timings', default=None)
+
+
+def begin() -> Token:
+    """Start collecting timings for the current request (or task)."""
+    return _current.set(Timings())
+
+
+def end(token: Token) -> Optional[Timings]:
+    timings = _current.get()
+    _current.reset(token)
+    return timings
+
+
+def current() -> Optional[Timings]:
+    return _current.get()
+
+
+class span:
+    """Time a block under `name` when a request is being timed.
+
+    With no active `Timings` this costs a single context-variable lookup, so
+    spans can stay in hot paths permanently:
+
+        with span('cache'):
+            entry = WeatherCache.objects.filter(...).first()
+    """
+
+    __slots__ = ('name', 'timings', 'started')
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __enter__(self) -> 'span':
+        self.timings = _current.get()
+        if self.timings is not None:
+            self.started = perf_counter()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        if self.timings is not None:
+            self.timings.add(self.name, perf_counter() - self.started)
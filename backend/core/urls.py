@@ -0,0 +1,7 @@
+from django.urls import path
+from . import views
+
+urlpatterns = [
+    path('', views.profile_list, name='profile_list'),
+    path('<str:name>', views.profile_download, name='profile_download'),
+]
@@ -1,6 +1,22 @@
 from __future__ import annotations
-from math import atan2, degrees
-from typing import Optional
+from math import atan2, degrees, log
+from typing import Any, Dict, List, Optional
+
+
+ICON_NAMES = {
+    '01d': 'clear-day', '01n': 'clear-night',
+    '02d': 'partly-cloudy-day', '02n': 'partly-cloudy-night',
+    '03d': 'cloudy', '03n': 'cloudy',
+    '04d': 'overcast', '04n': 'overcast',
+    '09d': 'showers', '09n': 'showers',
+    '10d': 'rain', '10n': 'rain',
+    '11d': 'thunderstorm', '11n': 'thunderstorm',
+    '13d': 'snow', '13n': 'snow',
+    '50d': 'mist', '50n': 'mist',
+}
+
+COMPASS_POINTS = ('N', 'NNE', 'NE', 'ENE', 'E', 'ESE', 'SE', 'SSE',
+                  'S', 'SSW', 'SW', 'WSW', 'W', 'WNW', 'NW', 'NNW')
 
 
 def get_weather_icon_name(icon_code: str) -> str:
@@ -9,18 +25,7 @@ def get_weather_icon_name(icon_code: str) -> str:
     Examples: '01d' -> 'clear-day', '01n' -> 'clear-night'
     Fallback returns the original code if no mapping exists.
     """
-    mapping = {
-        '01d': 'clear-day', '01n': 'clear-night',
-        '02d': 'partly-cloudy-day', '02n': 'partly-cloudy-night',
-        '03d': 'cloudy', '03n': 'cloudy',
-        '04d': 'overcast', '04n': 'overcast',
-        '09d': 'showers', '09n': 'showers',
-        '10d': 'rain', '10n': 'rain',
-        '11d': 'thunderstorm', '11n': 'thunderstorm',
-        '13d': 'snow', '13n': 'snow',
-        '50d': 'mist', '50n': 'mist',
-    }
-    return mapping.get((icon_code or '').strip(), icon_code or '')
+    return ICON_NAMES.get((icon_code or '').strip(), icon_code or '')
 
 
 def calculate_heat_index(temp_c: float, humidity: float) -> Optional[float]:
@@ -54,9 +59,77 @@ def format_wind_direction(degrees_value: float) -> str:
         deg = float(degrees_value) % 360.0
     except (TypeError, ValueError):
         return 'N'
-    dirs = ['N', 'NNE', 'NE', 'ENE', 'E', 'ESE', 'SE', 'SSE',
-            'S', 'SSW', 'SW', 'WSW', 'W', 'WNW', 'NW', 'NNW']
     idx = int((deg + 11.25) // 22.5) % 16
-    return dirs[idx]
+    return COMPASS_POINTS[idx]
+
+
+def weather_records(value: Any) -> List[Dict[str, Any]]:
+    """Every dict carrying measurements in a weather payload.
+
+    Covers current conditions, forecast days and their hours, whether `value`
+    is a single dict, a list of days or a `{'days': [...]}` forecast.
+    """
+    records: List[Dict[str, Any]] = []
+    stack = [value]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, list):
+            stack.extend(item)
+        elif isinstance(item, dict):
+            records.append(item)
+            for nested in ('days', 'hours'):
+                if isinstance(item.get(nested), list):
+                    stack.append(item[nested])
+    return records
+
+
+def _number(value: Any) -> Optional[float]:
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+
+def enrich_weather(value: Any) -> Any:
+    """Add derived metrics to every measurement record of `value`, in place.
+
+    Works column-wise over all records at once:
+      - heat_index (°C): Rothfusz regression, only where it applies (>= 26.7 °C, >= 40% RH)
+      - dew_point (°C): Magnus formula
+      - wind_chill (°C): NWS formula, only for <= 10 °C and wind > 4.8 km/h
+      - wind_compass: 16-point direction from wind_direction
+      - icon_name: descriptive name for the OpenWeather-style icon code
+    Records without the inputs get None. Day summaries, which carry no
+    measurements of their own, are left as they are.
+    """
+    rows = [r for r in weather_records(value) if 'temperature' in r]
+    if not rows:
+        return value
+    temps = [_number(r.get('temperature')) for r in rows]
+    humidity = [_number(r.get('humidity')) for r in rows]
+    wind_kmh = [None if w is None else w * 3.6 for w in (_number(r.get('wind_speed')) for r in rows)]
+    directions = [_number(r.get('wind_direction')) for r in rows]
 
+    heat_index = [
+        calculate_heat_index(t, rh) if t is not None and rh is not None and t >= 26.7 and rh >= 40 else None
+        for t, rh in zip(temps, humidity)
+    ]
+    dew_point = []
+    for t, rh in zip(temps, humidity):
+        if t is None or rh is None or rh <= 0:
+            dew_point.append(None)
+            continue
+        gamma = log(rh / 100.0) + 17.62 * t / (243.12 + t)
+        dew_point.append(round(243.12 * gamma / (17.62 - gamma), 2))
+    wind_chill = [
+        round(13.12 + 0.6215 * t - 11.37 * v ** 0.16 + 0.3965 * t * v ** 0.16, 2)
+        if t is not None and v is not None and t <= 10.0 and v > 4.8 else None
+        for t, v in zip(temps, wind_kmh)
+    ]
+    compass = [None if d is None else COMPASS_POINTS[int((d % 360.0 + 11.25) // 22.5) % 16] for d in directions]
+    icons = [ICON_NAMES.get(str(r.get('icon') or '').strip()) for r in rows]
 
+    for row, hi, dp, wc, cp, icon in zip(rows, heat_index, dew_point, wind_chill, compass, icons):
+        row['heat_index'] = hi
+        row['dew_point'] = dp
+        row['wind_chill'] = wc
+        row['wind_compass'] = cp
+        row['icon_name'] = icon
+    return value
@@ -0,0 +1,19 @@
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import FileResponse, Http404, HttpRequest, HttpResponse, JsonResponse
+
+from . import profiling
+
+
+@staff_member_required
+def profile_list(request: HttpRequest) -> HttpResponse:
+    """Stored request profiles, newest first."""
+    return JsonResponse({'profiles': profiling.list_profiles()})
+
+
+@staff_member_required
+def profile_download(request: HttpRequest, name: str) -> HttpResponse:
+    path = profiling.profile_path(name)
+    if path is None:
+        raise Http404('Unknown profile')
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=name,
+                        content_type='application/octet-stream')
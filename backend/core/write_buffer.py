@@ -0,0 +1,204 @@
+from __future__ import annotations
+import atexit
+import logging
+import threading
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import metrics
+from . import routers
+from . import session_context
+from .models import Location, WeatherCache
+from .session_context import coord_key
+
+
+# Write-behind for the rows weather GETs insert (WRITE_BEHIND_ENABLED).
+#
+# New Location rows and WeatherCache entries are kept in memory and become
+# visible to this process's lookups at once (`location()`, `latest_cache()`).
+# A background thread bulk-inserts them every WRITE_BEHIND_FLUSH_SECONDS, or
+# sooner once WRITE_BEHIND_MAX_PENDING rows are waiting, and the buffer is
+# flushed at interpreter exit. Location inserts ignore conflicts with the
+# (user_id, latitude, longitude) unique constraint, so a row another worker
+# or an API write created first is reused. Only the newest pending entry per
+# location and cache type is written; older ones were already superseded.
+
+LocationKey = Tuple[str, Decimal, Decimal]
+
+logger = logging.getLogger(__name__)
+
+
+def _location_key(user_id: str, lat, lon) -> LocationKey:
+    return (user_id, *coord_key(lat, lon))
+
+
+class WriteBuffer:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # Serializes flushes (timer thread, size threshold, exit)
+        self._flush_lock = threading.Lock()
+        self._locations: Dict[LocationKey, Location] = {}
+        self._caches: Dict[Tuple[LocationKey, str], WeatherCache] = {}
+        # Rows taken by the running flush, still visible until committed
+        self._flushing_locations: Dict[LocationKey, Location] = {}
+        self._flushing_caches: Dict[Tuple[LocationKey, str], WeatherCache] = {}
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __len__(self) -> int:
+        return len(self._locations) + len(self._caches)
+
+    def location(self, user_id: str, lat: float, lon: float) -> Optional[Location]:
+        """Pending (unsaved or just flushed) location of `user_id` at (lat, lon)."""
+        key = _location_key(user_id, lat, lon)
+        with self._lock:
+            return self._locations.get(key) or self._flushing_locations.get(key)
+
+    def add_location(self, loc: Location) -> Location:
+        """Queue an unsaved location; returns the one already queued for its key, if any."""
+        key = _location_key(loc.user_id, loc.latitude, loc.longitude)
+        with self._lock:
+            loc = self._locations.setdefault(key, self._flushing_locations.get(key) or loc)
+        self._added()
+        return loc
+
+    def latest_cache(self, loc: Location, cache_type: str) -> Optional[WeatherCache]:
+        key = (_location_key(loc.user_id, loc.latitude, loc.longitude), cache_type)
+        with self._lock:
+            return self._caches.get(key) or self._flushing_caches.get(key)
+
+    def add_cache(self, entry: WeatherCache) -> None:
+        """Queue an unsaved cache entry; it replaces any pending one for the same location and type."""
+        # Set now so validators and TTLs work before the insert (which stamps it again)
+        entry.cached_at = entry.cached_at or timezone.now()
+        loc = entry.location
+        key = (_location_key(loc.user_id, loc.latitude, loc.longitude), entry.cache_type)
+        with self._lock:
+            self._caches[key] = entry
+        self._added()
+
+    def _added(self) -> None:
+        if len(self) >= settings.WRITE_BEHIND_MAX_PENDING:
+            if settings.WRITE_BEHIND_FLUSH_SECONDS > 0:
+                self._wake.set()
+            else:
+                self.flush()
+        self._start()
+
+    def _start(self) -> None:
+        if self._thread is not None or settings.WRITE_BEHIND_FLUSH_SECONDS <= 0:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(settings.WRITE_BEHIND_FLUSH_SECONDS)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Write-behind flush failed')
+            finally:
+                close_old_connections()
+
+    def flush(self) -> Tuple[int, int]:
+        """Insert everything pending; returns (locations, cache entries) written.
+
+        On a database error the rows are queued again (behind newer ones) and
+        the error is raised. Its reads go to the primary: replicas cannot see
+        the rows inserted in the flush's own transaction.
+        """
+        with self._flush_lock, routers.pin_primary():
+            with self._lock:
+                self._flushing_locations, self._locations = self._locations, {}
+                self._flushing_caches, self._caches = self._caches, {}
+            locations = list(self._flushing_locations.values())
+            entries = list(self._flushing_caches.values())
+            if not locations and not entries:
+                return 0, 0
+            unsaved = [loc for loc in locations if loc.pk is None]
+            try:
+                with transaction.atomic():
+                    created = self._insert_locations(unsaved)
+                    # Drop entries whose location was deleted since it was buffered
+                    pks = {e.location.pk for e in entries} - {None}
+                    live = set(Location.objects.filter(pk__in=pks).values_list('pk', flat=True)) if pks else set()
+                    saved = [e for e in entries if e.location.pk in live]
+                    for entry in saved:
+                        entry.location = entry.location  # picks up pks assigned above
+                    WeatherCache.objects.bulk_create(saved)
+            except Exception:
+                for loc in unsaved:
+                    loc.pk = None  # rolled back
+                with self._lock:
+                    for key, loc in self._flushing_locations.items():
+                        self._locations.setdefault(key, loc)
+                    for key, entry in self._flushing_caches.items():
+                        self._caches.setdefault(key, entry)
+                metrics.WRITE_BEHIND_ROWS.inc(len(locations), model='location', outcome='retried')
+                metrics.WRITE_BEHIND_ROWS.inc(len(entries), model='weathercache', outcome='retried')
+                raise
+            finally:
+                with self._lock:
+                    self._flushing_locations, self._flushing_caches = {}, {}
+        for session_id in {loc.user_id for loc in locations} - {Location.SHARED_USER_ID}:
+            session_context.invalidate(session_id)
+        metrics.WRITE_BEHIND_ROWS.inc(created, model='location', outcome='inserted')
+        metrics.WRITE_BEHIND_ROWS.inc(len(saved), model='weathercache', outcome='inserted')
+        # Entries whose location was deleted before it could be written
+        metrics.WRITE_BEHIND_ROWS.inc(len(entries) - len(saved), model='weathercache', outcome='dropped')
+        return created, len(saved)
+
+    def _insert_locations(self, unsaved: List[Location]) -> int:
+        """Insert unsaved locations, reusing existing keys, and give every one its pk.
+
+        Returns how many rows were created; a row another writer inserted
+        between the lookup and the insert is reused but counted as created.
+        """
+        if not unsaved:
+            return 0
+        existing = _pks(unsaved)
+        for loc in unsaved:
+            loc.pk = existing.get(_location_key(loc.user_id, loc.latitude, loc.longitude))
+        new = [loc for loc in unsaved if loc.pk is None]
+        if not new:
+            return 0
+        Location.objects.bulk_create(new, ignore_conflicts=True)
+        # ignore_conflicts leaves pks unset; read them back by the unique key
+        pks = _pks(new)
+        for loc in new:
+            loc.pk = pks.get(_location_key(loc.user_id, loc.latitude, loc.longitude))
+        return sum(loc.pk is not None for loc in new)
+
+
+def _pks(locations: Iterable[Location], chunk: int = 200) -> Dict[LocationKey, int]:
+    keys = [(loc.user_id, loc.latitude, loc.longitude) for loc in locations]
+    pks: Dict[LocationKey, int] = {}
+    for i in range(0, len(keys), chunk):
+        query = reduce(or_, (Q(user_id=u, latitude=lat, longitude=lon) for u, lat, lon in keys[i:i + chunk]))
+        for pk, user_id, lat, lon in Location.objects.filter(query).values_list('pk', 'user_id', 'latitude', 'longitude'):
+            pks[_location_key(user_id, lat, lon)] = pk
+    return pks
+
+
+buffer = WriteBuffer()
+
+
+def _flush_at_exit() -> None:
+    try:
+        buffer.flush()
+    except Exception:
+        logger.exception('Write-behind flush at exit failed')
+
+
+atexit.register(_flush_at_exit)
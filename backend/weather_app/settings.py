@@ -2,6 +2,8 @@ import os
 from pathlib import Path
 from dotenv import load_dotenv
 
+from .database import parse_cache_url, parse_database_url
+
 # Load environment variables
 BASE_DIR = Path(__file__).resolve().parent.parent
 ENV_PATH = BASE_DIR / '.env'
@@ -32,15 +34,33 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'api.middleware.ServerTimingMiddleware',
+    'api.middleware.MetricsMiddleware',
+    'api.middleware.ReplicaPinMiddleware',
+    'api.middleware.JSONCompressionMiddleware',
+    # Runs SITE_MIDDLEWARE for everything outside API_PATH_PREFIX
+    'api.middleware.SiteOnlyMiddleware',
     'corsheaders.middleware.CorsMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
+    # Keep last: it runs the view itself when profiling
+    'api.middleware.ProfilingMiddleware',
+]
+
+# Only needed by the admin and static files: the JSON API uses its own
+# session_id cookie, never reads request.user and is not CSRF-protected (no
+# session authentication). Built lazily on the first non-API request.
+SITE_MIDDLEWARE = [
+    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
+API_PATH_PREFIX = '/api/'
+# The admin's checks only look at MIDDLEWARE; its requirements are met
+# through SITE_MIDDLEWARE above
+SILENCED_SYSTEM_CHECKS = ['admin.E408', 'admin.E409', 'admin.E410']
 
 ROOT_URLCONF = 'weather_app.urls'
 
@@ -63,15 +83,62 @@ TEMPLATES = [
 WSGI_APPLICATION = 'weather_app.wsgi.application'
 ASGI_APPLICATION = 'weather_app.asgi.application'
 
-# Database: use sqlite by default; parse DATABASE_URL for extensibility
-# Supports simple 'sqlite:///db.sqlite3'
+# Database: DATABASE_URL (sqlite:///db.sqlite3 by default, or postgres://...)
 DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///db.sqlite3')
-DB_PATH = DATABASE_URL.replace('sqlite:///', '')
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': str(BASE_DIR / DB_PATH),
+DATABASES = {'default': parse_database_url(DATABASE_URL, BASE_DIR)}
+# Keep connections open between requests (seconds; 0 closes after each
+# request) and check them before reuse so a dropped server connection is
+# replaced transparently
+DATABASES['default']['CONN_MAX_AGE'] = int(os.getenv('DB_CONN_MAX_AGE', '60'))
+DATABASES['default']['CONN_HEALTH_CHECKS'] = os.getenv('DB_CONN_HEALTH_CHECKS', 'True') == 'True'
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # Seconds a writer waits for the file lock before "database is locked"
+    DATABASES['default']['OPTIONS'].setdefault('timeout', int(os.getenv('SQLITE_BUSY_TIMEOUT', '20')))
+
+# Read replicas: comma-separated DATABASE_URLs, registered as replica1,
+# replica2, ... Read-only ORM traffic is spread over them by
+# core.routers.ReplicaRouter; a client is pinned to the primary for
+# REPLICA_PIN_SECONDS after each write so it always reads its own changes
+REPLICA_DATABASES = []
+for _i, _url in enumerate(u.strip() for u in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if u.strip()):
+    _alias = f'replica{_i + 1}'
+    DATABASES[_alias] = {
+        **parse_database_url(_url, BASE_DIR),
+        'CONN_MAX_AGE': DATABASES['default']['CONN_MAX_AGE'],
+        'CONN_HEALTH_CHECKS': DATABASES['default']['CONN_HEALTH_CHECKS'],
+        'TEST': {'MIRROR': 'default'},
     }
+    REPLICA_DATABASES.append(_alias)
+DATABASE_ROUTERS = ['core.routers.ReplicaRouter']
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', '10'))
+
+# Django cache: 'locmem://' (default, per process), 'redis://host:6379/0'
+# (needs the redis package) or 'dummy://'. Use a shared backend when running
+# several workers so cache invalidations reach all of them
+CACHE_URL = os.getenv('CACHE_URL', 'locmem://')
+CACHES = {'default': parse_cache_url(CACHE_URL)}
+
+# Seconds a session's locations and preferences stay cached between writes
+SESSION_CONTEXT_TTL = int(os.getenv('SESSION_CONTEXT_TTL', '300'))
+
+# Write-behind for the inserts weather GETs make (new Location rows and
+# WeatherCache entries): buffered per process and bulk-inserted every
+# WRITE_BEHIND_FLUSH_SECONDS, once WRITE_BEHIND_MAX_PENDING rows are waiting,
+# and at exit. Off by default; rows reach the database (and other workers)
+# up to one flush interval late.
+WRITE_BEHIND_ENABLED = os.getenv('WRITE_BEHIND_ENABLED', 'False') == 'True'
+WRITE_BEHIND_FLUSH_SECONDS = float(os.getenv('WRITE_BEHIND_FLUSH_SECONDS', '1'))
+WRITE_BEHIND_MAX_PENDING = int(os.getenv('WRITE_BEHIND_MAX_PENDING', '500'))
+
+# Applied to every new SQLite connection (core.db.configure_sqlite): WAL lets
+# readers proceed while a cache write is in progress, NORMAL sync is safe with
+# WAL, and mmap serves reads from the page cache
+SQLITE_PRAGMAS = {
+    'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT', '20')) * 1000,
+    'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024))),
+    'temp_store': 'MEMORY',
 }
 
 # Password validation
@@ -127,9 +194,97 @@ REST_FRAMEWORK = {
     'DEFAULT_PARSER_CLASSES': [
         'rest_framework.parsers.JSONParser',
     ],
+    # API requests skip the auth middleware, so there is no request.user
+    'DEFAULT_AUTHENTICATION_CLASSES': [],
+    'UNAUTHENTICATED_USER': None,
 }
 
 # External API keys
 OPENWEATHER_API_KEY = os.getenv('OPENWEATHER_API_KEY', '')
 
+# Upstream budget per request (weather and search endpoints): every provider
+# call's timeout is capped by what is left of it and fallbacks that cannot
+# start in time are skipped, so endpoint latency stays under this ceiling
+UPSTREAM_DEADLINE_SECONDS = float(os.getenv('UPSTREAM_DEADLINE_SECONDS', '8'))
 
+# Admission control (core.admission): at most UPSTREAM_MAX_CONCURRENCY
+# upstream-bound requests per process (0 disables); others wait up to
+# UPSTREAM_QUEUE_TIMEOUT_MS for a slot, then get an expired cache entry or a
+# 503 with `Retry-After: UPSTREAM_RETRY_AFTER`. Cache hits never wait.
+UPSTREAM_MAX_CONCURRENCY = int(os.getenv('UPSTREAM_MAX_CONCURRENCY', '8'))
+UPSTREAM_QUEUE_TIMEOUT_MS = int(os.getenv('UPSTREAM_QUEUE_TIMEOUT_MS', '500'))
+UPSTREAM_RETRY_AFTER = int(os.getenv('UPSTREAM_RETRY_AFTER', '5'))
+
+# Per-client rate limits (api.ratelimit), token buckets per client IP and per
+# session cookie: every weather/search request takes a HIT token (RATE per
+# second, up to BURST saved), requests that go upstream also take a MISS token.
+# Exceeding either returns 429 with Retry-After. The client IP is REMOTE_ADDR,
+# or, behind RATE_LIMIT_TRUSTED_PROXIES proxies that each append the peer they
+# saw to X-Forwarded-For (1 on Render), the entry that many hops from the right.
+# RATE_LIMIT_BACKEND: 'memory' (per process) or 'cache' (CACHES, shared).
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'False') == 'True'
+RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'memory')
+RATE_LIMIT_TRUSTED_PROXIES = int(os.getenv('RATE_LIMIT_TRUSTED_PROXIES', '0'))
+RATE_LIMIT_HIT_RATE = float(os.getenv('RATE_LIMIT_HIT_RATE', '10'))
+RATE_LIMIT_HIT_BURST = float(os.getenv('RATE_LIMIT_HIT_BURST', '100'))
+RATE_LIMIT_MISS_RATE = float(os.getenv('RATE_LIMIT_MISS_RATE', '0.5'))
+RATE_LIMIT_MISS_BURST = float(os.getenv('RATE_LIMIT_MISS_BURST', '30'))
+
+# Seconds a failed upstream call (same provider, URL and parameters) is not
+# retried, by failure kind; searches and reverse geocodes that found nothing
+# are remembered for UPSTREAM_NEGATIVE_TTL_EMPTY. 0 disables a kind. Shared
+# across workers through CACHES. Timeouts count only when the call had the
+# full timeout, not one shortened by the request deadline; connection errors
+# (refused, reset, DNS) use UPSTREAM_NEGATIVE_TTL_CONNECTION.
+UPSTREAM_NEGATIVE_TTL_4XX = int(os.getenv('UPSTREAM_NEGATIVE_TTL_4XX', '300'))
+UPSTREAM_NEGATIVE_TTL_5XX = int(os.getenv('UPSTREAM_NEGATIVE_TTL_5XX', '30'))
+UPSTREAM_NEGATIVE_TTL_TIMEOUT = int(os.getenv('UPSTREAM_NEGATIVE_TTL_TIMEOUT', '15'))
+UPSTREAM_NEGATIVE_TTL_CONNECTION = int(os.getenv('UPSTREAM_NEGATIVE_TTL_CONNECTION', '5'))
+UPSTREAM_NEGATIVE_TTL_EMPTY = int(os.getenv('UPSTREAM_NEGATIVE_TTL_EMPTY', '600'))
+
+# API responses: payloads with at least this many items (forecast hours or
+# saved locations) are streamed instead of rendered into a single buffer
+API_STREAM_MIN_ITEMS = int(os.getenv('API_STREAM_MIN_ITEMS', '48'))
+
+# Seconds a shared cache may keep serving an expired weather response while it
+# revalidates in the background (Cache-Control: stale-while-revalidate)
+API_STALE_WHILE_REVALIDATE = int(os.getenv('API_STALE_WHILE_REVALIDATE', '60'))
+
+# JSON responses at least this large are gzip-compressed; cached weather bodies
+# are compressed once when the cache entry is written
+API_COMPRESS_MIN_BYTES = int(os.getenv('API_COMPRESS_MIN_BYTES', '1024'))
+API_COMPRESS_LEVEL = int(os.getenv('API_COMPRESS_LEVEL', '6'))
+
+# Per-request phase timings: Server-Timing header plus one JSON log line per
+# request on the `api.timing` logger
+REQUEST_TIMING_ENABLED = os.getenv('REQUEST_TIMING_ENABLED', 'False') == 'True'
+
+# Prometheus-style metrics at /api/metrics/. With several worker processes set
+# METRICS_DIR to a directory shared by all of them (one per host); each worker
+# writes a snapshot there every METRICS_FLUSH_SECONDS and scrapes sum them.
+# When METRICS_TOKEN is set, scrapes must send `Authorization: Bearer <token>`;
+# without it only direct (unproxied) loopback requests are served.
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', '1'))
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Request profiling: a PROFILING_SAMPLE_RATE fraction of requests, plus any
+# request sending `X-Profile: <token>` (manage.py profile_token), is run under
+# cProfile. Captures go to PROFILING_DIR, keeping the newest
+# PROFILING_MAX_FILES, and staff can download them from /admin/profiles/.
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'False') == 'True'
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', '0'))
+PROFILING_DIR = os.getenv('PROFILING_DIR', str(BASE_DIR / 'profiles'))
+PROFILING_MAX_FILES = int(os.getenv('PROFILING_MAX_FILES', '50'))
+PROFILING_TOKEN_MAX_AGE = int(os.getenv('PROFILING_TOKEN_MAX_AGE', '3600'))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api.timing': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
@@ -2,6 +2,8 @@ from django.contrib import admin
 from django.urls import include, path
 
 urlpatterns = [
+    # Staff-only request profiles; must precede the admin catch-all
+    path('admin/profiles/', include('core.urls')),
     path('admin/', admin.site.urls),
     path('api/', include('api.urls')),
 ]